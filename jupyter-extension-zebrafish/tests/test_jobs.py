@@ -0,0 +1,38 @@
+import importlib.util
+import os
+
+from zebrafish.core import Processor
+
+#jobs.py is loaded alone, the package imports the notebook server
+JOBS_PATH = os.path.join(os.path.dirname(__file__), '..', 'zebrafish_on_jupyter', 'jobs.py')
+spec = importlib.util.spec_from_file_location('zebrafish_jobs', JOBS_PATH)
+jobs = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(jobs)
+
+
+def touch(directory, name):
+    path = os.path.join(str(directory), name)
+    open(path, 'w').close()
+    return path
+
+
+def test_get_file_paths_lists_inputs_only(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'tracked_data').mkdir()
+    for name in ['fish.mp4', 'fish_detection.csv', 'fish_detection_post.csv', 'other_detection.xlsx',
+                 'fish_detection.csv.manifest.json', '.zebrafish_catalog.sqlite', '.hidden.mp4',
+                 'notes.txt', 'README']:
+        touch(data_dir, name)
+    manager = jobs.JobManager(str(tmp_path))
+    file_paths = manager.get_file_paths(data_files_dir='data')
+    assert [os.path.basename(p) for p in file_paths] == ['fish.mp4', 'fish_detection.csv',
+                                                         'fish_detection_post.csv', 'other_detection.xlsx']
+
+
+def test_pipeline_job_inputs_are_deduplicated(tmp_path):
+    file_paths = [touch(tmp_path, name) for name in ['a_detection.csv', 'a_detection.xlsx', 'b_detection.xlsx',
+                                                     'c.mp4', 'c_detection.csv', 'c_detection.xlsx']]
+    paths = jobs.get_job_file_paths(Processor(), 'pipeline', file_paths)
+    #csv over xlsx, detection data of c runs with its video
+    assert [os.path.basename(p) for p in paths] == ['c.mp4', 'a_detection.csv', 'b_detection.xlsx']
@@ -0,0 +1,60 @@
+/**
+ * Client of the zebrafish progress websocket of the server extension
+ * (<base_url>/zebrafish/api/progress): job changes and throttled frame progress.
+ */
+import urljoin from "url-join";
+
+export interface StageProgress {
+  stage: "detection" | "tracking" | "render";
+  done: number;
+  total: number | null;
+  fps: number | null;
+  eta_s: number | null;
+  finished: boolean;
+}
+
+export interface ProgressMessage extends StageProgress {
+  type: "progress";
+  job_id: string;
+  file: string | null;
+  file_idx?: number;
+  elapsed_s: number;
+}
+
+export interface JobMessage {
+  type: "job";
+  job: {
+    id: string;
+    kind: string;
+    state: string;
+    nb_files: number;
+    nb_files_done: number;
+    current_file: string | null;
+    progress: number;
+    stage_progress: StageProgress | null;
+    error: string | null;
+    [key: string]: any;
+  };
+}
+
+export type ZebrafishMessage = ProgressMessage | JobMessage;
+
+export function connectProgressStream(
+  config: { baseUrl: string; token: string },
+  onMessage: (message: ZebrafishMessage) => void
+): WebSocket {
+  const wsOrigin: string = location.origin.replace(/^http/, "ws");
+  let url: string = urljoin(
+    wsOrigin,
+    config.baseUrl,
+    "zebrafish/api/progress"
+  );
+  if (config.token) {
+    url = `${url}?token=${encodeURIComponent(config.token)}`;
+  }
+  const socket = new WebSocket(url);
+  socket.onmessage = (event: MessageEvent) => {
+    onMessage(JSON.parse(event.data));
+  };
+  return socket;
+}
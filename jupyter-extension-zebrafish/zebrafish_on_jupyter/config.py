@@ -1,4 +1,4 @@
-from traitlets import HasTraits, Unicode, Bool
+from traitlets import HasTraits, Unicode, Bool, Integer
 from traitlets.config import Configurable
 
 
@@ -19,3 +19,5 @@ class NteractConfig(Configurable):
     asset_url = Unicode('', config=True, help='Remote URL for loading assets')
 
     ga_code = Unicode('', config=True, help="Google Analytics tracking code")
+
+    max_job_workers = Integer(2, config=True, help='Number of detection / post jobs run at the same time')
@@ -1,12 +1,13 @@
 import json
 import os
-from tornado import web
+from tornado import web, websocket
 
 HTTPError = web.HTTPError
 
 import notebook
 
-from notebook.base.handlers import IPythonHandler, FileFindHandler, FilesRedirectHandler, path_regex
+from notebook.base.handlers import IPythonHandler, APIHandler, FileFindHandler, FilesRedirectHandler, path_regex
+from notebook.base.zmqhandlers import WebSocketMixin
 
 from notebook.utils import url_escape
 
@@ -14,7 +15,10 @@ from jinja2 import FileSystemLoader
 from notebook.utils import url_path_join as ujoin
 from traitlets import HasTraits, Unicode, Bool
 
+from tornado.ioloop import PeriodicCallback
+
 from . import PACKAGE_DIR
+from .jobs import JobManager
 
 FILE_LOADER = FileSystemLoader(PACKAGE_DIR)
 
@@ -75,6 +79,107 @@ class NAppHandler(IPythonHandler):
         return FILE_LOADER.load(self.settings['jinja2_env'], name)
 
 
+class JobsHandler(APIHandler):
+    """List (GET, ?state=running) and submit (POST) detection / post jobs"""
+
+    def initialize(self, job_manager):
+        self.job_manager = job_manager
+
+    @web.authenticated
+    def get(self):
+        self.finish(json.dumps(self.job_manager.list(self.get_argument('state', None))))
+
+    @web.authenticated
+    def post(self):
+        """
+        body: {"kind": "detection" | "post" | "pipeline",
+               "files": [paths relative to the server root] or "data_files_dir": "data",
+               "settings": {Processor settings, same as the command line config}}
+        """
+        body = self.get_json_body() or {}
+        try:
+            job = self.job_manager.submit(body.get('kind'), files=body.get('files'),
+                                          data_files_dir=body.get('data_files_dir'),
+                                          settings=body.get('settings'), user=self.current_user)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        self.set_status(201)
+        self.finish(json.dumps(job.to_dict()))
+
+
+class JobHandler(APIHandler):
+    """Job status (GET) and cancel (DELETE)"""
+
+    def initialize(self, job_manager):
+        self.job_manager = job_manager
+
+    def get_job_id(self, job_id):
+        if job_id not in self.job_manager.jobs:
+            raise HTTPError(404, 'No job: {}'.format(job_id))
+        return job_id
+
+    @web.authenticated
+    def get(self, job_id):
+        self.finish(json.dumps(self.job_manager.jobs[self.get_job_id(job_id)].to_dict()))
+
+    @web.authenticated
+    def delete(self, job_id):
+        job = self.job_manager.cancel(self.get_job_id(job_id))
+        self.finish(json.dumps(job.to_dict()))
+
+
+class ProgressWebSocketHandler(WebSocketMixin, websocket.WebSocketHandler, IPythonHandler):
+    """
+    Pushes json messages to the app: {"type": "job", "job": {...}} on job changes (all jobs on open)
+    and {"type": "progress", "job_id", "stage", "done", "total", "fps", "eta_s", ...} while jobs run.
+    """
+
+    def initialize(self, job_manager):
+        self.job_manager = job_manager
+
+    def get(self, *args, **kwargs):
+        if not self.get_current_user():
+            raise HTTPError(403)
+        return super(ProgressWebSocketHandler, self).get(*args, **kwargs)
+
+    def open(self):
+        for job in self.job_manager.list():
+            self.send_message({'type': 'job', 'job': job})
+        self.job_manager.subscribe(self.send_message)
+
+    def send_message(self, message):
+        self.write_message(json.dumps(message))
+
+    def on_message(self, message):
+        pass
+
+    def on_close(self):
+        self.job_manager.unsubscribe(self.send_message)
+
+
+def add_job_handlers(web_app, config):
+    """
+    Job API at <base_url>/zebrafish/api/jobs, jobs run in worker processes of the server.
+    Progress websocket at <base_url>/zebrafish/api/progress.
+    """
+    base_url = web_app.settings['base_url']
+    job_manager = web_app.settings.get('zebrafish_job_manager')
+    if job_manager is None:
+        root_dir = web_app.settings.get('server_root_dir', os.getcwd())
+        job_manager = JobManager(root_dir, max_workers=config.max_job_workers)
+        web_app.settings['zebrafish_job_manager'] = job_manager
+        PeriodicCallback(job_manager.poll, 1000).start()
+
+    url = ujoin(base_url, 'zebrafish', 'api', 'jobs')
+    handlers = [
+        (url + r'/?', JobsHandler, {'job_manager': job_manager}),
+        (url + r'/(?P<job_id>\w+)/?', JobHandler, {'job_manager': job_manager}),
+        (ujoin(base_url, 'zebrafish', 'api', 'progress'), ProgressWebSocketHandler, {'job_manager': job_manager}),
+    ]
+    web_app.add_handlers(".*$", handlers)
+    return job_manager
+
+
 def add_handlers(web_app, config):
     """Add the appropriate handlers to the web app.
     """
@@ -99,3 +204,4 @@ def add_handlers(web_app, config):
     ]
 
     web_app.add_handlers(".*$", handlers)
+    add_job_handlers(web_app, config)
@@ -0,0 +1,308 @@
+"""Background detection / post jobs run in worker processes of the notebook server."""
+import os
+import time
+import uuid
+import logging
+import multiprocessing
+from collections import OrderedDict
+from queue import Empty
+
+from zebrafish.pipeline import scan_directory
+
+JOB_KINDS = ['detection', 'post', 'pipeline']
+JOB_STATES = ['queued', 'running', 'done', 'failed', 'cancelled']
+
+
+def get_job_file_paths(processor, kind, file_paths=None):
+    """
+    inputs of a job kind, as sorted by Processor.update_file_paths.
+    pipeline: inputs of file_paths as run by the incremental pipeline (one per detection data,
+    csv over xlsx, detection data of videos in file_paths run with their video).
+    """
+    if kind == 'pipeline':
+        video_paths, detection_data_paths = processor.pipeline.get_inputs(file_paths)
+        return video_paths + detection_data_paths
+    if kind == 'detection':
+        return list(processor._detection_file_paths)
+    if processor.post_output_type == 'video':
+        return [p['data'] for p in processor._post_file_paths['video']]
+    return [p['data'] for p in processor._post_file_paths['data']]
+
+
+def run_job(job_id, kind, file_paths, settings, events, cancel_event=None):
+    """
+    worker process: runs a job file by file, progress and errors are sent to events (queue of the job).
+    cancel_event: the job stops before the next file once it is set.
+    """
+    logging.basicConfig(level=logging.INFO)
+    try:
+        run_job_files(job_id, kind, file_paths, settings, events, cancel_event)
+    except Exception as e:
+        events.put({'job_id': job_id, 'type': 'error', 'error': '{}: {}'.format(type(e).__name__, e)})
+        raise
+
+
+def run_job_files(job_id, kind, file_paths, settings, events, cancel_event=None):
+    from zebrafish.core import Processor
+    from zebrafish.cli import apply_settings
+    from zebrafish.video import get_video_infos
+    from zebrafish.utils.progress import progress
+
+    #frame progress of the loops (throttled) instead of tqdm bars in the server log
+    progress.show_bars = False
+    progress.add_listener(lambda event: events.put(dict(event, job_id=job_id)))
+    processor = Processor()
+    apply_settings(processor, settings)
+    processor.update_file_paths(file_paths)
+    paths = get_job_file_paths(processor, kind, file_paths)
+    events.put({'job_id': job_id, 'type': 'started', 'nb_files': len(paths)})
+    for i, path in enumerate(paths):
+        if cancel_event is not None and cancel_event.is_set():
+            logging.info('Job {} cancelled'.format(job_id))
+            return
+        events.put({'job_id': job_id, 'type': 'file_started', 'file': path, 'file_idx': i})
+        progress.context = {'file': path, 'file_idx': i}
+        start = time.time()
+        if kind == 'detection':
+            processor._detection_file_paths = [path]
+            processor.run_detection()
+        elif kind == 'post':
+            if processor.post_output_type == 'video':
+                processor._post_file_paths['video'] = [p for p in processor._post_file_paths['video'] if p['data'] == path]
+            else:
+                processor._post_file_paths['data'] = [{'data': path}]
+            processor.run_post()
+        else:
+            processor.run_incremental([path])
+        try:
+            duration = get_video_infos(path)['duration'] if path.split('.')[-1] in ['mp4', 'MP4'] else None
+        except Exception:
+            duration = None
+        events.put({'job_id': job_id, 'type': 'file_done', 'file': path, 'file_idx': i,
+                    'elapsed_s': time.time() - start, 'duration_s': duration})
+
+
+class Job(object):
+
+    def __init__(self, kind, file_paths, settings, user=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.file_paths = file_paths
+        self.settings = settings
+        self.user = user
+        self.state = 'queued'
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.nb_files = len(file_paths)
+        self.nb_files_done = 0
+        self.current_file = None
+        self.processed_video_s = 0.
+        #last progress event of the current file (stage, frames done, fps, eta)
+        self.stage_progress = None
+        self.process = None
+        #queue of the job worker events (None before start and once closed) and its cancel flag
+        self.events = None
+        self.cancel_event = None
+
+    def get_progress(self):
+        return self.nb_files_done / self.nb_files if self.nb_files > 0 else 0.
+
+    def to_dict(self):
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        return OrderedDict([
+            ('id', self.id),
+            ('kind', self.kind),
+            ('user', self.user),
+            ('state', self.state),
+            ('submitted', self.submitted),
+            ('started', self.started),
+            ('finished', self.finished),
+            ('elapsed_s', elapsed),
+            ('nb_files', self.nb_files),
+            ('nb_files_done', self.nb_files_done),
+            ('current_file', self.current_file),
+            ('progress', self.get_progress()),
+            ('stage_progress', self.stage_progress),
+            ('files_per_hour', self.nb_files_done * 3600. / elapsed if elapsed else None),
+            #seconds of video processed per second
+            ('realtime_factor', self.processed_video_s / elapsed if elapsed else None),
+            ('error', self.error),
+        ])
+
+
+class JobManager(object):
+    """
+    Runs submitted jobs in worker processes, at most max_workers at a time (others are queued).
+    poll() (called periodically by the server) collects progress events and starts queued jobs.
+    Job changes and progress events are sent to subscribers (functions getting a message dict).
+    root_dir: job files are paths relative to it and must be inside it.
+    Each job has its own event queue. Cancelled workers stop before their next file,
+    they are terminated if still running after cancel_timeout_s (only their own queue
+    can be left broken by terminate, it is not read again).
+    """
+    def __init__(self, root_dir, max_workers=2, max_finished_jobs=100):
+        self.root_dir = os.path.realpath(root_dir)
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.cancel_timeout_s = 10.0
+        self.jobs = OrderedDict()
+        self.subscribers = []
+        #spawned workers do not inherit the server's event loop and sockets
+        self._context = multiprocessing.get_context('spawn')
+
+    def resolve_path(self, path):
+        full_path = os.path.realpath(os.path.join(self.root_dir, path))
+        if os.path.commonpath([full_path, self.root_dir]) != self.root_dir:
+            raise ValueError('Path outside the server root: {}'.format(path))
+        return full_path
+
+    def get_file_paths(self, files=None, data_files_dir=None):
+        if files:
+            file_paths = [self.resolve_path(p) for p in files]
+        else:
+            data_dir = self.resolve_path(data_files_dir or 'data')
+            #videos and detection / post data, as listed by the pipeline (no hidden files, manifests or caches)
+            file_paths = [r['path'] for r in scan_directory(data_dir) if r['kind'] is not None]
+        missing = [p for p in file_paths if not os.path.isfile(p)]
+        if len(missing) > 0:
+            raise ValueError('Files not found: {}'.format(missing))
+        return file_paths
+
+    def submit(self, kind, files=None, data_files_dir=None, settings=None, user=None):
+        if kind not in JOB_KINDS:
+            raise ValueError('Unknown job kind: {}, available: {}'.format(kind, JOB_KINDS))
+        job = Job(kind, self.get_file_paths(files, data_files_dir), settings or {}, user)
+        self.jobs[job.id] = job
+        self.publish_job(job)
+        self.poll()
+        return job
+
+    def cancel(self, job_id):
+        """cancels a job without waiting for its worker, poll() stops and terminates it"""
+        job = self.jobs[job_id]
+        if job.state == 'running':
+            job.cancel_event.set()
+        if job.state in ['queued', 'running']:
+            job.state = 'cancelled'
+            job.finished = time.time()
+            self.publish_job(job)
+        return job
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def publish(self, message):
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber(message)
+            except Exception as e:
+                logging.warning('Job subscriber failed: {}'.format(e))
+
+    def publish_job(self, job):
+        self.publish({'type': 'job', 'job': job.to_dict()})
+
+    def get_nb_running(self):
+        return len([j for j in self.jobs.values() if j.state == 'running'])
+
+    def handle_event(self, event):
+        job = self.jobs.get(event['job_id'])
+        if job is None:
+            return
+        if event['type'] == 'error':
+            job.error = event['error']
+            return
+        if job.state != 'running':
+            return
+        if event['type'] == 'progress':
+            event = dict(event, file=os.path.relpath(event['file'], self.root_dir) if 'file' in event else None)
+            job.stage_progress = dict((k, event[k]) for k in ['stage', 'done', 'total', 'fps', 'eta_s', 'finished'])
+            self.publish(event)
+            return
+        if event['type'] == 'started':
+            job.nb_files = event['nb_files']
+        elif event['type'] == 'file_started':
+            job.current_file = os.path.relpath(event['file'], self.root_dir)
+        elif event['type'] == 'file_done':
+            job.nb_files_done += 1
+            job.processed_video_s += event['duration_s'] or 0.
+            job.stage_progress = None
+        self.publish_job(job)
+
+    def read_events(self, job):
+        while job.events is not None:
+            try:
+                self.handle_event(job.events.get_nowait())
+            except Empty:
+                break
+
+    def close_events(self, job):
+        job.events.close()
+        job.events = None
+
+    def stop_cancelled(self, job, timeout_s):
+        """joins the worker of a cancelled job, terminated after timeout_s (from cancel)"""
+        if job.process.is_alive():
+            if time.time() < job.finished + timeout_s:
+                return
+            logging.info('Terminating worker of cancelled job {}'.format(job.id))
+            job.process.terminate()
+        job.process.join()
+        self.close_events(job)
+
+    def poll(self):
+        for job in self.jobs.values():
+            if job.state == 'running':
+                self.read_events(job)
+            elif job.state == 'cancelled' and job.events is not None:
+                self.stop_cancelled(job, self.cancel_timeout_s)
+        for job in self.jobs.values():
+            if job.state == 'running' and not job.process.is_alive():
+                job.process.join()
+                #events sent before the worker exited
+                self.read_events(job)
+                self.close_events(job)
+                job.finished = time.time()
+                if job.process.exitcode == 0:
+                    job.state = 'done'
+                else:
+                    job.state = 'failed'
+                    job.error = job.error or 'worker exited with {}, see the server log'.format(job.process.exitcode)
+                job.current_file = None
+                job.stage_progress = None
+                self.publish_job(job)
+        for job in self.jobs.values():
+            if self.get_nb_running() >= self.max_workers:
+                break
+            if job.state == 'queued':
+                job.events = self._context.Queue()
+                job.cancel_event = self._context.Event()
+                job.process = self._context.Process(target=run_job,
+                                                    args=(job.id, job.kind, job.file_paths, job.settings,
+                                                          job.events, job.cancel_event))
+                job.process.daemon = True
+                job.process.start()
+                job.state = 'running'
+                job.started = time.time()
+                self.publish_job(job)
+        #forget the oldest finished jobs (cancelled ones once their worker is stopped)
+        finished = [j.id for j in self.jobs.values() if j.state in ['done', 'failed', 'cancelled'] and j.events is None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def list(self, state=None):
+        return [j.to_dict() for j in self.jobs.values() if state is None or j.state == state]
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            if job.state in ['queued', 'running']:
+                self.cancel(job.id)
+            if job.state == 'cancelled' and job.events is not None:
+                self.stop_cancelled(job, 0.)
@@ -9,6 +9,9 @@ setuptools.setup(name='zebrafish',
       license='MIT',
       packages=setuptools.find_packages(),
       zip_safe=False,
+      entry_points={
+          'console_scripts': ['zebrafish=zebrafish.cli:main'],
+      },
       install_requires=[
           'numpy==1.19.1',
           'imageio==2.9.0',
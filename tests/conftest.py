@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from zebrafish.saver import DetectionDataSaver
+
+
+def make_detection_data(nb_frames=60, nb_fish=4, seed=0):
+    """detection data of fish moving randomly, with missed detections and frames without detections"""
+    rng = np.random.RandomState(seed)
+    saver = DetectionDataSaver()
+    positions = rng.rand(nb_fish, 2) * [600, 400] + [20, 20]
+    rows = []
+    for frame_num in range(nb_frames):
+        positions = np.clip(positions + rng.randn(nb_fish, 2) * 2, 10, [630, 430])
+        if rng.rand() < 0.05:
+            continue
+        for x, y in positions:
+            if rng.rand() < 0.1:
+                continue
+            angle = rng.rand() * 2 * np.pi - np.pi
+            rows.append([frame_num, x, y, x + 100, y + 50, x - 5, y - 5, x + 5, y + 5, angle,
+                         np.cos(angle), np.sin(angle), angle, np.degrees(angle)])
+    return pd.DataFrame(rows, columns=saver.base_data_names + saver.input_data_names)
+
+
+@pytest.fixture
+def detection_data_path(tmp_path):
+    path = str(tmp_path / 'fish_detection.csv')
+    make_detection_data().to_csv(path, index=False)
+    return path
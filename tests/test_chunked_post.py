@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+from zebrafish.core import PostProcessor
+
+
+def get_post_data(detection_data_path, tracker, chunksize=None, frame_cut=(0, None)):
+    postprocessor = PostProcessor()
+    postprocessor.tracker = tracker
+    postprocessor.save_track_index = False
+    postprocessor.save_summary = False
+    postprocessor.chunksize = chunksize
+    output_path = postprocessor.save_post_data(detection_data_path, frame_cut=frame_cut)
+    return pd.read_csv(output_path + '.csv')
+
+
+@pytest.mark.parametrize('tracker', ['KalmanTracker', 'VicinityTracker'])
+@pytest.mark.parametrize('frame_cut', [(0, None), (7, 41), (30, None)])
+def test_chunked_post_data_equals_in_memory(detection_data_path, tracker, frame_cut):
+    expected = get_post_data(detection_data_path, tracker, frame_cut=frame_cut)
+    if frame_cut != (0, None):
+        frame_nums = sorted(pd.read_csv(detection_data_path)['frame_num'].unique())
+        end = len(frame_nums) if frame_cut[1] is None else frame_cut[1]
+        assert sorted(expected['frame_num'].unique()) == frame_nums[frame_cut[0]:end]
+    for chunksize in [5, 64, 10000]:
+        chunked = get_post_data(detection_data_path, tracker, chunksize, frame_cut)
+        pd.testing.assert_frame_equal(chunked, expected)
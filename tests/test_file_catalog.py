@@ -0,0 +1,54 @@
+import os
+
+from zebrafish.core import Processor
+from zebrafish.pipeline import FileCatalog
+import zebrafish.pipeline.file_catalog as file_catalog
+
+
+def touch(directory, name, content=''):
+    path = os.path.join(str(directory), name)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_scan_classifies_only_new_or_changed_files(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    for name in ['a.mp4', 'b.mp4', 'a_detection.csv', 'a_detection_post.csv']:
+        touch(directory, name)
+    classified = []
+    classify_file = file_catalog.classify_file
+    monkeypatch.setattr(file_catalog, 'classify_file', lambda path: classified.append(path) or classify_file(path))
+
+    catalog = FileCatalog.for_directory(directory)
+    assert catalog.scan(directory) == {'added': 4, 'updated': 0, 'removed': 0}
+    assert len(classified) == 4
+
+    del classified[:]
+    assert catalog.scan(directory) == {'added': 0, 'updated': 0, 'removed': 0}
+    assert classified == []
+
+    del classified[:]
+    touch(directory, 'b.mp4', 'changed')
+    os.remove(os.path.join(directory, 'a_detection_post.csv'))
+    assert catalog.scan(directory) == {'added': 0, 'updated': 1, 'removed': 1}
+    assert classified == [os.path.join(directory, 'b.mp4')]
+    assert [r['name'] for r in catalog.get_records(directory, kind='video')] == ['a.mp4', 'b.mp4']
+    assert [r['name'] for r in catalog.get_videos_without_detections(directory)] == ['b.mp4']
+
+
+def test_update_file_paths_matches_post_data_to_video_with_trailing_separator(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    for name in ['fish.mp4', 'fish_detection.csv', 'fish_detection_post.csv']:
+        touch(data_dir, name)
+    for data_files_dir in [str(data_dir), str(data_dir) + os.path.sep]:
+        processor = Processor()
+        processor.data_files_dir = data_files_dir
+        processor.update_file_paths()
+        videos = processor._post_file_paths['video']
+        assert len(videos) == 1
+        assert os.path.basename(videos[0]['data']) == 'fish_detection_post.csv'
+        assert os.path.basename(videos[0]['video']) == 'fish.mp4'
+    #nothing is written to the data directory
+    assert not os.path.exists(os.path.join(str(data_dir), file_catalog.CATALOG_NAME))
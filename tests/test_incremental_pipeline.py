@@ -0,0 +1,16 @@
+import pytest
+
+from zebrafish.core import Processor
+
+
+@pytest.mark.parametrize('run_tracker', [True, False])
+@pytest.mark.parametrize('chunksize', [None, 50])
+def test_post_stage_is_up_to_date_after_a_run(detection_data_path, run_tracker, chunksize):
+    processor = Processor()
+    postprocessor = processor.postprocessor
+    postprocessor.run_tracker = run_tracker
+    postprocessor.chunksize = chunksize
+    postprocessor.save_summary = True
+    processor.pipeline.steps = ['tracking', 'post']
+    assert processor.run_incremental([detection_data_path]) > 0
+    assert processor.run_incremental([detection_data_path]) == 0
@@ -0,0 +1,51 @@
+import numpy as np
+
+from zebrafish.detector import MotionGate
+
+
+def make_frame(value=100):
+    return np.full((64, 64, 3), value, dtype=np.uint8)
+
+
+def test_static_frames_are_carried_up_to_max_carry_frames():
+    gate = MotionGate(max_carry_frames=3)
+    measured = [gate.is_measured(make_frame()) for _ in range(9)]
+    assert measured == [True, False, False, False, True, False, False, False, True]
+    assert (gate.nb_frames, gate.nb_measured, gate.nb_carried) == (9, 3, 0)
+    gate.reset()
+    assert gate.is_measured(make_frame())
+
+
+def test_motion_is_measured_against_the_last_measured_frame():
+    gate = MotionGate(scale=8, pixel_threshold=12, motion_threshold=2)
+    frame = make_frame()
+    assert gate.is_measured(frame)
+    #one 8x8 block changed: below motion_threshold
+    moved = frame.copy()
+    moved[:8, :8] = 200
+    assert not gate.is_measured(moved)
+    #two blocks changed since the last measured frame
+    moved[8:16, :8] = 200
+    assert gate.is_measured(moved)
+    assert not gate.is_measured(moved)
+
+
+def test_small_changes_are_below_pixel_threshold():
+    gate = MotionGate()
+    assert gate.is_measured(make_frame(100))
+    assert not gate.is_measured(make_frame(110))
+
+
+def test_match_positions_within_distance():
+    gate = MotionGate()
+    gate.max_interpolation_dist = 5.
+    position = np.array([[0., 0.], [50., 50.], [100., 0.]])
+    next_position = np.array([[51., 52.], [1., 1.], [200., 200.]])
+    rows, cols = gate.match_positions(position, next_position)
+    assert sorted(zip(rows.tolist(), cols.tolist())) == [(0, 1), (1, 0)]
+
+
+def test_match_positions_without_detections():
+    gate = MotionGate()
+    rows, cols = gate.match_positions(np.zeros((0, 2)), np.array([[1., 1.]]))
+    assert len(rows) == 0 and len(cols) == 0
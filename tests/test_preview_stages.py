@@ -0,0 +1,45 @@
+import numpy as np
+
+from zebrafish.detector import ThresholdDetector
+
+
+def make_image():
+    img = np.full((120, 160, 3), 200, dtype=np.uint8)
+    img[30:36, 20:60] = 20
+    img[40:42, 20:60] = 20
+    img[80:90, 100:104] = 30
+    return img
+
+
+def assert_same_stages(detector, img, frame_key):
+    cached_images, cached_contours, _, _ = detector.process_image_staged(img, frame_key=frame_key)
+    images, contours, _, _ = detector.process_image_staged(img)
+    for cached, image in zip(cached_images, images):
+        np.testing.assert_array_equal(cached, image)
+    assert len(cached_contours) == len(contours)
+
+
+def test_every_stage_parameter_invalidates_the_cache():
+    detector = ThresholdDetector()
+    img = make_image()
+    frame_key = ('frame', 0)
+    assert_same_stages(detector, img, frame_key)
+    detector.denoising_kernel = np.ones((5, 5), dtype=np.uint8)
+    assert_same_stages(detector, img, frame_key)
+    detector.closing_kernel = np.ones((7, 7), dtype=np.uint8)
+    assert_same_stages(detector, img, frame_key)
+    detector.closing_iterations = 2
+    assert_same_stages(detector, img, frame_key)
+    detector.l_thresh = (0, 40)
+    assert_same_stages(detector, img, frame_key)
+    detector.median_blur_size = 5
+    assert_same_stages(detector, img, frame_key)
+
+
+def test_unchanged_parameters_reuse_cached_stages():
+    detector = ThresholdDetector()
+    img = make_image()
+    first = detector.process_image_staged(img, frame_key=('frame', 0))
+    detector.size_bound = (1, 10)
+    second = detector.process_image_staged(img, frame_key=('frame', 0))
+    assert all(a is b for a, b in zip(first[0], second[0]))
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from zebrafish.post import RegionLabeler
+
+
+def label(labeler, positions):
+    data = pd.DataFrame(positions, columns=['pos_x_in_frame', 'pos_y_in_frame'])
+    return labeler.run(data)['region_id'].tolist()
+
+
+def test_rectangles_and_polygons_in_frame_pixels():
+    labeler = RegionLabeler()
+    #crop: rows 100-300, columns 200-500 of the frame
+    labeler.overall_crop = np.array([[100, 200], [300, 500]])
+    assert labeler.add_rectangle((200, 300), (100, 200), name='left') == 1
+    assert labeler.add_polygon([(400, 150), (480, 150), (480, 250), (400, 250)]) == 2
+    assert labeler.get_region_names() == {1: 'left', 2: 'polygon_2'}
+    assert label(labeler, [(250, 150), (440, 200), (350, 250)]) == [1, 2, 0]
+
+
+def test_later_regions_are_drawn_over_earlier_ones():
+    labeler = RegionLabeler()
+    labeler.overall_crop = np.array([[0, 0], [100, 100]])
+    labeler.add_rectangle((0, 60), (0, 60))
+    labeler.add_rectangle((40, 100), (40, 100))
+    assert label(labeler, [(20, 20), (50, 50), (80, 80)]) == [1, 2, 2]
+
+
+def test_positions_outside_the_crop_or_missing_are_in_no_region():
+    labeler = RegionLabeler()
+    labeler.overall_crop = np.array([[10, 10], [50, 50]])
+    labeler.add_rectangle((0, 100), (0, 100))
+    assert label(labeler, [(5, 20), (20, 60), (np.nan, 20), (20, 20)]) == [0, 0, 0, 1]
+
+
+def test_mask_is_rebuilt_when_the_crop_changes():
+    labeler = RegionLabeler()
+    labeler.overall_crop = np.array([[0, 0], [100, 100]])
+    labeler.add_rectangle((10, 20), (10, 20))
+    assert label(labeler, [(15, 15)]) == [1]
+    labeler.overall_crop = np.array([[0, 0], [200, 200]])
+    assert labeler.get_mask().shape == (200, 200)
+    assert label(labeler, [(15, 15), (150, 150)]) == [1, 0]
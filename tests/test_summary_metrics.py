@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from zebrafish.post import SummaryMetrics
+
+
+def make_post_data():
+    rng = np.random.RandomState(0)
+    nb_rows = 500
+    return pd.DataFrame({'frame_num': np.sort(rng.randint(0, 300, nb_rows)),
+                         'id': rng.randint(0, 4, nb_rows).astype(np.float64),
+                         'rel_angle_deg': rng.rand(nb_rows) * 360 - 180,
+                         'rel_angle_rad': rng.rand(nb_rows),
+                         'velocity_pixel': rng.rand(nb_rows) * 100,
+                         'pos_dist': rng.rand(nb_rows) * 5})
+
+
+def test_summary_of_one_id():
+    data = pd.DataFrame({'frame_num': [0, 1, 2, 3],
+                         'id': [7., 7., 7., np.nan],
+                         'rel_angle_deg': [10., -30., 120., 0.],
+                         'rel_angle_rad': np.radians([10., -30., 120., 0.]),
+                         'velocity_pixel': [1., 3., np.nan, 100.],
+                         'pos_dist': [np.nan, 2., 4., 1.]})
+    metrics = SummaryMetrics()
+    metrics.fps = 2.
+    summary = metrics.summarize(data)
+    assert len(summary) == 1
+    row = summary.iloc[0]
+    assert row['id'] == 7 and row['nb_frames'] == 3
+    assert row['first_frame'] == 0 and row['last_frame'] == 2
+    assert row['oriented_ratio'] == 2. / 3
+    assert row['oriented_time_s'] == 1.
+    np.testing.assert_allclose(row['mean_cos_rel_angle'], np.mean(np.cos(np.radians([10., -30., 120.]))))
+    assert row['speed_mean'] == 2. and row['speed_max'] == 3.
+    assert row['distance_pixel'] == 6.
+
+
+def test_chunks_give_the_summary_of_the_whole_data(tmp_path):
+    data = make_post_data()
+    metrics = SummaryMetrics()
+    metrics.time_bin_s = 2.
+    metrics.max_partials = 2
+    summary = metrics.summarize(data)
+    path = str(tmp_path / 'post.csv')
+    data.to_csv(path, index=False)
+    chunked = metrics.summarize_file(path, chunksize=37)
+    pd.testing.assert_frame_equal(summary, chunked, check_exact=False)
+    assert sorted(summary['time_bin'].unique().tolist()) == list(range(5))
+
+
+def test_speed_percentiles_from_histograms():
+    data = make_post_data()
+    metrics = SummaryMetrics()
+    metrics.speed_bin_edges = np.linspace(0, 100, 1001)
+    summary = metrics.summarize(data)
+    bin_width = 0.1
+    for _, row in summary.iterrows():
+        speeds = np.sort(data.loc[data['id'] == row['id'], 'velocity_pixel'])
+        for q, name in [(0.5, 'speed_p50'), (0.9, 'speed_p90')]:
+            #between the order statistics around the q quantile, within a histogram bin
+            k = q * len(speeds)
+            lower = speeds[int(np.floor(k)) - 1]
+            upper = speeds[min(int(np.ceil(k)), len(speeds) - 1)]
+            assert lower - bin_width <= row[name] <= upper + bin_width
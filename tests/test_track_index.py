@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from zebrafish.post import TrackIndex
+
+
+def make_tracked_data():
+    rng = np.random.RandomState(0)
+    rows = []
+    for frame_num in range(40):
+        for track_id in [0, 1, 2, 5]:
+            #ids alive in different frame ranges, with gaps
+            if (track_id == 2 and frame_num < 10) or (track_id == 5 and frame_num > 25) or rng.rand() < 0.2:
+                continue
+            rows.append([frame_num, track_id, rng.rand()])
+        rows.append([frame_num, np.nan, rng.rand()])
+    return pd.DataFrame(rows, columns=['frame_num', 'id', 'value'])
+
+
+def test_queries_match_boolean_filters():
+    data = make_tracked_data()
+    index = TrackIndex().build(data)
+    assert index.ids.tolist() == [0, 1, 2, 5]
+    for track_id in index.ids:
+        expected = data[data['id'] == track_id]
+        pd.testing.assert_frame_equal(index.get_trajectory(track_id), expected)
+        in_window = (expected['frame_num'] >= 12) & (expected['frame_num'] < 30)
+        pd.testing.assert_frame_equal(index.get_id_slice(track_id, 12, 30), expected[in_window])
+    window = (data['frame_num'] >= 5) & (data['frame_num'] < 9)
+    pd.testing.assert_frame_equal(index.get_window(5, 9, columns=['id', 'value']), data[window][['id', 'value']])
+    assert index.get_alive_ids(30, 40).tolist() == [0, 1, 2]
+    assert index.get_alive_ids(0, 5).tolist() == [0, 1, 5]
+
+
+def test_window_of_data_not_in_frame_order():
+    data = make_tracked_data().sample(frac=1., random_state=0)
+    index = TrackIndex().build(data)
+    rows = index.get_window_rows(3, 6)
+    assert sorted(rows.tolist()) == np.flatnonzero((data['frame_num'] >= 3) & (data['frame_num'] < 6)).tolist()
+
+
+def test_save_and_load(tmp_path):
+    data = make_tracked_data()
+    index = TrackIndex().build(data)
+    path = str(tmp_path / 'track_index.npz')
+    index.save(path)
+    loaded = TrackIndex().load(path, data)
+    assert len(loaded) == len(index)
+    pd.testing.assert_frame_equal(loaded.get_trajectory(2), index.get_trajectory(2))
@@ -0,0 +1,18 @@
+import pytest
+
+from zebrafish.video import split_frame_range
+
+
+@pytest.mark.parametrize('nb_frames, nb_segments, stride', [(100, 4, 1), (101, 3, 1), (1000, 7, 5), (37, 5, 4)])
+def test_segments_cover_the_frames(nb_frames, nb_segments, stride):
+    segments = split_frame_range(nb_frames, nb_segments, stride)
+    assert segments[0][0] == 0 and segments[-1][1] == nb_frames
+    for (start, end), (next_start, _) in zip(segments, segments[1:]):
+        assert start < end == next_start
+    assert all(start % stride == 0 for start, _ in segments)
+    assert len(segments) <= nb_segments
+
+
+def test_more_segments_than_frames():
+    assert split_frame_range(3, 10) == [(0, 1), (1, 2), (2, 3)]
+    assert split_frame_range(5, 0) == [(0, 5)]
@@ -0,0 +1,4 @@
+from zebrafish.benchmark.synthetic_video import SyntheticVideoGenerator, get_ground_truth_path
+from zebrafish.benchmark.detection_benchmark import DetectionBenchmark, DEFAULT_CASES, evaluate_detections
+from zebrafish.benchmark.detection_benchmark import load_results, get_results_table, get_stage_table, compare_results
+from zebrafish.benchmark.multiscale_benchmark import MultiScaleBenchmark
@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+import logging
+import os
+import json
+import time
+import platform
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+from scipy.spatial import distance_matrix
+from lapsolver import solve_dense
+
+from zebrafish.benchmark.synthetic_video import SyntheticVideoGenerator, get_ground_truth_path
+from zebrafish.utils.profiler import profiler
+
+#benchmark cases: name -> SyntheticVideoGenerator settings
+DEFAULT_CASES = OrderedDict([
+    ('720p_10fish', {'width': 1280, 'height': 720, 'nb_fish': 10}),
+    ('720p_10fish_noisy', {'width': 1280, 'height': 720, 'nb_fish': 10, 'noise_std': 12.0}),
+    ('1080p_crop_30fish', {'width': 1920, 'height': 1080, 'crop': [[60, 320], [1020, 1600]], 'nb_fish': 30}),
+    ('4k_crop_30fish', {'width': 3840, 'height': 2160, 'crop': [[0, 1290], [2120, 3400]], 'nb_fish': 30,
+                        'fish_length': 60, 'fish_width': 18, 'nb_frames': 60}),
+])
+
+
+def get_version_info():
+    """zebrafish version (git describe of the source tree if available) and machine info"""
+    source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        version = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=source_dir,
+                                          stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        version = None
+    import cv2
+    return {'version': version,
+            'machine': platform.node(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__}
+
+
+def evaluate_detections(detection_data, ground_truth, match_distance):
+    """
+    Matches detections to ground truth fish per frame (min total distance, pairs within match_distance).
+    Returns precision, recall, f1, position rmse (pixels) and heading errors (deg) of matches.
+    """
+    frame_nums = np.unique(ground_truth['frame_num'])
+    detections = dict(tuple(detection_data.groupby('frame_num')))
+    nb_matches = 0
+    position_errors = []
+    heading_errors = []
+    for frame_num, gt in ground_truth.groupby('frame_num'):
+        det = detections.get(frame_num)
+        if det is None or len(det) == 0:
+            continue
+        gt_positions = gt[['pos_x_in_frame', 'pos_y_in_frame']].values
+        det_positions = det[['pos_x_in_frame', 'pos_y_in_frame']].values
+        dist = distance_matrix(gt_positions, det_positions)
+        gt_rows, det_cols = solve_dense(dist)
+        matched = dist[gt_rows, det_cols] < match_distance
+        gt_rows, det_cols = gt_rows[matched], det_cols[matched]
+        nb_matches += len(gt_rows)
+        position_errors.append(dist[gt_rows, det_cols])
+        angle_diff = det['angle'].values[det_cols] - gt['angle'].values[gt_rows]
+        heading_errors.append(np.abs(np.degrees(np.arctan2(np.sin(angle_diff), np.cos(angle_diff)))))
+    position_errors = np.concatenate(position_errors) if len(position_errors) > 0 else np.zeros(0)
+    heading_errors = np.concatenate(heading_errors) if len(heading_errors) > 0 else np.zeros(0)
+
+    nb_detections = int(np.sum(np.isin(detection_data['frame_num'], frame_nums)))
+    precision = nb_matches / nb_detections if nb_detections > 0 else np.nan
+    recall = nb_matches / len(ground_truth) if len(ground_truth) > 0 else np.nan
+    return {'nb_ground_truth': int(len(ground_truth)),
+            'nb_detections': nb_detections,
+            'nb_matches': int(nb_matches),
+            'precision': precision,
+            'recall': recall,
+            'f1': 2 * precision * recall / (precision + recall) if nb_matches > 0 else 0.,
+            'position_rmse_px': float(np.sqrt(np.mean(position_errors ** 2))) if nb_matches > 0 else np.nan,
+            'heading_error_mean_deg': float(np.mean(heading_errors)) if nb_matches > 0 else np.nan,
+            'heading_error_p90_deg': float(np.percentile(heading_errors, 90)) if nb_matches > 0 else np.nan,
+            #head and tail swapped
+            'heading_flip_ratio': float(np.mean(heading_errors > 90)) if nb_matches > 0 else np.nan}
+
+
+class DetectionBenchmark(object):
+    """
+    End-to-end detection benchmark on synthetic videos (SyntheticVideoGenerator).
+    For every case it runs DetectionProcessor.save_detection_data and the rendering paths
+    (render_paths: 'detection' video, 'post' data and video), and reports frames per second,
+    profiler stage breakdowns and detection accuracy against the ground truth.
+    Results are appended to results_path (json lines), compare them with load_results / compare_results.
+
+    output_dir: generated videos (reused while their settings do not change) and outputs,
+    output file names are derived from the video path, so output_dir must be a relative path without '.'.
+    """
+    def __init__(self, processor=None):
+        if processor is None:
+            from zebrafish.core import Processor
+            processor = Processor()
+        self.processor = processor
+        self.cases = OrderedDict(DEFAULT_CASES)
+        self.output_dir = 'benchmark'
+        self.results_path = os.path.join('benchmark', 'benchmark_results.jsonl')
+        self.render_paths = ['detection', 'post']
+        #size_bound of the detector: (low, high) * mean ground truth fish area
+        self.size_bound_ratio = (0.5, 2.0)
+        #max distance of a match: match_distance_ratio * fish_length
+        self.match_distance_ratio = 0.5
+        self.trace_memory = False
+
+    def get_generator(self, case_settings):
+        return SyntheticVideoGenerator().set_settings(case_settings)
+
+    def get_video(self, case_name, generator):
+        """synthetic video path and ground truth, generated if missing"""
+        #rendered videos are saved in these folders next to the video
+        for video_dir in ['detection_video', 'post_video']:
+            if not os.path.exists(os.path.join(self.output_dir, video_dir)):
+                os.makedirs(os.path.join(self.output_dir, video_dir))
+        video_path = os.path.join(self.output_dir, 'synthetic_{}.mp4'.format(generator.get_settings_key()))
+        ground_truth_path = get_ground_truth_path(video_path)
+        if os.path.exists(video_path) and os.path.exists(ground_truth_path):
+            logging.info('Reusing synthetic video of {}: {}'.format(case_name, video_path))
+            return video_path, pd.read_csv(ground_truth_path)
+        return video_path, generator.generate(video_path)
+
+    def setup_processors(self, generator, ground_truth):
+        crop = generator.get_crop()
+        mean_area = ground_truth['area'].mean()
+        for processor in [self.processor.detection_processor, self.processor.postprocessor]:
+            processor.overall_crop = np.array(crop)
+            processor.image_width = generator.width
+            processor.image_height = generator.height
+            processor.fps = generator.fps
+        detector = self.processor.detection_processor._detector
+        detector.size_bound = (self.size_bound_ratio[0] * mean_area, self.size_bound_ratio[1] * mean_area)
+
+    def run_timed(self, name, run, nb_frames):
+        """runs run() with the profiler, returns phase time, fps and stage stats"""
+        logging.info('Benchmark phase: ' + name)
+        profiler.start(trace_memory=self.trace_memory)
+        start = time.perf_counter()
+        try:
+            run()
+        finally:
+            elapsed = time.perf_counter() - start
+            profiler.stop()
+        stages = profiler.get_summary()
+        return {'time_s': elapsed,
+                'fps': nb_frames / elapsed if elapsed > 0 else np.nan,
+                'stages': dict((row['stage'], {'count': int(row['count']),
+                                               'total_s': row['total_s'],
+                                               'mean_ms': row['mean_ms'],
+                                               'peak_memory_mb': row['peak_memory_mb']})
+                               for _, row in stages.iterrows())}
+
+    def run_case(self, case_name, case_settings):
+        generator = self.get_generator(case_settings)
+        video_path, ground_truth = self.get_video(case_name, generator)
+        self.setup_processors(generator, ground_truth)
+        detection_processor = self.processor.detection_processor
+        postprocessor = self.processor.postprocessor
+        phases = OrderedDict()
+
+        phases['detection_data'] = self.run_timed('detection_data',
+                                                  lambda: detection_processor.save_detection_data(video_path),
+                                                  generator.nb_frames)
+        detection_data_path = detection_processor.saver.output_file_path + '.csv'
+        accuracy = evaluate_detections(pd.read_csv(detection_data_path), ground_truth,
+                                       self.match_distance_ratio * generator.fish_length)
+
+        if 'detection' in self.render_paths:
+            phases['detection_video'] = self.run_timed('detection_video',
+                                                       lambda: detection_processor.save_detection_video(video_path),
+                                                       generator.nb_frames)
+        if 'post' in self.render_paths:
+            phases['post_data'] = self.run_timed('post_data',
+                                                 lambda: postprocessor.save_post_data(detection_data_path),
+                                                 generator.nb_frames)
+            post_data_path = postprocessor.saver.output_file_path + '.csv'
+            phases['post_video'] = self.run_timed('post_video',
+                                                  lambda: postprocessor.save_post_video(video_path, post_data_path),
+                                                  generator.nb_frames)
+
+        result = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'case': case_name,
+                  'settings': generator.get_settings(),
+                  'detection_settings': {'size_bound': list(detection_processor._detector.size_bound),
+                                         'nb_render_workers': detection_processor.nb_render_workers,
+                                         'render_scale': detection_processor.render_scale},
+                  'phases': phases,
+                  'accuracy': accuracy}
+        logging.info('Benchmark {}: detection {:.1f} fps, recall {:.3f}, precision {:.3f}'.format(
+            case_name, phases['detection_data']['fps'], accuracy['recall'], accuracy['precision']))
+        return result
+
+    def run(self, case_names=None):
+        """runs cases (None: every case), appends results to results_path, returns the results table"""
+        if case_names is None:
+            case_names = list(self.cases)
+        version_info = get_version_info()
+        results = []
+        for case_name in case_names:
+            result = self.run_case(case_name, self.cases[case_name])
+            result.update(version_info)
+            results.append(result)
+            save_result(result, self.results_path)
+        return get_results_table(results)
+
+
+def save_result(result, results_path):
+    results_dir = os.path.dirname(results_path)
+    if results_dir and not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    with open(results_path, 'a') as f:
+        f.write(json.dumps(result, default=float) + '\n')
+    logging.info('Benchmark result saved at: ' + results_path)
+
+
+def get_results_table(results):
+    """one row per result: case, version, machine, phase fps and times, accuracy"""
+    rows = []
+    for result in results:
+        row = OrderedDict((name, result.get(name)) for name in ['timestamp', 'case', 'version', 'machine'])
+        for phase, stats in result['phases'].items():
+            row[phase + '_fps'] = stats['fps']
+            row[phase + '_time_s'] = stats['time_s']
+        row.update(result['accuracy'])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def load_results(results_path):
+    """saved results (json lines) of results_path"""
+    with open(results_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_stage_table(result, phase='detection_data'):
+    """profiler stage breakdown of a phase of a result"""
+    stages = result['phases'][phase]['stages']
+    table = pd.DataFrame([dict(stage=name, **stats) for name, stats in stages.items()])
+    return table.sort_values(by='total_s', ascending=False).reset_index(drop=True)
+
+
+def compare_results(results, metric='detection_data_fps', machine=None):
+    """
+    metric of the latest result of every (case, version), cases x versions (in run order).
+    machine: compares results of this machine only (None: current machine).
+    """
+    table = get_results_table(results)
+    if machine is None:
+        machine = platform.node()
+    table = table[table['machine'] == machine]
+    versions = list(OrderedDict.fromkeys(table['version']))
+    table = table.drop_duplicates(subset=['case', 'version'], keep='last')
+    return table.pivot(index='case', columns='version', values=metric)[versions]
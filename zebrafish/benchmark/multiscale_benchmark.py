@@ -0,0 +1,82 @@
+import pandas as pd
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from zebrafish.benchmark.detection_benchmark import DetectionBenchmark, evaluate_detections
+
+
+def get_detector_time(phase_stats):
+    """time of the detector stages of a phase (coarse-to-fine: top level stages only, not the nested ones)"""
+    stages = phase_stats['stages']
+    if 'detector.coarse' in stages:
+        names = ['detector.coarse', 'detector.refine', 'detector.position_angle', 'detector.full_resolution']
+    else:
+        names = [name for name in stages if name.startswith('detector.')]
+    return sum(stages[name]['total_s'] for name in names if name in stages)
+
+
+class MultiScaleBenchmark(DetectionBenchmark):
+    """
+    Coarse-to-fine detection (ThresholdDetector.detection_scale) against full resolution detection.
+    For every case and scale it reports detection fps, speedup, accuracy against the ground truth
+    and agreement with the full resolution detections: recall (full resolution detections found)
+    and precision of matches within the detector multiscale_tolerance_px.
+    Accuracy columns are prefixed with the scale, e.g. scale2_speedup, scale2_within_tolerance.
+    """
+    def __init__(self, processor=None):
+        super(MultiScaleBenchmark, self).__init__(processor)
+        self.scales = [1, 2, 4]
+        self.render_paths = []
+        self.results_path = os.path.join('benchmark', 'multiscale_results.jsonl')
+
+    def run_case(self, case_name, case_settings):
+        generator = self.get_generator(case_settings)
+        video_path, ground_truth = self.get_video(case_name, generator)
+        self.setup_processors(generator, ground_truth)
+        detection_processor = self.processor.detection_processor
+        detector = detection_processor._detector
+        detector_settings = (detector.detection_scale, detector.multiscale_check_interval)
+        #every frame is compared here, no runtime check
+        detector.multiscale_check_interval = 0
+        phases = OrderedDict()
+        accuracy = OrderedDict()
+        reference = None
+        try:
+            for scale in [1] + [s for s in self.scales if s != 1]:
+                detector.detection_scale = scale
+                phase = 'detection_data_scale{}'.format(scale)
+                phases[phase] = self.run_timed(phase, lambda: detection_processor.save_detection_data(video_path),
+                                               generator.nb_frames)
+                data = pd.read_csv(detection_processor.saver.output_file_path + '.csv')
+                prefix = 'scale{}_'.format(scale)
+                for name, value in evaluate_detections(data, ground_truth,
+                                                       self.match_distance_ratio * generator.fish_length).items():
+                    accuracy[prefix + name] = value
+                if reference is None:
+                    reference = data
+                    continue
+                agreement = evaluate_detections(data, reference, detector.multiscale_tolerance_px)
+                accuracy[prefix + 'speedup'] = phases[phase]['fps'] / phases['detection_data_scale1']['fps']
+                #detector stages only (without decoding and saving)
+                accuracy[prefix + 'detector_speedup'] = get_detector_time(phases['detection_data_scale1']) / \
+                                                        get_detector_time(phases[phase])
+                accuracy[prefix + 'agreement_recall'] = agreement['recall']
+                accuracy[prefix + 'agreement_precision'] = agreement['precision']
+                accuracy[prefix + 'agreement_rmse_px'] = agreement['position_rmse_px']
+                accuracy[prefix + 'within_tolerance'] = bool(agreement['recall'] == 1 and agreement['precision'] == 1)
+                logging.info('Benchmark {} scale {}: {:.2f}x, agreement recall {:.4f}, precision {:.4f}'.format(
+                    case_name, scale, accuracy[prefix + 'speedup'], agreement['recall'], agreement['precision']))
+        finally:
+            detector.detection_scale, detector.multiscale_check_interval = detector_settings
+
+        return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'case': case_name,
+                'settings': generator.get_settings(),
+                'detection_settings': {'size_bound': list(detector.size_bound),
+                                       'scales': self.scales,
+                                       'refine_padding': detector.refine_padding,
+                                       'multiscale_tolerance_px': detector.multiscale_tolerance_px},
+                'phases': phases,
+                'accuracy': accuracy}
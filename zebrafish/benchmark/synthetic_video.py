@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+import cv2
+import logging
+import hashlib
+import json
+
+from zebrafish.video import FFmpegVideoWriter, get_encoding_settings
+
+
+class SyntheticVideoGenerator(object):
+    """
+    Synthetic rheotaxis videos: dark fish-like blobs (a wide head ellipse and a thin tail ellipse)
+    moving on a light background inside crop, with gaussian pixel noise.
+    Ground truth of every fish and frame: centroid (frame pixels, centroid of the drawn blob),
+    heading angle (rad, image coords, tail to head, same as ThresholdDetector angle) and area.
+
+    crop: [[y_start, x_start], [y_end, x_end]] (same as overall_crop), None: whole frame.
+    fish_length, fish_width: blob size in pixels.
+    speed: fish speed in pixels per frame, turn_std: heading random walk std (rad per frame).
+    noise_std: gaussian noise std of pixel values (0: no noise).
+    """
+    def __init__(self):
+        self.width = 1280
+        self.height = 720
+        self.fps = 30.0
+        self.nb_frames = 150
+        self.crop = None
+        self.nb_fish = 10
+        self.fish_length = 40
+        self.fish_width = 12
+        self.speed = 2.0
+        self.turn_std = 0.1
+        self.background = 200
+        self.fish_value = 40
+        self.noise_std = 4.0
+        self.nb_noise_frames = 8
+        self.seed = 0
+        #lossless by default, encoding artifacts are not part of the detection benchmark
+        self.encoding_preset = 'default'
+        self.encoding_settings = {'crf': 0, 'preset': 'ultrafast'}
+
+    def get_settings(self):
+        return {'width': self.width,
+                'height': self.height,
+                'fps': self.fps,
+                'nb_frames': self.nb_frames,
+                'crop': None if self.crop is None else np.asarray(self.crop).tolist(),
+                'nb_fish': self.nb_fish,
+                'fish_length': self.fish_length,
+                'fish_width': self.fish_width,
+                'speed': self.speed,
+                'turn_std': self.turn_std,
+                'background': self.background,
+                'fish_value': self.fish_value,
+                'noise_std': self.noise_std,
+                'nb_noise_frames': self.nb_noise_frames,
+                'seed': self.seed,
+                'encoding_preset': self.encoding_preset,
+                'encoding_settings': self.encoding_settings}
+
+    def set_settings(self, settings):
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise ValueError('Unknown synthetic video setting: {}'.format(name))
+            setattr(self, name, value)
+        return self
+
+    def get_settings_key(self):
+        """short hash of the settings, names generated files"""
+        settings = json.dumps(self.get_settings(), sort_keys=True)
+        return hashlib.sha1(settings.encode('utf-8')).hexdigest()[:12]
+
+    def get_crop(self):
+        if self.crop is None:
+            return np.array([[0, 0], [self.height, self.width]])
+        return np.asarray(self.crop)
+
+    def get_fish_polygons(self, position, heading):
+        """head and tail polygons of a fish, position: blob reference point (x, y)"""
+        direction = np.array([np.cos(heading), np.sin(heading)])
+        angle_deg = int(round(np.degrees(heading)))
+        head_center = position + 0.2 * self.fish_length * direction
+        tail_center = position - 0.2 * self.fish_length * direction
+        head = cv2.ellipse2Poly(tuple(np.round(head_center).astype(int).tolist()),
+                                (int(round(0.3 * self.fish_length)), int(round(0.5 * self.fish_width))),
+                                angle_deg, 0, 360, 10)
+        tail = cv2.ellipse2Poly(tuple(np.round(tail_center).astype(int).tolist()),
+                                (int(round(0.3 * self.fish_length)), max(1, int(round(0.25 * self.fish_width)))),
+                                angle_deg, 0, 360, 10)
+        return [head, tail]
+
+    def get_trajectories(self):
+        """positions (nb_frames, nb_fish, 2) and headings (nb_frames, nb_fish), fish bounce off the crop"""
+        rng = np.random.RandomState(self.seed)
+        crop = self.get_crop()
+        margin = self.fish_length
+        lower = np.array([crop[0,1] + margin, crop[0,0] + margin], dtype=np.float64)
+        upper = np.array([crop[1,1] - margin, crop[1,0] - margin], dtype=np.float64)
+        if np.any(upper <= lower):
+            raise ValueError('Crop is too small for fish length: {}'.format(self.fish_length))
+
+        positions = np.empty((self.nb_frames, self.nb_fish, 2))
+        headings = np.empty((self.nb_frames, self.nb_fish))
+        position = lower + rng.uniform(size=(self.nb_fish, 2)) * (upper - lower)
+        heading = rng.uniform(-np.pi, np.pi, size=self.nb_fish)
+        for i in range(self.nb_frames):
+            positions[i] = position
+            headings[i] = heading
+            heading = heading + rng.normal(0., self.turn_std, size=self.nb_fish)
+            velocity = self.speed * np.stack([np.cos(heading), np.sin(heading)], axis=-1)
+            position = position + velocity
+            #reflect at the crop bounds
+            out_lower = position < lower
+            out_upper = position > upper
+            position = np.where(out_lower, 2 * lower - position, position)
+            position = np.where(out_upper, 2 * upper - position, position)
+            velocity = np.where(out_lower | out_upper, -velocity, velocity)
+            heading = np.arctan2(velocity[:, 1], velocity[:, 0])
+        return positions, headings
+
+    def get_noise_frames(self, rng):
+        if self.noise_std <= 0:
+            return None
+        shape = (self.nb_noise_frames, self.height, self.width, 1)
+        return np.round(rng.normal(0., self.noise_std, size=shape)).astype(np.int16)
+
+    def draw_frame(self, positions, headings, noise=None):
+        """frame and ground truth (centroid x, y, area) of every fish"""
+        mask = np.zeros((self.height, self.width), dtype=np.uint8)
+        fish_mask = np.zeros_like(mask)
+        ground_truth = np.empty((len(positions), 3))
+        for i in range(len(positions)):
+            polygons = self.get_fish_polygons(positions[i], headings[i])
+            x, y, w, h = cv2.boundingRect(np.concatenate(polygons, axis=0))
+            x, y = max(x, 0), max(y, 0)
+            fish_roi = fish_mask[y:y + h, x:x + w]
+            fish_roi[...] = 0
+            cv2.fillPoly(fish_mask, polygons, 1)
+            moments = cv2.moments(fish_roi, binaryImage=True)
+            ground_truth[i] = [x + moments['m10'] / moments['m00'],
+                               y + moments['m01'] / moments['m00'],
+                               moments['m00']]
+            mask[y:y + h, x:x + w] |= fish_roi
+        frame = np.where(mask[:, :, None] > 0, self.fish_value, self.background).astype(np.int16)
+        frame = np.repeat(frame, 3, axis=-1)
+        if noise is not None:
+            frame += noise
+        return np.clip(frame, 0, 255).astype(np.uint8), ground_truth
+
+    def generate(self, video_path):
+        """writes the video and its ground truth csv (video path without extension + '_ground_truth.csv')"""
+        logging.info('Generating synthetic video: ' + video_path)
+        rng = np.random.RandomState(self.seed + 1)
+        positions, headings = self.get_trajectories()
+        noise_frames = self.get_noise_frames(rng)
+        encoding_settings = get_encoding_settings(self.encoding_preset, **self.encoding_settings)
+        rows = []
+        with FFmpegVideoWriter(video_path, (self.width, self.height), self.fps, **encoding_settings) as writer:
+            for frame_num in range(self.nb_frames):
+                noise = None if noise_frames is None else noise_frames[frame_num % len(noise_frames)]
+                frame, ground_truth = self.draw_frame(positions[frame_num], headings[frame_num], noise)
+                writer.write_frame(frame)
+                rows.append(np.concatenate([np.full((self.nb_fish, 1), frame_num),
+                                            np.arange(self.nb_fish)[:, None],
+                                            ground_truth[:, :2],
+                                            headings[frame_num][:, None],
+                                            ground_truth[:, 2:]], axis=-1))
+        ground_truth = pd.DataFrame(np.concatenate(rows, axis=0),
+                                    columns=['frame_num', 'fish', 'pos_x_in_frame', 'pos_y_in_frame', 'angle', 'area'])
+        ground_truth[['frame_num', 'fish']] = ground_truth[['frame_num', 'fish']].astype(np.int64)
+        ground_truth_path = get_ground_truth_path(video_path)
+        ground_truth.to_csv(ground_truth_path, index=False)
+        logging.info('Ground truth saved at: ' + ground_truth_path)
+        return ground_truth
+
+
+def get_ground_truth_path(video_path):
+    return video_path.rsplit('.', 1)[0] + '_ground_truth.csv'
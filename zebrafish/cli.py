@@ -0,0 +1,215 @@
+"""
+Headless batch runner: detection, tracking and post-processing of a directory or a file list.
+
+    zebrafish run config.json [inputs ...] [--steps detection post]
+
+Config (json):
+    {"inputs": ["data"],                  directories (every file in them) or files
+     "steps": ["detection", "post"],
+     "settings": {                        Processor attributes, same names as in the app notebook
+        "detection_output_type": "data",
+        "post_output_type": "data",
+        "detection_processor": {"overall_crop": [[0, 320], [1080, 1730]],
+                                "detectors": {"ThresholdDetector": {"l_thresh": [0, 120]}}},
+        "postprocessor": {"tracker": "KalmanTracker",
+                          "trackers": {"KalmanTracker": {"mokt": {"max_age": 10}}},
+                          "post_methods_selected": {"DataConverter": true},
+                          "post_methods": {"DataConverter": {"fps": 30, "selected": {"pixel_diff_to_pixel_velocity": true}}}}}}
+"""
+import numpy as np
+import logging
+import argparse
+import json
+import os
+import sys
+from glob import glob
+
+STEPS = ['detection', 'post']
+
+#config names of private attributes
+SETTING_ALIASES = {
+    'detectors': '_available_detectors',
+    'trackers': '_available_trackers',
+    'post_methods': '_post_methods',
+    'post_methods_selected': '_post_methods_selected'
+}
+
+def is_settings_object(value):
+    return hasattr(value, '__dict__') and not isinstance(value, (type, np.ndarray))
+
+def convert_setting(current, value):
+    """value in the type of the current setting"""
+    if isinstance(current, np.ndarray):
+        return np.array(value, dtype=current.dtype)
+    if isinstance(current, tuple) and isinstance(value, list):
+        return tuple(value)
+    return value
+
+def apply_settings(target, settings, path='settings'):
+    """
+    Sets nested settings on target (objects and dicts), e.g.
+    {'postprocessor': {'trackers': {'KalmanTracker': {'mokt': {'max_age': 10}}}}}.
+    Unknown names raise ValueError.
+    """
+    for name, value in settings.items():
+        setting_path = path + '.' + name
+        if isinstance(target, dict):
+            if name not in target:
+                raise ValueError('Unknown setting: {}'.format(setting_path))
+            current = target[name]
+        else:
+            attr_name = SETTING_ALIASES.get(name, name)
+            if not hasattr(target, attr_name):
+                raise ValueError('Unknown setting: {}'.format(setting_path))
+            current = getattr(target, attr_name)
+
+        if isinstance(value, dict) and (is_settings_object(current) or isinstance(current, dict)):
+            apply_settings(current, value, setting_path)
+        elif isinstance(target, dict):
+            target[name] = convert_setting(current, value)
+        else:
+            setattr(target, attr_name, convert_setting(current, value))
+
+def load_config(config_path):
+    with open(config_path) as f:
+        config = json.load(f)
+    unknown = [name for name in config if name not in ['inputs', 'steps', 'settings']]
+    if len(unknown) > 0:
+        raise ValueError('Unknown config keys: {}'.format(unknown))
+    return config
+
+def get_input_files(inputs):
+    """files of inputs (directories: every file in them)"""
+    file_paths = []
+    for p in inputs:
+        if os.path.isdir(p):
+            file_paths += sorted(glob(os.path.join(p, '*.*')))
+        elif os.path.isfile(p):
+            file_paths.append(p)
+        else:
+            raise IOError('Input not found: {}'.format(p))
+    #same file given twice
+    file_paths = list(dict.fromkeys(file_paths))
+    #data is saved as csv and xlsx, post-process each data once (csv)
+    csv_stems = set(p[:-len('.csv')] for p in file_paths if p.endswith('.csv'))
+    return [p for p in file_paths if not (p.endswith('.xlsx') and p[:-len('.xlsx')] in csv_stems)]
+
+def run(config, inputs=None, steps=None, incremental=False, force=False):
+    """
+    runs steps of config on inputs (None: config inputs), returns the processor.
+    incremental: skips outputs that are up to date (Processor.run_incremental).
+    """
+    from zebrafish.core import Processor
+    inputs = inputs or config.get('inputs', [])
+    steps = steps or config.get('steps', STEPS)
+    unknown = [s for s in steps if s not in STEPS]
+    if len(unknown) > 0:
+        raise ValueError('Unknown steps: {}, available: {}'.format(unknown, STEPS))
+    if len(inputs) == 0:
+        raise ValueError('No inputs, give directories or files in the config or on the command line.')
+
+    processor = Processor()
+    apply_settings(processor, config.get('settings', {}))
+    file_paths = get_input_files(inputs)
+    if incremental:
+        pipeline_steps = []
+        if 'detection' in steps:
+            pipeline_steps.append('detection')
+            if processor.detection_output_type != 'data':
+                pipeline_steps.append('detection_video')
+        if 'post' in steps:
+            pipeline_steps += ['tracking', 'post']
+            if processor.post_output_type == 'video':
+                pipeline_steps.append('post_video')
+        processor.run_incremental(file_paths, pipeline_steps, force)
+        return processor
+    processor.update_file_paths(file_paths)
+
+    if 'detection' in steps:
+        processor.run_detection()
+        #detection data of this run is post-processed in the same run
+        detection_data_paths = []
+        if processor.detection_output_type != 'video':
+            saver = processor.detection_processor.saver
+            for p in processor._detection_file_paths:
+                detection_data_paths.append(p.split('.')[0] + saver.output_file_suffix + '.csv')
+        file_paths = get_input_files(inputs)
+        file_paths += [p for p in detection_data_paths if p not in file_paths and os.path.exists(p)]
+        processor.update_file_paths(file_paths)
+
+    if 'post' in steps:
+        processor.run_post()
+    return processor
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='zebrafish', description='Zebrafish detection, tracking and post-processing.')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='runs steps on a directory or files')
+    run_parser.add_argument('config', help='json config (inputs, steps, settings)')
+    run_parser.add_argument('inputs', nargs='*', help='directories or files (overrides config inputs)')
+    run_parser.add_argument('--steps', nargs='+', choices=STEPS, help='steps to run (overrides config steps)')
+    run_parser.add_argument('--incremental', action='store_true', help='skips outputs that are up to date')
+    run_parser.add_argument('--force', action='store_true', help='with --incremental, runs every stage')
+    run_parser.add_argument('--nb-render-workers', type=int, help='video rendering worker processes')
+    run_parser.add_argument('--profile', metavar='REPORT_PATH', help='profiles stages, saves the json report')
+    run_parser.add_argument('--log-level', default='INFO', help='logging level (default: INFO)')
+
+    watch_parser = subparsers.add_parser('watch', help='processes new videos of a directory as they are recorded')
+    watch_parser.add_argument('config', help='json config (settings, steps)')
+    watch_parser.add_argument('directory', nargs='?', help='directory to watch (default: first config input)')
+    watch_parser.add_argument('--nb-workers', type=int, default=2, help='worker processes (default: 2)')
+    watch_parser.add_argument('--stable-time', type=float, default=30.0,
+                              help='seconds without file changes before a video is queued (default: 30)')
+    watch_parser.add_argument('--poll-interval', type=float, default=5.0, help='seconds between scans (default: 5)')
+    watch_parser.add_argument('--log-level', default='INFO', help='logging level (default: INFO)')
+    return parser
+
+def watch(config, directory=None, nb_workers=2, stable_time_s=30.0, poll_interval_s=5.0):
+    """runs a WatchFolderService on directory until interrupted"""
+    from zebrafish.core import Processor
+    from zebrafish.service import WatchFolderService
+    directory = directory or (config.get('inputs') or [None])[0]
+    if directory is None or not os.path.isdir(directory):
+        raise ValueError('Directory to watch not found: {}'.format(directory))
+    processor = Processor()
+    apply_settings(processor, config.get('settings', {}))
+    service = WatchFolderService(processor, directory)
+    steps = config.get('steps', STEPS)
+    service.steps = (['detection'] if 'detection' in steps else []) + (['tracking', 'post'] if 'post' in steps else [])
+    service.nb_workers = nb_workers
+    service.stable_time_s = stable_time_s
+    service.poll_interval_s = poll_interval_s
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        logging.info('Watch stopped.')
+    return service
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.command not in ['run', 'watch']:
+        get_parser().print_help()
+        return 2
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    config = load_config(args.config)
+    if args.command == 'watch':
+        watch(config, args.directory, args.nb_workers, args.stable_time, args.poll_interval)
+        return 0
+    if args.nb_render_workers is not None:
+        settings = config.setdefault('settings', {})
+        for name in ['detection_processor', 'postprocessor']:
+            settings.setdefault(name, {})['nb_render_workers'] = args.nb_render_workers
+    if args.profile:
+        from zebrafish.utils import profiler
+        profiler.start()
+    try:
+        run(config, args.inputs, args.steps, args.incremental, args.force)
+    finally:
+        if args.profile:
+            profiler.stop()
+            profiler.save_report(args.profile)
+            logging.info('Profile summary:\n' + profiler.get_summary().to_string())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
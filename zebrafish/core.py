@@ -2,21 +2,56 @@ import numpy as np
 import logging
 import cv2
 import os
-from moviepy.editor import VideoFileClip
-import matplotlib.pyplot as plt
-from tqdm import tqdm
-import plotly.graph_objects as go
-from PIL import Image
 import pandas as pd
-from glob import glob
 import time
+import multiprocessing
+import itertools
+import shutil
+import tempfile
 
-from zebrafish.detector import ThresholdDetector
+from zebrafish.detector import ThresholdDetector, MotionGate
 from zebrafish.tracker import VicinityTracker, KalmanTracker
-from zebrafish.post import DataConverter, PositionBounder
+from zebrafish.post import DataConverter, PositionBounder, RegionLabeler, TrackIndex, PostPipeline, SummaryMetrics
 from zebrafish.saver import DetectionDataSaver, PostprocessDataSaver
-
-from zebrafish.utils import convert_angle
+from zebrafish.video import split_frame_range, render_video_segment, concat_videos
+from zebrafish.video import get_encoding_settings, FFmpegVideoReader, get_video_infos, get_scaled_size
+
+from zebrafish.utils import convert_angle, LabelAtlas, get_nb_label_lines, PreviewImageEncoder
+from zebrafish.utils.profiler import profiler
+from zebrafish.utils.progress import progress
+from zebrafish.pipeline import IncrementalPipeline, is_manifest_path
+from zebrafish.pipeline import FileCatalog, classify_file, scan_directory, get_post_video_stem
+
+def get_sample_frame_stats(detector_settings, overall_crop, video_path, frame_num, area_bin_edges,
+                           thumbnail_scale=0.25):
+    """
+    Detection stats of one frame: number of detections (hulls in size_bound), hull areas histogram
+    (areas above the last edge are counted in the last bin) and an annotated crop thumbnail.
+    Module level with the detector settings only, so sample workers get small arguments
+    (not the processor, its preview cache and detection data).
+    """
+    detector = ThresholdDetector.from_settings(detector_settings)
+    reader = FFmpegVideoReader(video_path, frame_num, frame_num + 1)
+    frame = None
+    for _, frame in reader.iter_frames():
+        pass
+    if frame is None:
+        return None
+    cropped_img = np.copy(frame[overall_crop[0,0]:overall_crop[1,0],
+                                overall_crop[0,1]:overall_crop[1,1], :])
+    processed_images, contours, convex_hulls, hull_moments = detector.process_image_staged(cropped_img)
+    areas = np.array([hm['m00'] for hm in hull_moments])
+    nb_detections = int(np.sum((areas >= detector.size_bound[0]) & (areas <= detector.size_bound[1])))
+    area_histogram = np.histogram(np.minimum(areas, area_bin_edges[-1]), bins=area_bin_edges)[0]
+
+    result_img = detector.draw_hull_areas(cropped_img, convex_hulls, hull_moments)
+    size = get_scaled_size((result_img.shape[1], result_img.shape[0]), thumbnail_scale)
+    thumbnail = cv2.resize(result_img, size, interpolation=cv2.INTER_AREA)
+    return {'frame_num': frame_num,
+            'nb_detections': nb_detections,
+            'nb_blobs': len(areas),
+            'area_histogram': area_histogram,
+            'thumbnail': thumbnail}
 
 class VideoProcessor(object):
 
@@ -28,6 +63,128 @@ class VideoProcessor(object):
         self.image_width = 3840
         self.fps = 30.0
         self.frame_num = 0
+        self._video_fps = None #fps of the video being rendered
+
+        #overlay labels (label_density: 'full', 'ids', 'every_n')
+        self.use_label_atlas = True
+        self.label_density = 'full'
+        self.label_every_n_frames = 10
+        self._label_atlas = None
+
+        #rendering: > 1 renders frame segments in worker processes
+        self.nb_render_workers = 1
+        #encoding: preset name in ENCODING_PRESETS ('default', 'fast_qa', 'archive'),
+        #encoding_settings overrides codec, preset, crf, pix_fmt, threads
+        self.encoding_preset = 'default'
+        self.encoding_settings = {}
+
+        #QA rendering: render_scale < 1 renders downscaled frames (e.g. 0.5, 0.25),
+        #render_stride > 1 renders every render_stride-th frame (written at fps / render_stride)
+        self.render_scale = 1.0
+        self.render_stride = 1
+
+    def get_label_atlas(self, scale=1.0):
+        if not self.use_label_atlas:
+            return None
+        font_size = self.text_font_size * scale
+        thickness = max(1, int(round(2 * scale)))
+        if (self._label_atlas is None or self._label_atlas.font_size != font_size or
+                self._label_atlas.thickness != thickness):
+            self._label_atlas = LabelAtlas(font_size=font_size, thickness=thickness)
+        return self._label_atlas
+
+    def get_decode_scale(self):
+        """scale of decoded frames passed to render_frame"""
+        return self.render_scale
+
+    def render_frame(self, frame, frame_num):
+        return frame
+
+    def get_encoding_settings(self):
+        return get_encoding_settings(self.encoding_preset, **self.encoding_settings)
+
+    def get_render_settings(self):
+        """parameters that change rendered videos (nb_render_workers does not)"""
+        return {'encoding': self.get_encoding_settings(),
+                'render_scale': self.render_scale,
+                'render_stride': self.render_stride,
+                'use_label_atlas': self.use_label_atlas,
+                'label_density': self.label_density,
+                'label_every_n_frames': self.label_every_n_frames,
+                'text_font_size': self.text_font_size}
+
+    def check_video_fps(self, video_path):
+        video_fps = get_video_infos(video_path)['fps']
+        if abs(video_fps - self.fps) > 1e-3:
+            logging.info('Video fps ({}) differs from fps ({}). Data frame_num is sampled at fps.'.format(video_fps, self.fps))
+        return video_fps
+
+    def get_source_frame_idx(self, frame_num, video_fps):
+        """index of the decoded frame of data frame_num (sampled at fps, as moviepy iter_frames(fps))"""
+        return int(frame_num * video_fps / self.fps + 1e-5)
+
+    def get_data_frame_num(self, frame_idx):
+        """data frame_num of decoded frame frame_idx of the rendered video (last sample at or before it)"""
+        if self._video_fps is None or abs(self._video_fps - self.fps) <= 1e-3:
+            return frame_idx
+        return int(np.ceil((frame_idx + 1 - 1e-5) * self.fps / self._video_fps)) - 1
+
+    def iter_sampled_frames(self, reader, video_fps):
+        """
+        (frame_num, frame) of decoded frames sampled at fps. Same as the decoded frames if the video is at fps,
+        otherwise frames are skipped (higher video fps) or repeated (lower video fps).
+        """
+        if abs(video_fps - self.fps) <= 1e-3:
+            for frame_num, frame in reader.iter_frames():
+                yield frame_num, frame
+            return
+        frame_num = 0
+        for frame_idx, frame in reader.iter_frames():
+            while self.get_source_frame_idx(frame_num, video_fps) <= frame_idx:
+                yield frame_num, frame
+                frame_num += 1
+
+    def write_video(self, video_path, video_output_path):
+        """
+        Renders decoded frames in order, render_frame gets the data frame_num of each frame
+        (the decoded frame index if the video is at fps).
+        """
+        self._video_fps = self.check_video_fps(video_path)
+        if self.render_scale != 1 or self.render_stride != 1:
+            logging.info('QA rendering, scale: {}, every {} frame(s)'.format(self.render_scale, self.render_stride))
+        if self.nb_render_workers > 1:
+            self.write_video_parallel(video_path, video_output_path)
+        else:
+            render_video_segment(self.render_frame, video_path, video_output_path,
+                                 encoding_settings=self.get_encoding_settings(), show_progress=True,
+                                 scale=self.get_decode_scale(), stride=self.render_stride)
+
+    def write_video_parallel(self, video_path, video_output_path):
+        """
+        Renders frame segments in worker processes (each with its own reader),
+        then joins segments without re-encoding. Frames are the same as the serial output.
+        """
+        nb_frames = get_video_infos(video_path)['nb_frames']
+        segments = split_frame_range(nb_frames, self.nb_render_workers, self.render_stride)
+        logging.info('Rendering {} frames in {} segments...'.format(nb_frames, len(segments)))
+        segment_dir = tempfile.mkdtemp(dir=os.path.dirname(video_output_path) or '.')
+        segment_paths = [os.path.join(segment_dir, 'segment_{:04d}.mp4'.format(i)) for i in range(len(segments))]
+        encoding_settings = self.get_encoding_settings()
+        #last segment reads until the end, frame count estimated from duration may be off
+        args = [(self.render_frame, video_path, segment_paths[i], start,
+                 end if i < len(segments) - 1 else None, encoding_settings, False,
+                 self.get_decode_scale(), self.render_stride)
+                for i, (start, end) in enumerate(segments)]
+        pool = multiprocessing.Pool(len(segments))
+        try:
+            pool.starmap(render_video_segment, args)
+        finally:
+            pool.close()
+            pool.join()
+        try:
+            concat_videos(segment_paths, video_output_path)
+        finally:
+            shutil.rmtree(segment_dir)
 
     @property
     def video_path(self):
@@ -54,65 +211,152 @@ class DetectionProcessor(VideoProcessor):
         self._detector_name = default_detector
         self._detector = self._available_detectors[self._detector_name]
         self.saver = DetectionDataSaver()
+        self._preview_frame = (None, None) #((video path, mtime), first frame)
+
+        #motion gating: low motion frames are not detected, rows are flagged 'measured' (1) or carried (0)
+        self.motion_gating = False
+        self.motion_gate = MotionGate()
+
+    def __getstate__(self):
+        #render workers get render_frame bound to the processor, the preview frame is not sent
+        state = self.__dict__.copy()
+        state['_preview_frame'] = (None, None)
+        return state
 
     def reset(self):
         self.saver.clear()
         self.frame_num = 0
+        self._detector.reset_multiscale()
+        self.motion_gate.reset()
+        self.saver.flag_data_names = ['measured'] if self.motion_gating else []
+
+    def get_detection_settings(self):
+        """parameters that change detection data"""
+        settings = {'detector': self._detector_name,
+                    'detector_settings': self._detector.get_settings(),
+                    'overall_crop': np.asarray(self.overall_crop).tolist(),
+                    'flow_left_to_right': self.flow_left_to_right}
+        if self.motion_gating:
+            settings['motion_gate'] = self.motion_gate.get_settings()
+        return settings
+
+    def get_render_settings(self):
+        settings = super(DetectionProcessor, self).get_render_settings()
+        settings.update({'detection': self.get_detection_settings(),
+                         'ang_text_y_diff': self.ang_text_y_diff})
+        return settings
+
+    def get_zero_angle(self):
+        return 'left' if self.flow_left_to_right else 'right'
+
+    def get_detection_rows(self, position, angle, hulls, angle_vector):
+        """detection data rows (saver input_data_names) of a frame, None without detections"""
+        if len(position) == 0:
+            return None
+        pos_x_in_crop = position[:, :1]
+        pos_y_in_crop = position[:, 1:]
+        pos_x_in_frame = pos_x_in_crop + self.overall_crop[0,1]
+        pos_y_in_frame = pos_y_in_crop + self.overall_crop[0,0]
+
+        rel_ang_rad, rel_ang_deg = convert_angle(angle, zero_angle=self.get_zero_angle())
+
+        bboxes = self._detector.convert_hulls_to_bboxes(hulls)
+        bbox_tl_x_in_crop = bboxes[:, :1]
+        bbox_tl_y_in_crop = bboxes[:, 1:2]
+        bbox_br_x_in_crop = bboxes[:, 2:3]
+        bbox_br_y_in_crop = bboxes[:, 3:]
+
+        angle = np.expand_dims(angle, axis=-1)
+        rel_ang_rad = np.expand_dims(rel_ang_rad, axis=-1)
+        rel_ang_deg = np.expand_dims(rel_ang_deg, axis=-1)
+        return np.concatenate([pos_x_in_crop,
+                               pos_y_in_crop,
+                               pos_x_in_frame,
+                               pos_y_in_frame,
+                               bbox_tl_x_in_crop,
+                               bbox_tl_y_in_crop,
+                               bbox_br_x_in_crop,
+                               bbox_br_y_in_crop,
+                               angle,
+                               angle_vector,
+                               rel_ang_rad,
+                               rel_ang_deg], axis=-1)
+
+    def interpolate_detection_rows(self, rows, next_rows, ratio):
+        """
+        rows of a carried frame between two measured frames (ratio: 0 at rows, 1 at next_rows).
+        Detections matched by the motion gate are interpolated (angle from the interpolated angle vector),
+        others are held.
+        """
+        if rows is None:
+            return None
+        if next_rows is None:
+            return rows
+        idx = self.saver.input_data_names_idx
+        position_idxs = [idx['pos_x_in_crop'], idx['pos_y_in_crop']]
+        matched, next_matched = self.motion_gate.match_positions(rows[:, position_idxs], next_rows[:, position_idxs])
+        carried_rows = np.copy(rows)
+        linear_idxs = [i for name, i in idx.items() if name not in ['angle', 'rel_angle_rad', 'rel_angle_deg']]
+        for i in linear_idxs:
+            carried_rows[matched, i] = (1. - ratio) * rows[matched, i] + ratio * next_rows[next_matched, i]
+        angle = np.arctan2(carried_rows[matched, idx['angle_vector_y']], carried_rows[matched, idx['angle_vector_x']])
+        rel_ang_rad, rel_ang_deg = convert_angle(angle, zero_angle=self.get_zero_angle())
+        carried_rows[matched, idx['angle']] = angle
+        carried_rows[matched, idx['rel_angle_rad']] = rel_ang_rad
+        carried_rows[matched, idx['rel_angle_deg']] = rel_ang_deg
+        return carried_rows
 
     def save_detection_data(self, video_path):
         self.video_path = video_path
-        clip = VideoFileClip(video_path)
+        video_fps = self.check_video_fps(video_path)
+        reader = FFmpegVideoReader(video_path)
         logging.info('Saving detection data...')
 
         #reset
         self.reset()
 
-        for frame in clip.iter_frames(fps=self.fps, logger='bar'):
+        gate = self.motion_gate if self.motion_gating else None
+        measured_rows = None
+        carried_frame_nums = [] #frames waiting for the next measured frame (interpolation)
+        total = int(round(reader.nb_frames * self.fps / video_fps))
+        for frame_num, frame in progress.iterate(self.iter_sampled_frames(reader, video_fps), 'detection', total=total):
+            self.frame_num = frame_num
             cropped_img = frame[self.overall_crop[0,0]:self.overall_crop[1,0],
                             self.overall_crop[0,1]:self.overall_crop[1,1], :]
 
+            if gate is not None and not gate.is_measured(cropped_img):
+                if gate.carry_mode == 'interpolate':
+                    carried_frame_nums.append(frame_num)
+                elif measured_rows is not None:
+                    self.saver.add_data_by_frame(measured_rows, frame_num, flags=(0,))
+                continue
+
             position, angle, hulls, angle_vector = self._detector.detect_position_and_angle(cropped_img)
-            if len(position) > 0:
-                pos_x_in_crop = position[:, :1]
-                pos_y_in_crop = position[:, 1:]
-                pos_x_in_frame = pos_x_in_crop + self.overall_crop[0,1]
-                pos_y_in_frame = pos_y_in_crop + self.overall_crop[0,0]
-
-                if self.flow_left_to_right:
-                    zero_angle = 'left'
-                else:
-                    zero_angle = 'right'
-                rel_ang_rad, rel_ang_deg = convert_angle(angle, zero_angle=zero_angle)
-
-                bboxes = self._detector.convert_hulls_to_bboxes(hulls)
-                bbox_tl_x_in_crop = bboxes[:, :1]
-                bbox_tl_y_in_crop = bboxes[:, 1:2]
-                bbox_br_x_in_crop = bboxes[:, 2:3]
-                bbox_br_y_in_crop = bboxes[:, 3:]
-
-                angle = np.expand_dims(angle, axis=-1)
-                rel_ang_rad = np.expand_dims(rel_ang_rad, axis=-1)
-                rel_ang_deg = np.expand_dims(rel_ang_deg, axis=-1)
-                data = np.concatenate([pos_x_in_crop,
-                                       pos_y_in_crop,
-                                       pos_x_in_frame,
-                                       pos_y_in_frame,
-                                       bbox_tl_x_in_crop,
-                                       bbox_tl_y_in_crop,
-                                       bbox_br_x_in_crop,
-                                       bbox_br_y_in_crop,
-                                       angle,
-                                       angle_vector,
-                                       rel_ang_rad,
-                                       rel_ang_deg], axis=-1)
-                self.saver.add_data_by_frame(data, self.frame_num)
-            self.frame_num += 1
+            rows = self.get_detection_rows(position, angle, hulls, angle_vector)
+            if gate is None:
+                if rows is not None:
+                    self.saver.add_data_by_frame(rows, self.frame_num)
+                continue
+            for i, carried_frame_num in enumerate(carried_frame_nums):
+                carried_rows = self.interpolate_detection_rows(measured_rows, rows, (i + 1.) / (len(carried_frame_nums) + 1))
+                if carried_rows is not None:
+                    self.saver.add_data_by_frame(carried_rows, carried_frame_num, flags=(0,))
+            carried_frame_nums = []
+            if rows is not None:
+                self.saver.add_data_by_frame(rows, self.frame_num, flags=(1,))
+            measured_rows = rows
+
+        if gate is not None:
+            #frames after the last measured frame
+            for carried_frame_num in carried_frame_nums:
+                if measured_rows is not None:
+                    self.saver.add_data_by_frame(measured_rows, carried_frame_num, flags=(0,))
+            logging.info('Motion gating: {} of {} frames measured'.format(gate.nb_measured, gate.nb_frames))
 
         #save data
         self.saver.save()
-        clip.close()
 
-    def get_detection_frame(self, frame):
+    def get_detection_frame(self, frame, frame_num=0):
         frame = np.copy(frame)
         cropped_img = frame[self.overall_crop[0,0]:self.overall_crop[1,0],
                             self.overall_crop[0,1]:self.overall_crop[1,1], :]
@@ -121,7 +365,11 @@ class DetectionProcessor(VideoProcessor):
             zero_angle = 'left'
         else:
             zero_angle = 'right'
-        cropped_detection_img = self._detector.draw_detection_img(cropped_img, zero_angle=zero_angle)
+        nb_label_lines = get_nb_label_lines(3, self.label_density, frame_num, self.label_every_n_frames)
+        cropped_detection_img = self._detector.draw_detection_img(cropped_img, zero_angle=zero_angle,
+                                                                  text_font_size=self.text_font_size,
+                                                                  label_atlas=self.get_label_atlas(),
+                                                                  nb_label_lines=nb_label_lines)
         frame[self.overall_crop[0,0]:self.overall_crop[1,0],
               self.overall_crop[0,1]:self.overall_crop[1,1], :] = cropped_detection_img
 
@@ -135,26 +383,88 @@ class DetectionProcessor(VideoProcessor):
         file_name = names[-1].split('.')[0] + '_detection.mp4'
         video_output_path_list = names[:-1] + ['detection_video', file_name]
         video_output_path = os.path.join(*video_output_path_list)
-        clip = VideoFileClip(video_path)
         logging.info('Saving detection video...')
-        out_clip = clip.fl(lambda gf, t: self.get_detection_frame(gf(t)), [])
-        out_clip.write_videofile(video_output_path, audio=False, fps=self.fps)
+        self.write_video(video_path, video_output_path)
         logging.info('Saved detection video at: ' + video_output_path)
-        clip.close()
+
+    def get_decode_scale(self):
+        #detection runs on full resolution frames, rendered frames are downscaled
+        return 1.0
+
+    def render_frame(self, frame, frame_idx):
+        with profiler.stage('render.detection_overlay'):
+            frame = self.get_detection_frame(frame, self.get_data_frame_num(frame_idx))
+        if self.render_scale != 1:
+            size = get_scaled_size((frame.shape[1], frame.shape[0]), self.render_scale)
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return frame
 
     def get_preview(self, video_path):
-        clip = VideoFileClip(video_path)
-        first_frame = clip.get_frame(0)
-        step_images = [np.copy(first_frame)]
+        """
+        Preview images, names and offsets (x, y) of each image in the frame.
+        The first frame is full size with the crop drawn, detection steps are crop sized.
+        """
+        video_key = (video_path, os.path.getmtime(video_path))
+        if self._preview_frame[0] != video_key:
+            reader = FFmpegVideoReader(video_path, 0, 1)
+            self._preview_frame = (video_key, next(reader.iter_frames())[1])
+            reader.close()
+        first_frame = np.copy(self._preview_frame[1])
+        step_images = [first_frame]
         step_names = ['first_frame', ]
+        step_offsets = [(0, 0)]
         if self._detector_name == 'ThresholdDetector':
-            detection_step_images, detection_step_names = self._detector.get_preview_images(first_frame, self.overall_crop)
+            detection_step_images, detection_step_names = self._detector.get_preview_images(first_frame, self.overall_crop,
+                                                                                            frame_key=video_key + (0,))
             step_images += detection_step_images
             step_names += detection_step_names
+            step_offsets += [(self.overall_crop[0,1], self.overall_crop[0,0])] * len(detection_step_images)
         else:
             pass
-        clip.close()
-        return step_images, step_names
+        cv2.rectangle(first_frame, (self.overall_crop[0, 1], self.overall_crop[0, 0]),
+                      (self.overall_crop[1, 1], self.overall_crop[1, 0]), (255, 0, 0), 4)
+        return step_images, step_names, step_offsets
+
+    def get_preview_samples(self, video_path, nb_samples=8, nb_workers=None, area_bin_edges=None,
+                            thumbnail_scale=0.25):
+        """
+        Runs the detector on nb_samples evenly spaced frames in worker processes.
+        Returns frame_nums, nb_detections, nb_blobs, area_bin_edges, area_histograms (nb frames x nb bins)
+        and thumbnails (annotated crops).
+        """
+        nb_frames = get_video_infos(video_path)['nb_frames']
+        frame_nums = np.unique(np.linspace(0, nb_frames, nb_samples, endpoint=False).astype(np.int64)).tolist()
+        if area_bin_edges is None:
+            area_bin_edges = np.linspace(0, 2 * self._detector.size_bound[1], 21)
+        if nb_workers is None:
+            nb_workers = multiprocessing.cpu_count()
+        nb_workers = max(1, min(nb_workers, len(frame_nums)))
+        logging.info('Sampling {} frames in {} workers...'.format(len(frame_nums), nb_workers))
+
+        detector_settings = self._detector.get_settings()
+        overall_crop = np.asarray(self.overall_crop)
+        args = [(detector_settings, overall_crop, video_path, frame_num, area_bin_edges, thumbnail_scale)
+                for frame_num in frame_nums]
+        if nb_workers > 1:
+            pool = multiprocessing.Pool(nb_workers)
+            try:
+                frame_stats = pool.starmap(get_sample_frame_stats, args)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            frame_stats = [get_sample_frame_stats(*a) for a in args]
+        #frames past the end of the video (frame count estimated from duration) are dropped
+        frame_stats = [s for s in frame_stats if s is not None]
+
+        samples = {'frame_nums': np.array([s['frame_num'] for s in frame_stats]),
+                   'nb_detections': np.array([s['nb_detections'] for s in frame_stats]),
+                   'nb_blobs': np.array([s['nb_blobs'] for s in frame_stats]),
+                   'area_bin_edges': area_bin_edges,
+                   'area_histograms': np.array([s['area_histogram'] for s in frame_stats]).reshape(-1, len(area_bin_edges) - 1),
+                   'thumbnails': [s['thumbnail'] for s in frame_stats]}
+        logging.info('Detections per frame: {}'.format(samples['nb_detections'].tolist()))
+        return samples
 
     @property
     def video_path(self):
@@ -202,21 +512,34 @@ class PostProcessor(VideoProcessor):
         self._tracker_name = default_tracker
         self.run_tracker = True
         self._tracker = self._available_trackers[self._tracker_name]
-        self._post_methods = {
-            'DataConverter': DataConverter(),
-            'PositionBounder': PositionBounder()
-        }
-        self._post_methods_selected = {
-            'DataConverter': False,
-            'PositionBounder': False
-        }
+        #post methods run as pipeline stages in registration order
+        self.post_pipeline = PostPipeline()
+        self.post_pipeline.register('PositionBounder', PositionBounder())
+        self.post_pipeline.register('RegionLabeler', RegionLabeler())
+        self.post_pipeline.register('DataConverter', DataConverter())
+        self._post_methods = self.post_pipeline.stages
+        self._post_methods_selected = self.post_pipeline.selected
         self.saver = PostprocessDataSaver()
+        self.save_track_index = True
+        self.track_index = None
+        #per-fish summary (SummaryMetrics params: time_bin_s, oriented_angle_deg, ...)
+        self.save_summary = False
+        self.summary_metrics = SummaryMetrics()
+        #chunked post-processing: detection rows read per chunk (None: whole file in memory)
+        self.chunksize = None
 
         #video data
         self.video_data = None
         self.frame_idx = None
         self.detected_frames = None
-        self.frame_idx_dict = None
+        self.frame_offsets = None
+        self.draw_data = None
+        self._draw_scale = 1.0
+
+        #output frame
+        self._output_mode_list = ['full', 'crop']
+        self._output_mode = 'full'
+        self._output_frame = None
 
     def get_frame_idx(self, data):
         frame_num = data['frame_num'].iloc[0]
@@ -232,113 +555,340 @@ class PostProcessor(VideoProcessor):
     def set_video_data(self, data):
         data = data.sort_values(by=['frame_num', 'id'])
         self.video_data = data
-        self.frame_idx = self.get_frame_idx(data)
 
-        valid_frames = (np.array(self.video_data['frame_num'])[self.frame_idx[:-1]]).astype(np.int)
-        last_frame = valid_frames[-1]
-        self.detected_frames = np.full(last_frame + 1, False)
-        self.detected_frames[valid_frames] = True
-
-        self.frame_idx_dict = {vframe:(self.frame_idx[i], self.frame_idx[i+1])
-                              for i, vframe in enumerate(valid_frames)}
+        #frame offset table: rows of frame f are [frame_offsets[f], frame_offsets[f + 1])
+        frame_nums = np.array(data['frame_num']).astype(np.int64)
+        last_frame = frame_nums[-1]
+        self.frame_offsets = np.searchsorted(frame_nums, np.arange(last_frame + 2), side='left')
+        self.detected_frames = self.frame_offsets[1:] > self.frame_offsets[:-1]
+        frame_starts = np.flatnonzero(frame_nums[1:] != frame_nums[:-1]) + 1
+        self.frame_idx = [0] + frame_starts.tolist() + [len(frame_nums)]
+        self.set_draw_data(self.render_scale)
+
+    def set_draw_data(self, scale=1.0):
+        """contiguous columns for drawing (points in render scale), computed once for every row"""
+        data = self.video_data
+        pos = self.get_draw_columns(data, ['pos_x_in_crop', 'pos_y_in_crop'])
+        angle_vector = self.get_draw_columns(data, ['angle_vector_x', 'angle_vector_y'])
+        pos_int = (pos * scale).astype(np.int64)
+        arrow_start_points = ((pos - angle_vector) * scale).astype(np.int64)
+        arrow_end_points = (arrow_start_points + self.ang_draw_ratio * angle_vector * scale).astype(np.int64)
+        text_pos_int = np.copy(pos_int)
+        text_pos_int[:, 0] += int(round(self.text_x_diff * scale))
+        text_pos_int[:, 1] += int(round(self.text_start_y_diff * scale))
+        self._draw_scale = scale
+        self.draw_data = {
+            'pos': pos,
+            'pos_int': pos_int,
+            'arrow_start_points': arrow_start_points,
+            'arrow_end_points': arrow_end_points,
+            'text_pos_int': text_pos_int,
+            'id': self.get_draw_columns(data, ['id'])[:, 0],
+            'vel': self.get_draw_columns(data, ['velocity_pixel_x', 'velocity_pixel_y']),
+            'acc': self.get_draw_columns(data, ['acc_pixel_x', 'acc_pixel_y']),
+            'ang': self.get_draw_columns(data, ['rel_angle_deg'])[:, 0],
+        }
 
-    def save_post_data(self, post_data_path, frame_cut=(0, None)):
-        self.post_data_path = post_data_path
-        logging.info('Reading from: ' + post_data_path)
+    def get_draw_columns(self, data, names):
+        """columns as a contiguous float array, missing columns (not converted) are nan"""
+        columns = np.full((len(data), len(names)), np.nan)
+        for i, name in enumerate(names):
+            if name in data.columns:
+                columns[:, i] = np.array(data[name], dtype=np.float64)
+        return columns
+
+    def get_tracking_settings(self, frame_cut=(0, None)):
+        """parameters that change tracked data"""
+        settings = {'run_tracker': self.run_tracker, 'frame_cut': list(frame_cut)}
+        if self.run_tracker:
+            settings.update({'tracker': self._tracker_name,
+                             'tracker_settings': self._tracker.get_settings()})
+        return settings
+
+    def get_post_settings(self):
+        """
+        parameters that change post data of tracked data, with the overall_crop and summary fps
+        that save_post_data sets on the post methods
+        """
+        pipeline_settings = self.post_pipeline.get_settings()
+        for name, stage_settings in pipeline_settings['stages']:
+            if name == 'RegionLabeler':
+                stage_settings['overall_crop'] = np.asarray(self.overall_crop).tolist()
+        settings = {'post_pipeline': pipeline_settings,
+                    'save_track_index': self.save_track_index,
+                    'save_summary': self.save_summary}
+        if self.save_summary:
+            settings['summary_metrics'] = self.summary_metrics.get_settings()
+            settings['summary_metrics']['fps'] = self._post_methods['DataConverter'].fps
+        return settings
+
+    def get_render_settings(self):
+        settings = super(PostProcessor, self).get_render_settings()
+        settings.update({'overall_crop': np.asarray(self.overall_crop).tolist(),
+                         'output_mode': self._output_mode,
+                         'pos_draw_radius': self.pos_draw_radius,
+                         'ang_draw_ratio': self.ang_draw_ratio,
+                         'text_x_diff': self.text_x_diff,
+                         'text_start_y_diff': self.text_start_y_diff,
+                         'text_y_increment': self.text_y_increment,
+                         'ang_text_y_diff': self.ang_text_y_diff,
+                         'id_text_y_diff': self.id_text_y_diff})
+        return settings
+
+    def read_data(self, data_path):
+        logging.info('Reading from: ' + data_path)
         try:
-            data = pd.read_csv(post_data_path)
+            return pd.read_csv(data_path)
         except:
-            data = pd.read_excel(post_data_path)
+            return pd.read_excel(data_path)
+
+    def cut_frames(self, data, frame_cut=(0, None), first_frame=0):
+        """
+        rows of the frames (with detections) [start, end) of frame_cut (end None: to the last frame).
+        first_frame: position of the first frame of data in the whole data (chunks).
+        Returns the rows (index from 0) and the nb of frames in data.
+        """
+        if len(data) == 0:
+            return data, 0
+        frame_starts = self.get_frame_starts(data)
+        nb_frames = len(frame_starts)
+        if tuple(frame_cut) == (0, None):
+            return data, nb_frames
+        bounds = np.append(frame_starts, len(data))
+        start = min(max(frame_cut[0] - first_frame, 0), nb_frames)
+        end = nb_frames if frame_cut[1] is None else min(max(frame_cut[1] - first_frame, start), nb_frames)
+        return data.iloc[bounds[start]:bounds[end]].reset_index(drop=True), nb_frames
+
+    def track_data(self, data, frame_cut=(0, None)):
+        #frames out of frame_cut are dropped (same rows as the chunked path)
+        data, _ = self.cut_frames(data, frame_cut)
         if self.run_tracker:
             self._tracker.initialize()
-            data = self._tracker.track(data, frame_cut=frame_cut)
-        if self._post_methods_selected['PositionBounder']:
-            data = self._post_methods['PositionBounder'].run(data)
-        if self._post_methods_selected['DataConverter']:
-            data = self._post_methods['DataConverter'].run(data)
+            with profiler.stage('tracker.track'):
+                data = self._tracker.track(data)
+        return data
+
+    def save_tracked_data(self, post_data_path, frame_cut=(0, None)):
+        """tracks detection data and saves it (before post methods), returns the tracked data path"""
+        self.post_data_path = post_data_path
+        data = self.track_data(self.read_data(post_data_path), frame_cut)
+        return self.saver.save_tracked(data)
+
+    def save_post_data(self, post_data_path, frame_cut=(0, None), tracked_data_path=None):
+        """
+        Tracks detection data, runs post methods and saves post data.
+        tracked_data_path: tracked data of post_data_path (save_tracked_data), tracking is skipped.
+        """
+        if self.chunksize is not None:
+            return self.save_post_data_chunked(post_data_path, self.chunksize, frame_cut)
+        self.post_data_path = post_data_path
+        if tracked_data_path is None:
+            data = self.track_data(self.read_data(post_data_path), frame_cut)
+        else:
+            data = self.read_data(tracked_data_path)
+        self._post_methods['RegionLabeler'].overall_crop = self.overall_crop
+        with profiler.stage('post.pipeline'):
+            data = self.post_pipeline.run(data)
         self.saver.save(data)
+        if self.save_track_index and 'id' in data.columns:
+            self.track_index = TrackIndex().build(data)
+            self.saver.save_track_index(self.track_index)
+        if self.save_summary and 'id' in data.columns:
+            self.summary_metrics.fps = self._post_methods['DataConverter'].fps
+            self.saver.save_summary(self.summary_metrics.summarize(data))
+        logging.info('Post data saved.')
+        return self.saver.output_file_path
+
+    def get_frame_starts(self, data):
+        """row positions where a new frame starts"""
+        frame_nums = np.asarray(data['frame_num'])
+        return np.concatenate([[0], np.flatnonzero(frame_nums[1:] != frame_nums[:-1]) + 1]).astype(np.int64)
+
+    def save_post_data_chunked(self, post_data_path, chunksize=100000, frame_cut=(0, None)):
+        """
+        Post-processing of a detection csv in chunks of rows (frame order), memory is bounded by chunksize.
+        frame_cut: frames kept, as in track_data.
+        Tracker state and the last row of each id are carried across chunks. Rows of the last
+        nb_context_frames frames of a chunk are held back until their ids and found_after are final.
+        Post data is appended to the csv output (no xlsx, no track index).
+        """
+        self.post_data_path = post_data_path
+        logging.info('Reading in chunks of {} rows from: {}'.format(chunksize, post_data_path))
+        if self.run_tracker:
+            self._tracker.initialize()
+            nb_context_frames = self._tracker.get_nb_context_frames()
+        self._post_methods['RegionLabeler'].overall_crop = self.overall_crop
+        if self.save_summary:
+            self.summary_metrics.fps = self._post_methods['DataConverter'].fps
+            self.summary_metrics.reset()
+
+        pending = None #rows of the last frame read, the frame may continue in the next chunk
+        tail = None #tracked rows held back
+        last_rows = None
+        columns = None
+        nb_rows = 0
+        nb_summarized_rows = 0
+        nb_frames_read = 0
+        reader = pd.read_csv(post_data_path, chunksize=chunksize)
+        for chunk in itertools.chain(reader, [None]):
+            is_last_chunk = chunk is None
+            data = pd.concat([d for d in [pending, chunk] if d is not None], ignore_index=True, sort=False)
+            if not is_last_chunk:
+                frame_starts = self.get_frame_starts(data)
+                pending = data.iloc[frame_starts[-1]:]
+                data = data.iloc[:frame_starts[-1]]
+                if len(data) == 0:
+                    continue
+            #frame_cut: frames are counted over the whole data
+            data, nb_frames = self.cut_frames(data, frame_cut, nb_frames_read)
+            nb_frames_read += nb_frames
+            if len(data) == 0 and not is_last_chunk:
+                continue
+
+            if self.run_tracker:
+                nb_tracked_frames = 0 if tail is None else len(self.get_frame_starts(tail))
+                data = pd.concat([d for d in [tail, data] if d is not None and len(d) > 0], ignore_index=True, sort=False)
+                if len(data) == 0:
+                    break
+                with profiler.stage('tracker.track'):
+                    data = self._tracker.track_chunk(data, nb_tracked_frames)
+
+                #hold back the last frames, ids there can still be matched by the next chunk
+                frame_starts = self.get_frame_starts(data)
+                if is_last_chunk or len(frame_starts) <= nb_context_frames:
+                    nb_final_rows = len(data) if is_last_chunk else 0
+                else:
+                    nb_final_rows = frame_starts[len(frame_starts) - nb_context_frames]
+                tail = data.iloc[nb_final_rows:].reset_index(drop=True)
+                with profiler.stage('tracker.track_data'):
+                    data, last_rows = self._tracker.get_chunk_track_data(data.iloc[:nb_final_rows], last_rows, tail)
+                if len(data) == 0:
+                    continue
+
+            with profiler.stage('post.pipeline'):
+                data = self.post_pipeline.run(data)
+            if columns is None:
+                columns = list(data.columns)
+            self.saver.save_chunk(data[columns], is_first_chunk=nb_rows == 0)
+            nb_rows += len(data)
+            if self.save_summary and 'id' in data.columns:
+                self.summary_metrics.add_chunk(data)
+                nb_summarized_rows += len(data)
+            logging.info('Post data rows saved: {}'.format(nb_rows))
+
+        #as save_post_data: summary of tracked data (id column) only
+        if self.save_summary and nb_summarized_rows > 0:
+            self.saver.save_summary(self.summary_metrics.get_summary())
         logging.info('Post data saved.')
         return self.saver.output_file_path
 
+    def get_track_index(self, post_data_path):
+        """
+        Reads post data and its track index (built from the data if the index file is missing).
+        """
+        try:
+            data = pd.read_csv(post_data_path)
+        except:
+            data = pd.read_excel(post_data_path)
+        track_index_path = post_data_path.split('.')[0] + self.saver.track_index_suffix + '.npz'
+        if os.path.exists(track_index_path):
+            self.track_index = TrackIndex().load(track_index_path, data)
+        else:
+            logging.info('No track index file at: ' + track_index_path + ', building...')
+            self.track_index = TrackIndex().build(data)
+        return self.track_index
+
     def draw_post_data(self, img, frame_num):
-        idx_start = self.frame_idx_dict[frame_num][0]
-        idx_end = self.frame_idx_dict[frame_num][1]
-        #draw pos circle
-        pos = np.array(self.video_data[['pos_x_in_crop', 'pos_y_in_crop']].iloc[idx_start:idx_end])
-        pos_int = pos.astype(int)
-        pos_int_list = [tuple(p) for p in pos_int]
-        for i in range(len(pos_int_list)):
-            cv2.circle(img, pos_int_list[i], self.pos_draw_radius, (0,255,0), thickness=2)
-
-        #draw angle vector
-        angle_vector = np.array(self.video_data[['angle_vector_x', 'angle_vector_y']].iloc[idx_start:idx_end])
-        arrow_start_points = (pos - angle_vector).astype(np.int)
-        arrow_end_points = (arrow_start_points + self.ang_draw_ratio * angle_vector).astype(np.int)
-        start_point_list = [tuple(p) for p in arrow_start_points]
-        end_point_list = [tuple(p) for p in arrow_end_points]
-        for i in range(len(start_point_list)):
-            cv2.arrowedLine(img, start_point_list[i], end_point_list[i],
+        idx_start = self.frame_offsets[frame_num]
+        idx_end = self.frame_offsets[frame_num + 1]
+        draw_data = self.draw_data
+        pos = draw_data['pos'][idx_start:idx_end]
+        pos_int_list = draw_data['pos_int'][idx_start:idx_end].tolist()
+        start_point_list = draw_data['arrow_start_points'][idx_start:idx_end].tolist()
+        end_point_list = draw_data['arrow_end_points'][idx_start:idx_end].tolist()
+        text_pos_int_list = draw_data['text_pos_int'][idx_start:idx_end].tolist()
+        tracking_id = draw_data['id'][idx_start:idx_end]
+        vel = draw_data['vel'][idx_start:idx_end]
+        acc = draw_data['acc'][idx_start:idx_end]
+        ang = draw_data['ang'][idx_start:idx_end]
+        scale = self._draw_scale
+        radius = max(1, int(round(self.pos_draw_radius * scale)))
+        thickness = max(1, int(round(2 * scale)))
+        text_y_increment = int(round(self.text_y_increment * scale))
+
+        nb_label_lines = get_nb_label_lines(5, self.label_density, frame_num, self.label_every_n_frames)
+        texts = []
+        text_orgs = []
+        for i in range(idx_end - idx_start):
+            #draw pos circle
+            cv2.circle(img, tuple(pos_int_list[i]), radius, (0,255,0), thickness=thickness)
+
+            #draw angle vector
+            cv2.arrowedLine(img, tuple(start_point_list[i]), tuple(end_point_list[i]),
                             (255, 0, 0), 1)
 
-        ###text
-        text_pos_int = np.copy(pos_int)
-        text_pos_int[:, 0] += self.text_x_diff
-        text_pos_int[:, 1] += self.text_start_y_diff
-        text_pos_int_list = [tuple(p) for p in text_pos_int]
-
-        #draw id text
-        tracking_id = self.video_data['id'].iloc[idx_start:idx_end]
-        for i in range(len(text_pos_int_list)):
-            cv2.putText(img, 'ID: {}'.format(tracking_id.iloc[i]), text_pos_int_list[i],
-                        cv2.FONT_HERSHEY_SIMPLEX, self.text_font_size, (0,0,255), 2)
-
-        #draw pos text
-        text_pos_int[:, 1] += self.text_y_increment
-        text_pos_int_list = [tuple(p) for p in text_pos_int]
-        for i in range(len(text_pos_int_list)):
-            cv2.putText(img, 'pos:{:.1f}, {:.1f}'.format(pos[i, 0], pos[i, 1]), text_pos_int_list[i],
-                        cv2.FONT_HERSHEY_SIMPLEX, self.text_font_size, (0,0,255), 2)
-
-        #draw vel text
-        vel = np.array(self.video_data[['velocity_pixel_x', 'velocity_pixel_y']].iloc[idx_start:idx_end])
-        text_pos_int[:, 1] += self.text_y_increment
-        text_pos_int_list = [tuple(p) for p in text_pos_int]
-        for i in range(len(text_pos_int_list)):
-            cv2.putText(img, 'vel:{:.1f}, {:.1f}'.format(vel[i, 0], vel[i, 1]), text_pos_int_list[i],
-                        cv2.FONT_HERSHEY_SIMPLEX, self.text_font_size, (0,0,255), 2)
-
-        #draw acc text
-        acc = np.array(self.video_data[['acc_pixel_x', 'acc_pixel_y']].iloc[idx_start:idx_end])
-        text_pos_int[:, 1] += self.text_y_increment
-        text_pos_int_list = [tuple(p) for p in text_pos_int]
-        for i in range(len(text_pos_int_list)):
-            cv2.putText(img, 'acc:{:.1f}, {:.1f}'.format(acc[i, 0], acc[i, 1]), text_pos_int_list[i],
-                        cv2.FONT_HERSHEY_SIMPLEX, self.text_font_size, (0,0,255), 2)
-
-        #draw angle text
-        ang = self.video_data['rel_angle_deg'].iloc[idx_start:idx_end]
-        text_pos_int[:, 1] += self.text_y_increment
-        text_pos_int_list = [tuple(p) for p in text_pos_int]
-        for i in range(len(text_pos_int_list)):
-            cv2.putText(img, 'ang: {:.1f}'.format(ang.iloc[i]), text_pos_int_list[i],
-                        cv2.FONT_HERSHEY_SIMPLEX, self.text_font_size, (0,0,255), 2)
+            ###text: id, pos, vel, acc, angle
+            texts.append('ID: {}'.format(tracking_id[i]))
+            if nb_label_lines > 1:
+                texts += ['pos:{:.1f}, {:.1f}'.format(pos[i, 0], pos[i, 1]),
+                          'vel:{:.1f}, {:.1f}'.format(vel[i, 0], vel[i, 1]),
+                          'acc:{:.1f}, {:.1f}'.format(acc[i, 0], acc[i, 1]),
+                          'ang: {:.1f}'.format(ang[i])]
+            text_x, text_y = text_pos_int_list[i]
+            text_orgs += [(text_x, text_y + j * text_y_increment) for j in range(nb_label_lines)]
+
+        label_atlas = self.get_label_atlas(scale)
+        if label_atlas is None:
+            for i in range(len(texts)):
+                cv2.putText(img, texts[i], text_orgs[i],
+                            cv2.FONT_HERSHEY_SIMPLEX, self.text_font_size * scale, (0,0,255), thickness)
+        else:
+            label_atlas.draw_texts(img, texts, text_orgs, (0,0,255))
         return img
 
-    def get_post_frame(self, frame, t):
-        #new_frame = np.ones((self.image_height, self.image_width, 3))*255.0
-        new_frame = np.zeros((self.image_height, self.image_width, 3))
-        cropped_img = frame[self.overall_crop[0,0]:self.overall_crop[1,0],
-                            self.overall_crop[0,1]:self.overall_crop[1,1], :]
-        cropped_img_height = self.overall_crop[1,0] - self.overall_crop[0,0]
-        cropped_img_width = self.overall_crop[1,1] - self.overall_crop[0,1]
-
-        frame_num = int(t * self.fps)
+    def get_output_frame(self):
+        """
+        Output frame buffer, allocated once and reused across frames.
+        'full': image_height x image_width canvas, 'crop': overall_crop region only.
+        Sizes are scaled by render_scale.
+        """
+        if self.output_mode == 'crop':
+            crop = self.get_render_crop()
+            cropped_img_height = crop[1,0] - crop[0,0]
+            cropped_img_width = crop[1,1] - crop[0,1]
+            #h264 (yuv420p) needs even frame sizes
+            shape = (cropped_img_height + cropped_img_height % 2,
+                     cropped_img_width + cropped_img_width % 2, 3)
+        else:
+            width, height = get_scaled_size((self.image_width, self.image_height), self.render_scale)
+            shape = (height, width, 3)
+        if self._output_frame is None or self._output_frame.shape != shape:
+            self._output_frame = np.zeros(shape, dtype=np.uint8)
+        return self._output_frame
+
+    def get_render_crop(self):
+        """overall_crop in decoded (render_scale) frame coordinates"""
+        if self.render_scale == 1:
+            return self.overall_crop
+        return np.round(self.overall_crop * self.render_scale).astype(np.int64)
+
+    def get_post_frame(self, frame, frame_num):
+        if self._draw_scale != self.render_scale:
+            self.set_draw_data(self.render_scale)
+        new_frame = self.get_output_frame()
+        crop = self.get_render_crop()
+        source_cropped_img = frame[crop[0,0]:crop[1,0], crop[0,1]:crop[1,1], :]
+        cropped_img_height = source_cropped_img.shape[0]
+        cropped_img_width = source_cropped_img.shape[1]
+
+        #draw in place on the crop region of the output buffer
+        cropped_img = new_frame[:cropped_img_height, :cropped_img_width, :]
+        cropped_img[...] = source_cropped_img
 
         if frame_num < len(self.detected_frames):
             if self.detected_frames[frame_num]:
-                cropped_img = self.draw_post_data(cropped_img, frame_num)
-
-        new_frame[:cropped_img_height, :cropped_img_width, :] = cropped_img
+                with profiler.stage('render.post_overlay'):
+                    self.draw_post_data(cropped_img, frame_num)
         return new_frame
 
     def save_post_video(self, video_path, post_data_path):
@@ -354,13 +904,12 @@ class PostProcessor(VideoProcessor):
         path_names = post_data_path.split(os.path.sep)
         video_output_path_list = path_names[:-1] + ['post_video', path_names[-1].split('.')[0] + '.mp4']
         video_output_path = os.path.join(*video_output_path_list)
-        clip = VideoFileClip(video_path)
         logging.info('Saving post video...')
-
-        out_clip = clip.fl(lambda gf, t: self.get_post_frame(gf(t), t), [])
-        out_clip.write_videofile(video_output_path, audio=False, fps=self.fps)
+        self.write_video(video_path, video_output_path)
         logging.info('Saved post video at: ' + video_output_path)
-        clip.close()
+
+    def render_frame(self, frame, frame_idx):
+        return self.get_post_frame(frame, self.get_data_frame_num(frame_idx))
 
     @property
     def post_data_path(self):
@@ -379,6 +928,19 @@ class PostProcessor(VideoProcessor):
     def video_path(self, path):
         self._video_path = path
 
+    @property
+    def output_mode(self):
+        return self._output_mode
+
+    @output_mode.setter
+    def output_mode(self, output_mode_name):
+        if output_mode_name in self._output_mode_list:
+            self._output_mode = output_mode_name
+            self._output_frame = None
+            logging.info('Set post video output mode:{}'.format(self._output_mode))
+        else:
+            logging.info('Post video output mode not in list')
+
     @property
     def tracker(self):
         return self._tracker_name
@@ -402,6 +964,25 @@ class Processor(object):
         self._post_output_type_list = ['video', 'data']
         self._post_output_type = 'data'
         self.preview_file_path = None
+        self.preview_encoder = PreviewImageEncoder()
+        self.profiler = profiler
+        self.pipeline = IncrementalPipeline(self)
+
+    def start_profiling(self, trace_memory=False):
+        """
+        Records time (and peak memory if trace_memory) of pipeline stages until stop_profiling.
+        Stages of parallel rendering workers are not recorded, set nb_render_workers=1 to profile rendering.
+        """
+        self.profiler.start(trace_memory=trace_memory)
+
+    def stop_profiling(self, report_path=None):
+        """stops profiling, saves the json report if report_path, returns the stage summary table"""
+        self.profiler.stop()
+        if report_path is not None:
+            self.profiler.save_report(report_path)
+        summary = self.profiler.get_summary()
+        logging.info('Profile summary:\n' + summary.to_string())
+        return summary
 
     def run_detection(self):
         logging.info('Running detection...')
@@ -434,28 +1015,31 @@ class Processor(object):
                 logging.info('File to process:\ndata: {} video: {}'.format(p['data'], p['video']))
                 self.postprocessor.save_post_video(p['video'], p['data'])
 
-    def plot_image(self, img, title, scale_factor=0.25):
+    def run_incremental(self, file_paths=None, steps=None, force=False):
+        """
+        Runs steps ('detection', 'tracking', 'post', 'detection_video', 'post_video') on videos and
+        detection data of file_paths (None: data_files_dir), skipping outputs that are up to date
+        with their inputs and settings (manifest sidecars). force: runs every stage.
+        """
+        if file_paths is None:
+            file_paths = [r['path'] for r in scan_directory(self.data_files_dir)]
+        if steps is not None:
+            self.pipeline.steps = steps
+        self.pipeline.force = force
+        return self.pipeline.run(file_paths)
+
+    def plot_image(self, img, title, scale_factor=0.25, offset=(0, 0)):
+        """
+        Shows img downsampled to the figure size (img size * scale_factor).
+        offset (x, y): position of img in the frame, axes are in frame pixels.
+        """
+        #plotting is imported on use, batch runs do not load it
+        import plotly.graph_objects as go
         logging.info(title)
-        source_img = Image.fromarray(img)
+        source_img = self.preview_encoder.encode(img, scale_factor)
         img_width = img.shape[1]
         img_height = img.shape[0]
-        x_axis_data = {
-            'x': np.arange(int(img_width)),
-            'y': np.zeros(int(img_width)),
-            'type': 'scatter',
-            'mode': 'markers',
-            'marker': {'opacity': 0},
-            'hoverinfo': 'x+y'
-        }
-        y_axis_data = {
-            'x': np.zeros(int(img_height)),
-            'y': np.arange(int(img_height)),
-            'type': 'scatter',
-            'mode': 'markers',
-            'marker': {'opacity': 0},
-            'hoverinfo': 'x+y'
-        }
-        data = [x_axis_data, y_axis_data]
+        x_start, y_start = offset
         layout = go.Layout(
             title=go.layout.Title(
                 text=title
@@ -464,24 +1048,23 @@ class Processor(object):
             hovermode='closest',
             xaxis = go.layout.XAxis(
                 showgrid=False,
-                range=[0, img_width],
-                spikemode='across'
+                zeroline=False,
+                range=[x_start, x_start + img_width]
             ),
             yaxis = go.layout.YAxis(
                 showgrid=False,
-                autorange='reversed',
-                range=[0, img_height],
+                zeroline=False,
+                range=[y_start + img_height, y_start],
                 scaleanchor='x',
-                scaleratio=1,
-                spikemode='across'
+                scaleratio=1
             ),
             width = img_width * scale_factor,
             height = img_height * scale_factor,
             margin = {'l': 0, 'r': 0, 't': 0, 'b': 0},
             images = [
                 go.layout.Image(
-                    x=0,
-                    y=0,
+                    x=x_start,
+                    y=y_start,
                     sizex=img_width,
                     sizey=img_height,
                     xref='x',
@@ -494,53 +1077,87 @@ class Processor(object):
                 )
             ]
         )
-        fig = go.Figure(data=data, layout=layout)
+        fig = go.Figure(layout=layout)
         #py.iplot(fig)
         fig.show()
         #return fig
 
     def preview_detection(self):
         if self.preview_file_path != None:
-            step_imgs, step_names = self.detection_processor.get_preview(self.preview_file_path)
+            step_imgs, step_names, step_offsets = self.detection_processor.get_preview(self.preview_file_path)
             for i in range(len(step_imgs)):
-                self.plot_image(step_imgs[i], step_names[i], scale_factor=0.25)
+                self.plot_image(step_imgs[i], step_names[i], scale_factor=0.25, offset=step_offsets[i])
         else:
             logging.info('No mp4 file to preview. Add mp4 file path first.')
 
-
-    def update_file_paths(self):
-        file_paths = sorted(glob(os.path.join(self.data_files_dir, '*.*')))
+    def preview_detection_samples(self, nb_samples=8, nb_workers=None):
+        """detection counts and annotated thumbnails of nb_samples evenly spaced frames"""
+        if self.preview_file_path == None:
+            logging.info('No mp4 file to preview. Add mp4 file path first.')
+            return None
+        samples = self.detection_processor.get_preview_samples(self.preview_file_path, nb_samples=nb_samples,
+                                                               nb_workers=nb_workers)
+        for i in range(len(samples['frame_nums'])):
+            #thumbnails are already downsampled
+            thumbnail = samples['thumbnails'][i]
+            self.plot_image(thumbnail, 'frame {}: {} detections, {} blobs'.format(samples['frame_nums'][i],
+                                                                                  samples['nb_detections'][i],
+                                                                                  samples['nb_blobs'][i]),
+                            scale_factor=1.0)
+        return samples
+
+
+    def get_file_catalog(self, directory=None):
+        """catalog of directory (None: data_files_dir), saved in it, updated by catalog.scan(directory)"""
+        return FileCatalog.for_directory(self.data_files_dir if directory is None else directory)
+
+    def update_file_paths(self, file_paths=None):
+        """
+        Sorts files into detection (videos) and post (detection or post data) inputs.
+        file_paths: files to sort (None: every file in data_files_dir).
+        Each directory is listed once (scan_directory), post data is matched to its video from the listing.
+        """
+        if file_paths is None:
+            directories = [self.data_files_dir]
+        else:
+            #manifest sidecars of outputs are not inputs
+            file_paths = sorted(p for p in file_paths if not is_manifest_path(p))
+            directories = sorted(set(os.path.dirname(p) for p in file_paths))
+        records = {}
+        videos = {}
+        for directory in directories:
+            if not os.path.isdir(directory or '.'):
+                continue
+            for r in scan_directory(directory):
+                records[r['path']] = r
+                if r['kind'] == 'video':
+                    #keyed on the normalized directory (data_files_dir may end with a separator)
+                    videos.setdefault((os.path.normpath(os.path.dirname(r['path'])), r['stem']), r['path'])
+        if file_paths is None:
+            file_paths = sorted(records)
         detection_file_paths = []
         post_file_paths = {'data':[], 'video':[]}
         excluded_files = []
         for p in file_paths:
-            file_name = p.split(os.path.sep)[-1]
-            file_name_split = file_name.split('.')
-            exten = file_name_split[-1]
-            no_exten_file_name = file_name_split[-2]
-            if exten == 'mp4' or exten == 'MP4':
+            if p in records:
+                kind, stem = records[p]['kind'], records[p]['stem']
+            else:
+                kind, stem = classify_file(p)
+            path_dict = {'data':p}
+            if kind == 'video':
                 detection_file_paths.append(p)
-            elif exten == 'csv' or exten == 'xlsx':
-                no_exten_file_name_split = no_exten_file_name.split('_')
-                suffix = no_exten_file_name_split[-1]
-                path_dict = {'data':p}
-                if suffix == 'detection':
-                    post_file_paths['data'].append(path_dict)
-                elif suffix == 'post':
-                    video_file_name = '_'.join(no_exten_file_name_split[:-2])
-                    paths = sorted(glob(os.path.join(self.data_files_dir,  video_file_name + '.*4')))
-                    try:
-                        path_dict = {'data':p}
-                        path_dict['video'] = paths[0]
-                        post_file_paths['video'].append(path_dict)
-                    except:
-                        logging.info('No video file name of ' + video_file_name)
-                    post_file_paths['data'].append(path_dict)
+            elif kind == 'detection':
+                post_file_paths['data'].append(path_dict)
+            elif kind == 'post':
+                video_path = videos.get((os.path.normpath(os.path.dirname(p)), get_post_video_stem(stem)))
+                if video_path is not None:
+                    path_dict['video'] = video_path
+                    post_file_paths['video'].append(path_dict)
                 else:
-                    logging.info("Data file's name should end with '_detection' or '_post'. excluding " + file_name)
-                    excluded_files.append(p)
+                    logging.info('No video file name of ' + get_post_video_stem(stem))
+                post_file_paths['data'].append(path_dict)
             else:
-                logging.info("File's extension should be 'mp4' or 'xlsx'. excluding " + file_name)
+                logging.debug("Excluding {}, inputs are mp4 videos and data named '_detection' or '_post'".format(p))
                 excluded_files.append(p)
         self._detection_file_paths = detection_file_paths
         self._post_file_paths = post_file_paths
@@ -553,8 +1170,7 @@ class Processor(object):
                         ', video: ' + str(self._post_file_paths['video'][i]['video'])
                         for i in range(len(self._post_file_paths['video']))])
         logging.info('\n Postprocessing video file paths: \n' + log)
-        log = '\n'.join(['{}: '.format(i) + p for i, p in enumerate(excluded_files)])
-        logging.info('\n Excluded file paths: \n' + log)
+        logging.info('Excluded files: {} (listed at debug level)'.format(len(excluded_files)))
         try:
             self.preview_file_path = self._detection_file_paths[0]
             logging.info('Detection preview file:' + self.preview_file_path.split(os.path.sep)[-1])
@@ -1 +1,2 @@
 from zebrafish.detector.image_processing_detectors import ThresholdDetector
+from zebrafish.detector.motion_gating import MotionGate
@@ -1,7 +1,15 @@
 import numpy as np
 import cv2
+import logging
+from collections import OrderedDict
 
 from zebrafish.utils import convert_angle
+from zebrafish.utils.profiler import profiler
+
+def get_kernel_key(kernel):
+    """hashable key of a structuring element (values, shape and dtype)"""
+    kernel = np.asarray(kernel)
+    return (kernel.shape, kernel.dtype.str, kernel.tobytes())
 
 class ThresholdDetector(object):
 
@@ -26,7 +34,53 @@ class ThresholdDetector(object):
 
         self.ang_draw_ratio = 2.
 
-    def process_image(self, img):
+        #coarse-to-fine detection (detection_scale > 1): candidates are found on the frame downsampled
+        #by detection_scale, detection runs at full resolution in windows around them only
+        self.detection_scale = 1
+        #pixels added around windows (beyond what the processing steps need)
+        self.refine_padding = 4
+        #frames with windows covering more than this ratio of the frame are processed at full resolution
+        self.max_refine_area_ratio = 0.5
+        #every multiscale_check_interval frames, detections are compared to the full resolution path,
+        #coarse-to-fine detection is turned off if they differ (count, or position by > multiscale_tolerance_px)
+        self.multiscale_tolerance_px = 1.0
+        self.multiscale_check_interval = 500
+        self.reset_multiscale()
+
+        #preview stage cache (LRU), stages are keyed on the frame key and upstream params
+        self.max_cached_preview_stages = 32
+        self._preview_stages = OrderedDict()
+
+    def get_settings(self):
+        """parameters that change detection results"""
+        settings = {'l_thresh': list(self.l_thresh),
+                'size_bound': list(self.size_bound),
+                'median_blur_size': self.median_blur_size,
+                'closing_iterations': self.closing_iterations,
+                'denoising_kernel': self.denoising_kernel.tolist(),
+                'closing_kernel': self.closing_kernel.tolist()}
+        if self.detection_scale > 1:
+            #only if used, full resolution settings (and manifests of their outputs) are unchanged
+            settings.update({'detection_scale': self.detection_scale,
+                             'refine_padding': self.refine_padding,
+                             'multiscale_tolerance_px': self.multiscale_tolerance_px})
+        return settings
+
+    @classmethod
+    def from_settings(cls, settings):
+        """detector with the settings of get_settings (e.g. in worker processes, without the preview cache)"""
+        detector = cls(l_thresh=tuple(settings['l_thresh']),
+                       size_bound=tuple(settings['size_bound']),
+                       median_blur_size=settings['median_blur_size'],
+                       closing_iterations=settings['closing_iterations'])
+        detector.denoising_kernel = np.array(settings['denoising_kernel'], dtype=np.uint8)
+        detector.closing_kernel = np.array(settings['closing_kernel'], dtype=np.uint8)
+        for name in ['detection_scale', 'refine_padding', 'multiscale_tolerance_px']:
+            if name in settings:
+                setattr(detector, name, settings[name])
+        return detector
+
+    def get_l_channel(self, img):
         #to hls
         #hls = cv2.cvtColor(img, cv2.COLOR_RGB2HLS)
         #l_channel = hls[:,:,1]
@@ -34,14 +88,18 @@ class ThresholdDetector(object):
         #to lab
         lab = cv2.cvtColor(img, cv2.COLOR_RGB2Lab)
         l_channel = lab[:,:,0]
+        return lab, l_channel
 
-        #blur
-        blur = cv2.medianBlur(l_channel, self.median_blur_size)
+    def get_blur(self, l_channel):
+        return cv2.medianBlur(l_channel, self.median_blur_size)
 
+    def get_l_binary(self, blur):
         #l thresholding
         l_binary = np.zeros_like(blur)
         l_binary[(blur >= self.l_thresh[0]) & (blur <= self.l_thresh[1])] = 1
+        return l_binary
 
+    def get_morphology(self, l_binary):
         #closing opening (denoising)
         closing = cv2.morphologyEx(l_binary, cv2.MORPH_CLOSE, self.denoising_kernel)
         opening = cv2.morphologyEx(closing, cv2.MORPH_OPEN, self.denoising_kernel)
@@ -49,8 +107,74 @@ class ThresholdDetector(object):
         #closing
         dilation = cv2.dilate(opening, self.closing_kernel, iterations=self.closing_iterations)
         erosion = cv2.erode(dilation, self.closing_kernel, iterations=self.closing_iterations)
+        return closing, opening, dilation, erosion
+
+    def process_image(self, img):
+        with profiler.stage('detector.lab'):
+            lab, l_channel = self.get_l_channel(img)
+        with profiler.stage('detector.blur'):
+            blur = self.get_blur(l_channel)
+        with profiler.stage('detector.threshold'):
+            l_binary = self.get_l_binary(blur)
+        with profiler.stage('detector.morphology'):
+            closing, opening, dilation, erosion = self.get_morphology(l_binary)
         return lab, l_channel, blur, l_binary, closing, opening, dilation, erosion
 
+    def get_preview_stage_keys(self, frame_key):
+        """cache key of every stage: frame key and the params upstream of the stage"""
+        if frame_key is None:
+            return dict((stage, None) for stage in ['lab', 'blur', 'l_binary', 'morphology', 'contours'])
+        lab_key = (frame_key,)
+        blur_key = lab_key + (self.median_blur_size,)
+        l_binary_key = blur_key + (tuple(self.l_thresh),)
+        morphology_key = l_binary_key + (get_kernel_key(self.denoising_kernel), get_kernel_key(self.closing_kernel),
+                                         self.closing_iterations)
+        return {'lab': lab_key,
+                'blur': blur_key,
+                'l_binary': l_binary_key,
+                'morphology': morphology_key,
+                'contours': morphology_key}
+
+    def get_preview_stage(self, stage_name, key, compute):
+        """memoized stage output, not cached if key is None. Cached outputs must not be modified."""
+        if key is None:
+            return compute()
+        cache_key = (stage_name,) + key
+        output = self._preview_stages.get(cache_key)
+        if output is not None:
+            self._preview_stages.move_to_end(cache_key)
+            return output
+        output = compute()
+        self._preview_stages[cache_key] = output
+        while len(self._preview_stages) > self.max_cached_preview_stages:
+            self._preview_stages.popitem(last=False)
+        return output
+
+    def clear_preview_stages(self):
+        self._preview_stages.clear()
+
+    def __getstate__(self):
+        #preview cache (full frame stages) is not sent to worker processes
+        state = self.__dict__.copy()
+        state['_preview_stages'] = OrderedDict()
+        return state
+
+    def process_image_staged(self, img, frame_key=None):
+        """
+        process_image and contours, each stage memoized on frame_key (identifies img).
+        Changing size_bound reuses every stage, changing l_thresh reuses lab and blur.
+        """
+        keys = self.get_preview_stage_keys(frame_key)
+        lab, l_channel = self.get_preview_stage('lab', keys['lab'], lambda: self.get_l_channel(img))
+        blur = self.get_preview_stage('blur', keys['blur'], lambda: self.get_blur(l_channel))
+        l_binary = self.get_preview_stage('l_binary', keys['l_binary'], lambda: self.get_l_binary(blur))
+        closing, opening, dilation, erosion = self.get_preview_stage('morphology', keys['morphology'],
+                                                                     lambda: self.get_morphology(l_binary))
+        contours, convex_hulls, hull_moments = self.get_preview_stage('contours', keys['contours'],
+                                                                      lambda: self.detect_countours_hulls_moments(erosion))
+        processed_images = (lab, l_channel, blur, l_binary, closing, opening, dilation, erosion)
+        return processed_images, contours, convex_hulls, hull_moments
+
     def detect_countours_hulls_moments(self, binary_img):
         _, contours, _ = cv2.findContours(binary_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
         convex_hulls = [cv2.convexHull(cnt) for cnt in contours]
@@ -79,17 +203,142 @@ class ThresholdDetector(object):
             angle = angle_vector
         return position, angle, hulls_reshaped, angle_vector
 
+    def reset_multiscale(self):
+        self._nb_multiscale_frames = 0
+        self.multiscale_disabled = False
+
+    def get_support_radius(self):
+        """distance (pixels) of the pixels a processed (eroded) pixel depends on"""
+        #median blur, closing and opening (dilate and erode 1 px each), closing iterations
+        return self.median_blur_size // 2 + 4 + 2 * self.closing_iterations
+
+    def get_coarse_candidates(self, img):
+        """
+        bounding boxes (x1, y1, x2, y2) of dark blobs of img downsampled by detection_scale.
+        Downsampling takes the min of every block, so every pixel in l_thresh is in a candidate.
+        """
+        scale = int(self.detection_scale)
+        #min of the block starting at every pixel, then the first pixel of every block
+        #(the last rows and columns, if the size is not a multiple of scale, are left out)
+        pooled = cv2.erode(img, np.ones((scale, scale), dtype=np.uint8), anchor=(0, 0))
+        small = cv2.resize(pooled, (img.shape[1] // scale, img.shape[0] // scale), interpolation=cv2.INTER_NEAREST)
+        _, l_channel = self.get_l_channel(small)
+        #no blur and opening: candidates are a superset, rejected at full resolution
+        coarse_binary = (l_channel <= self.l_thresh[1]).astype(np.uint8)
+        iterations = int(np.ceil(self.closing_iterations / float(scale)))
+        if iterations > 0:
+            coarse_binary = cv2.dilate(coarse_binary, self.closing_kernel, iterations=iterations)
+        _, contours, _ = cv2.findContours(coarse_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for cnt in contours:
+            x, y, w, h = cv2.boundingRect(cnt)
+            boxes.append([x * scale, y * scale, (x + w) * scale, (y + h) * scale])
+        return boxes
+
+    def get_refine_windows(self, boxes, img_shape):
+        """boxes padded and clipped to the image, overlapping windows merged"""
+        pad = self.get_support_radius() + self.closing_iterations + int(self.detection_scale) + self.refine_padding
+        height, width = img_shape[:2]
+        windows = [[max(0, b[0] - pad), max(0, b[1] - pad), min(width, b[2] + pad), min(height, b[3] + pad)]
+                   for b in boxes]
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(windows)):
+                for j in range(i + 1, len(windows)):
+                    a, b = windows[i], windows[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        windows[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del windows[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return windows
+
+    def refine_windows(self, img, windows):
+        """
+        contours, convex hulls and hull moments (img coordinates) of full resolution processing of windows.
+        Contours touching a window edge inside img are cut by the window and left out.
+        """
+        height, width = img.shape[:2]
+        convex_hulls = []
+        hull_moments = []
+        for x1, y1, x2, y2 in windows:
+            erosion = self.process_image(img[y1:y2, x1:x2])[-1]
+            _, contours, _ = cv2.findContours(erosion, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+            for cnt in contours:
+                x, y, w, h = cv2.boundingRect(cnt)
+                if (x == 0 and x1 > 0) or (y == 0 and y1 > 0) or \
+                   (x + w == x2 - x1 and x2 < width) or (y + h == y2 - y1 and y2 < height):
+                    continue
+                hull = cv2.convexHull(cnt + np.array([x1, y1], dtype=cnt.dtype))
+                convex_hulls.append(hull)
+                hull_moments.append(cv2.moments(hull))
+        return convex_hulls, hull_moments
+
+    def detect_hulls_multiscale(self, img):
+        """convex hulls and moments of coarse-to-fine detection (None: windows too large, use full resolution)"""
+        with profiler.stage('detector.coarse'):
+            windows = self.get_refine_windows(self.get_coarse_candidates(img), img.shape)
+        window_area = sum((w[2] - w[0]) * (w[3] - w[1]) for w in windows)
+        if window_area > self.max_refine_area_ratio * img.shape[0] * img.shape[1]:
+            return None
+        with profiler.stage('detector.refine'):
+            return self.refine_windows(img, windows)
+
+    def compare_positions(self, position, reference):
+        """nb of unmatched detections (both ways) and max distance of nearest detections"""
+        if len(position) == 0 or len(reference) == 0:
+            return abs(len(position) - len(reference)), 0.
+        dist = np.linalg.norm(position[:, None, :] - reference[None, :, :], axis=-1)
+        nearest = np.concatenate([dist.min(axis=0), dist.min(axis=1)])
+        return int(np.sum(nearest > self.multiscale_tolerance_px)), float(nearest.max())
+
+    def check_multiscale(self, img, result):
+        """
+        compares result to the full resolution path, if they differ coarse-to-fine detection is
+        turned off and the full resolution result is returned
+        """
+        with profiler.stage('detector.full_resolution'):
+            reference = self.detect_position_and_angle_full(img)
+        nb_unmatched, max_dist = self.compare_positions(result[0], reference[0])
+        if nb_unmatched == 0 and len(result[0]) == len(reference[0]):
+            return result
+        self.multiscale_disabled = True
+        logging.warning('Coarse-to-fine detection differs from full resolution ({} vs {} detections, '
+                        'max distance {:.2f} px), detecting at full resolution.'.format(
+                        len(result[0]), len(reference[0]), max_dist))
+        return reference
+
     def detect_position_and_angle(self, img):
+        if self.detection_scale > 1 and not self.multiscale_disabled:
+            hulls = self.detect_hulls_multiscale(img)
+            if hulls is not None:
+                with profiler.stage('detector.position_angle'):
+                    convex_hulls_bounded, hull_moments_bounded = self.bound_hulls_by_size(*hulls)
+                    result = self.get_position_and_angle_from_hulls(convex_hulls_bounded, hull_moments_bounded)
+                if self.multiscale_check_interval > 0 and self._nb_multiscale_frames % self.multiscale_check_interval == 0:
+                    result = self.check_multiscale(img, result)
+                self._nb_multiscale_frames += 1
+                return result
+            with profiler.stage('detector.full_resolution'):
+                return self.detect_position_and_angle_full(img)
+        return self.detect_position_and_angle_full(img)
+
+    def detect_position_and_angle_full(self, img):
         processed_images = self.process_image(img)
 
         #contour
-        contours, convex_hulls, hull_moments = self.detect_countours_hulls_moments(processed_images[-1])
+        with profiler.stage('detector.contours_hulls'):
+            contours, convex_hulls, hull_moments = self.detect_countours_hulls_moments(processed_images[-1])
 
-        #bound by size
-        convex_hulls_bounded, hull_moments_bounded = self.bound_hulls_by_size(convex_hulls, hull_moments)
+        with profiler.stage('detector.position_angle'):
+            #bound by size
+            convex_hulls_bounded, hull_moments_bounded = self.bound_hulls_by_size(convex_hulls, hull_moments)
 
-        #position, angle
-        position, angle, hulls_reshaped, angle_vector = self.get_position_and_angle_from_hulls(convex_hulls_bounded, hull_moments_bounded)
+            #position, angle
+            position, angle, hulls_reshaped, angle_vector = self.get_position_and_angle_from_hulls(convex_hulls_bounded, hull_moments_bounded)
         return position, angle, hulls_reshaped, angle_vector
 
     def convert_hulls_to_bboxes(self, hulls_list):
@@ -102,16 +351,19 @@ class ThresholdDetector(object):
         bboxes_converted[:, 3] += bboxes[:, 1]
         return bboxes_converted
 
-    def get_processing_step_images(self, img):
-        processed_images = self.process_image(img)
+    def get_processing_step_images(self, img, frame_key=None):
+        #processing and contour (memoized with frame_key)
+        processed_images, contours, convex_hulls, hull_moments = self.process_image_staged(img, frame_key)
         lab, l_channel, blur, l_binary, closing, opening, dilation, erosion = processed_images
 
-        #contour
-        contours, convex_hulls, hull_moments = self.detect_countours_hulls_moments(processed_images[-1])
-
         #bound by size
         #convex_hulls_bounded, hull_moments_bounded = self.bound_hulls_by_size(convex_hulls, hull_moments)
 
+        img = self.draw_hull_areas(img, convex_hulls, hull_moments)
+        return l_channel, blur, l_binary, erosion, img
+
+    def draw_hull_areas(self, img, convex_hulls, hull_moments):
+        """hulls with their areas, in size_bound: red, out: blue"""
         position = np.array([[m['m10']/m['m00'], m['m01']/m['m00']] for m in hull_moments])
 
         for i in range(len(hull_moments)):
@@ -124,48 +376,22 @@ class ThresholdDetector(object):
                 cv2.putText(img, '{:.1f}, out.'.format(hull_moments[i]['m00']),
                             tuple(position[i].astype(np.int)),
                             cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 0, 0), 2)
-        return l_channel, blur, l_binary, erosion, img
-
-    def get_preview_images(self, img, overall_crop):
-        cropped_img = img[overall_crop[0,0]:overall_crop[1,0],
-                                  overall_crop[0,1]:overall_crop[1,1],:]
-
-        l_channel_img = np.copy(img)
-        blur_img = np.copy(img)
-        l_binary_img = np.copy(img)
-        closing_img = np.copy(img)
-        result_img = np.copy(img)
-
-        step_cropped_images = self.get_processing_step_images(cropped_img)
-
-        l_channel_stack = np.stack([step_cropped_images[0] for i in range(3)], axis=-1)
-
-        l_channel_img[overall_crop[0,0]:overall_crop[1,0],
-                      overall_crop[0,1]:overall_crop[1,1],:] = l_channel_stack
-
-        blur_stack = np.stack([step_cropped_images[1] for i in range(3)], axis=-1)
-
-        blur_img[overall_crop[0,0]:overall_crop[1,0],
-                 overall_crop[0,1]:overall_crop[1,1],:] = blur_stack
-
-        l_binary_stack = np.stack([step_cropped_images[2] for i in range(3)], axis=-1)
-        l_binary_stack *= 255
-
-        l_binary_img[overall_crop[0,0]:overall_crop[1,0],
-                     overall_crop[0,1]:overall_crop[1,1],:] = l_binary_stack
-
-        closing_stack = np.stack([step_cropped_images[3] for i in range(3)], axis=-1)
-        closing_stack *= 255
+        return img
 
-        closing_img[overall_crop[0,0]:overall_crop[1,0],
-                    overall_crop[0,1]:overall_crop[1,1],:] = closing_stack
+    def get_preview_images(self, img, overall_crop, frame_key=None):
+        """
+        Processing step images of the overall_crop region only (crop sized,
+        single channel for l_channel, blur, l_binary and closing).
+        frame_key: identifies img (e.g. video path and frame index), stages are memoized if given.
+        """
+        cropped_img = np.copy(img[overall_crop[0,0]:overall_crop[1,0],
+                                  overall_crop[0,1]:overall_crop[1,1],:])
+        if frame_key is not None:
+            frame_key = (frame_key, tuple(np.asarray(overall_crop).ravel().tolist()))
 
-        result_img[overall_crop[0,0]:overall_crop[1,0],
-                   overall_crop[0,1]:overall_crop[1,1],:] = step_cropped_images[4]
-        cv2.rectangle(result_img, (overall_crop[0,1], overall_crop[0,0]),
-                      (overall_crop[1,1], overall_crop[1,0]), (255, 0, 0), 4)
+        l_channel, blur, l_binary, closing, result_img = self.get_processing_step_images(cropped_img, frame_key)
 
-        step_images = [l_channel_img, blur_img, l_binary_img, closing_img, result_img]
+        step_images = [l_channel, blur, l_binary * 255, closing * 255, result_img]
         step_names = ['l_channel', 'blur', 'l_binary', 'closing', 'result_img']
         return step_images, step_names
 
@@ -222,7 +448,9 @@ class ThresholdDetector(object):
     def draw_detection_img(self, img,
                            zero_angle='left',
                            ang_text_y_diff=50,
-                           text_font_size=1.0):
+                           text_font_size=1.0,
+                           label_atlas=None,
+                           nb_label_lines=3):
         position, angle, hulls, angle_vector = self.detect_position_and_angle(img)
         _, rel_ang_deg = convert_angle(angle, zero_angle=zero_angle)
 
@@ -246,17 +474,27 @@ class ThresholdDetector(object):
                 #cv2.circle(img, position_int_list[i], 1, (0, 0, 255), -1)
                 cv2.circle(img, position_int_list[i], 15, (0,255,0), thickness=2)
 
-            #draw text
+            #draw text: position, angle, relative angle
             ang_text_pos = position_int + ang_text_y_diff
             ang_text_pos_list = [tuple(p) for p in ang_text_pos]
             ang_text_diff = np.zeros_like(ang_text_pos)
             ang_text_diff[:, 1] += ang_text_y_diff
             rel_ang_text_pos_list = [tuple(p) for p in ang_text_pos + ang_text_diff]
+            texts = []
+            text_orgs = []
             for i in range(len(position)):
-                cv2.putText(img, '{:.2f}, {:.2f}'.format(position[i][0], position[i][1]), position_int_list[i],
-                            cv2.FONT_HERSHEY_SIMPLEX, text_font_size, (0,0,255), 2)
-                cv2.putText(img, '{:.3f}'.format(angle[i]), ang_text_pos_list[i],
-                            cv2.FONT_HERSHEY_SIMPLEX, text_font_size, (0,0,255), 2)
-                cv2.putText(img, '{:.2f}'.format(rel_ang_deg[i]), rel_ang_text_pos_list[i],
-                            cv2.FONT_HERSHEY_SIMPLEX, text_font_size, (0,0,255), 2)
+                texts.append('{:.2f}, {:.2f}'.format(position[i][0], position[i][1]))
+                text_orgs.append(position_int_list[i])
+                if nb_label_lines > 1:
+                    texts.append('{:.3f}'.format(angle[i]))
+                    text_orgs.append(ang_text_pos_list[i])
+                if nb_label_lines > 2:
+                    texts.append('{:.2f}'.format(rel_ang_deg[i]))
+                    text_orgs.append(rel_ang_text_pos_list[i])
+            if label_atlas is None:
+                for i in range(len(texts)):
+                    cv2.putText(img, texts[i], text_orgs[i],
+                                cv2.FONT_HERSHEY_SIMPLEX, text_font_size, (0,0,255), 2)
+            else:
+                label_atlas.draw_texts(img, texts, text_orgs, (0,0,255))
         return img
@@ -0,0 +1,76 @@
+import numpy as np
+import cv2
+from lapsolver import solve_dense
+from scipy.spatial import distance_matrix
+
+from zebrafish.utils.profiler import profiler
+
+class MotionGate(object):
+    """
+    Decides which frames are detected (measured) and which reuse the detections of measured
+    frames (carried). A frame is measured if its motion score is at least motion_threshold:
+    nb of pixels of the crop downsampled by scale (gray, block mean) that changed by more than
+    pixel_threshold since the last measured frame. Comparing to the last measured frame (not the
+    previous frame) catches slow drifts. At most max_carry_frames frames in a row are carried.
+    carry_mode: 'hold' (detections of the last measured frame) or 'interpolate' (detections
+    matched between measured frames within max_interpolation_dist pixels are interpolated, others held).
+    """
+    def __init__(self,
+                 scale=8,
+                 pixel_threshold=12,
+                 motion_threshold=2,
+                 max_carry_frames=10):
+        self.scale = scale
+        self.pixel_threshold = pixel_threshold
+        self.motion_threshold = motion_threshold
+        self.max_carry_frames = max_carry_frames
+        self.carry_mode = 'hold'
+        self.max_interpolation_dist = 20.0
+        self.reset()
+
+    def reset(self):
+        self._measured_gray = None
+        self.nb_carried = 0
+        self.nb_frames = 0
+        self.nb_measured = 0
+
+    def get_settings(self):
+        return {'scale': self.scale,
+                'pixel_threshold': self.pixel_threshold,
+                'motion_threshold': self.motion_threshold,
+                'max_carry_frames': self.max_carry_frames,
+                'carry_mode': self.carry_mode,
+                'max_interpolation_dist': self.max_interpolation_dist}
+
+    def get_small_gray(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        size = (max(1, img.shape[1] // self.scale), max(1, img.shape[0] // self.scale))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    def get_motion_score(self, small_gray):
+        diff = cv2.absdiff(small_gray, self._measured_gray)
+        return int(np.count_nonzero(diff > self.pixel_threshold))
+
+    def is_measured(self, img):
+        """True if img must be detected, state is updated as if it is"""
+        self.nb_frames += 1
+        with profiler.stage('detector.motion_score'):
+            small_gray = self.get_small_gray(img)
+            measured = (self._measured_gray is None or self.nb_carried >= self.max_carry_frames or
+                        self.get_motion_score(small_gray) >= self.motion_threshold)
+        if measured:
+            self._measured_gray = small_gray
+            self.nb_carried = 0
+            self.nb_measured += 1
+        else:
+            self.nb_carried += 1
+        return measured
+
+    def match_positions(self, position, next_position):
+        """index pairs of detections of two measured frames within max_interpolation_dist"""
+        if len(position) == 0 or len(next_position) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        dist = distance_matrix(position, next_position)
+        rows, cols = solve_dense(dist)
+        matched = dist[rows, cols] <= self.max_interpolation_dist
+        return rows[matched], cols[matched]
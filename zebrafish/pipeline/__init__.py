@@ -0,0 +1,3 @@
+from zebrafish.pipeline.manifests import Manifest, get_manifest_path, is_manifest_path, get_file_fingerprint
+from zebrafish.pipeline.incremental_pipeline import IncrementalPipeline, PipelineStage
+from zebrafish.pipeline.file_catalog import FileCatalog, classify_file, scan_directory, get_post_video_stem
@@ -0,0 +1,143 @@
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from zebrafish.pipeline.manifests import is_manifest_path
+
+CATALOG_NAME = '.zebrafish_catalog.sqlite'
+CATALOG_VERSION = 1
+VIDEO_EXTENSIONS = ['mp4', 'MP4']
+DATA_EXTENSIONS = ['csv', 'xlsx']
+COLUMNS = ['path', 'dir', 'name', 'stem', 'kind', 'size', 'mtime_ns', 'scanned']
+
+def classify_file(path):
+    """
+    kind of a file as named by the savers: 'video', 'detection' (data), 'post' (data)
+    or None (not an input), and its name without extension
+    """
+    file_name = os.path.basename(path)
+    file_name_split = file_name.split('.')
+    exten = file_name_split[-1]
+    stem = '.'.join(file_name_split[:-1])
+    if exten in VIDEO_EXTENSIONS:
+        return 'video', stem
+    if exten in DATA_EXTENSIONS:
+        suffix = file_name_split[-2].split('_')[-1]
+        if suffix in ['detection', 'post']:
+            return suffix, stem
+    return None, stem
+
+def get_post_video_stem(post_stem):
+    """name of the video of post data, e.g. fish_detection_post -> fish"""
+    return '_'.join(post_stem.split('_')[:-2])
+
+def scan_directory(directory, known=None):
+    """
+    records (dicts of COLUMNS) of the files of directory, sorted by path.
+    Same files as glob('*.*'): hidden files are skipped, manifests too.
+    known: records by path (e.g. of a catalog), files with the same size and mtime are not classified again.
+    """
+    known = known or {}
+    now = time.time()
+    records = []
+    for entry in os.scandir(directory or '.'):
+        if entry.name.startswith('.') or '.' not in entry.name:
+            continue
+        path = os.path.join(directory, entry.name)
+        if is_manifest_path(path) or not entry.is_file():
+            continue
+        stat = entry.stat()
+        record = known.get(path)
+        if record is not None and (record['size'], record['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            records.append(record)
+            continue
+        kind, stem = classify_file(path)
+        records.append({'path': path, 'dir': directory, 'name': entry.name, 'stem': stem, 'kind': kind,
+                        'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'scanned': now})
+    return sorted(records, key=lambda r: r['path'])
+
+
+class FileCatalog(object):
+    """
+    Persistent catalog (sqlite) of the videos, detection data and post data of directories,
+    keyed on path with size and mtime, for queries across runs (missing or stale outputs).
+    scan() updates the rows of a directory from one listing (stat only): rows of unchanged
+    files are kept, only new or changed files are classified and written.
+    Connections are opened per call, so the catalog can be pickled to worker processes.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    @classmethod
+    def for_directory(cls, directory):
+        return cls(os.path.join(directory, CATALOG_NAME))
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                self.create_tables(conn)
+                yield conn
+        finally:
+            conn.close()
+
+    def create_tables(self, conn):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == CATALOG_VERSION:
+            return
+        #catalog of another version: rebuilt by the next scan
+        conn.execute('DROP TABLE IF EXISTS files')
+        conn.execute('CREATE TABLE files (path TEXT PRIMARY KEY, dir TEXT, name TEXT, stem TEXT, kind TEXT, '
+                     'size INTEGER, mtime_ns INTEGER, scanned REAL)')
+        conn.execute('CREATE INDEX files_dir_kind_stem ON files (dir, kind, stem)')
+        conn.execute('PRAGMA user_version = {}'.format(CATALOG_VERSION))
+
+    def scan(self, directory):
+        """updates the rows of directory, returns nb of added, updated and removed files"""
+        with self.connect() as conn:
+            known = dict((r['path'], dict(r)) for r in conn.execute('SELECT * FROM files WHERE dir = ?', (directory,)))
+            records = scan_directory(directory, known)
+            changed = [r for r in records if known.get(r['path']) is not r]
+            paths = set(r['path'] for r in records)
+            removed = [p for p in known if p not in paths]
+            conn.executemany('INSERT OR REPLACE INTO files ({}) VALUES ({})'.format(
+                ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), [[r[c] for c in COLUMNS] for r in changed])
+            conn.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in removed])
+        stats = {'added': len([r for r in changed if r['path'] not in known]),
+                 'updated': len([r for r in changed if r['path'] in known]),
+                 'removed': len(removed)}
+        logging.info('Catalog of {}: {} files, {}'.format(directory or '.', len(records), stats))
+        return stats
+
+    def query(self, sql, params=()):
+        with self.connect() as conn:
+            return [dict(r) for r in conn.execute(sql, params)]
+
+    def get_records(self, directory, kind=None):
+        """records of directory (kind: 'video', 'detection', 'post'), as of the last scan"""
+        if kind is None:
+            return self.query('SELECT * FROM files WHERE dir = ? ORDER BY path', (directory,))
+        return self.query('SELECT * FROM files WHERE dir = ? AND kind = ? ORDER BY path', (directory, kind))
+
+    def get_videos_without_detections(self, directory, detection_suffix='_detection'):
+        """videos without detection data (csv or xlsx) next to them"""
+        return self.query('SELECT v.* FROM files v WHERE v.dir = ? AND v.kind = \'video\' AND NOT EXISTS '
+                          '(SELECT 1 FROM files d WHERE d.dir = v.dir AND d.kind = \'detection\' '
+                          'AND d.stem = v.stem || ?) ORDER BY v.path', (directory, detection_suffix))
+
+    def get_stale_post_outputs(self, directory, post_suffix='_post'):
+        """post data older than its detection data (detection ran again after post)"""
+        return self.query('SELECT p.* FROM files p WHERE p.dir = ? AND p.kind = \'post\' AND EXISTS '
+                          '(SELECT 1 FROM files d WHERE d.dir = p.dir AND d.kind = \'detection\' '
+                          'AND d.stem || ? = p.stem AND d.mtime_ns > p.mtime_ns) ORDER BY p.path',
+                          (directory, post_suffix))
+
+    def get_post_without_detections(self, directory, post_suffix='_post'):
+        """post data whose detection data was removed"""
+        return self.query('SELECT p.* FROM files p WHERE p.dir = ? AND p.kind = \'post\' AND NOT EXISTS '
+                          '(SELECT 1 FROM files d WHERE d.dir = p.dir AND d.kind = \'detection\' '
+                          'AND d.stem || ? = p.stem) ORDER BY p.path', (directory, post_suffix))
@@ -0,0 +1,153 @@
+import logging
+import os
+from collections import OrderedDict
+
+from zebrafish.pipeline.manifests import Manifest, is_manifest_path
+from zebrafish.utils.profiler import profiler
+
+STEPS = ['detection', 'tracking', 'post', 'detection_video', 'post_video']
+
+class PipelineStage(object):
+    """
+    A node of the run graph: runs run() to write output_paths from input_paths.
+    Skipped while its manifest (inputs, settings, outputs) is up to date.
+    """
+    def __init__(self, name, input_paths, output_paths, settings, run):
+        self.name = name
+        self.input_paths = input_paths
+        self.output_paths = output_paths
+        self.settings = settings
+        self.run = run
+
+    def get_manifest(self):
+        return Manifest(self.name, self.input_paths, self.settings, self.output_paths)
+
+
+class IncrementalPipeline(object):
+    """
+    Runs the mp4 -> detection data -> tracked data -> post data (-> videos) chain and records
+    a manifest for every output. A stage is run only if its inputs, its settings or its outputs
+    changed since the last run, e.g. changing DataConverter settings reruns post only.
+
+    Tracked data is cached in tracked_data/ next to the detection data. With
+    PostProcessor.chunksize set, tracking and post run as one stage (no tracked data cache).
+    """
+    def __init__(self, processor):
+        self.processor = processor
+        self.steps = ['detection', 'tracking', 'post']
+        self.force = False
+        #stage name -> nb of (run, skipped) in the last run
+        self.stats = OrderedDict()
+
+    def get_detection_data_path(self, video_path):
+        #same as DetectionDataSaver output
+        return video_path.split('.')[0] + self.processor.detection_processor.saver.output_file_suffix
+
+    def get_video_stages(self, video_path):
+        detection_processor = self.processor.detection_processor
+        detection_data_path = self.get_detection_data_path(video_path)
+        stages = []
+        if 'detection' in self.steps:
+            stages.append(PipelineStage('detection', [video_path],
+                                        [detection_data_path + '.csv', detection_data_path + '.xlsx'],
+                                        detection_processor.get_detection_settings(),
+                                        lambda: detection_processor.save_detection_data(video_path)))
+        if 'detection_video' in self.steps:
+            names = video_path.split(os.path.sep)
+            video_output_path = os.path.join(*(names[:-1] + ['detection_video', names[-1].split('.')[0] + '_detection.mp4']))
+            stages.append(PipelineStage('detection_video', [video_path], [video_output_path],
+                                        detection_processor.get_render_settings(),
+                                        lambda: detection_processor.save_detection_video(video_path)))
+        stages += self.get_data_stages(detection_data_path + '.csv', video_path)
+        return stages
+
+    def get_data_stages(self, detection_data_path, video_path=None):
+        postprocessor = self.processor.postprocessor
+        saver = postprocessor.saver
+        post_data_path = saver.get_output_file_path(detection_data_path)
+        post_outputs = [post_data_path + '.csv']
+        if postprocessor.chunksize is None:
+            post_outputs.append(post_data_path + '.xlsx')
+        #track index and summary are written for tracked data (id column) only
+        if postprocessor.chunksize is None and postprocessor.save_track_index and postprocessor.run_tracker:
+            post_outputs.append(post_data_path + saver.track_index_suffix + '.npz')
+        if postprocessor.save_summary and postprocessor.run_tracker:
+            post_outputs.append(post_data_path + saver.summary_suffix + '.csv')
+
+        stages = []
+        if postprocessor.chunksize is not None:
+            if 'post' in self.steps:
+                settings = {'tracking': postprocessor.get_tracking_settings(),
+                            'post': postprocessor.get_post_settings(),
+                            'chunksize': postprocessor.chunksize}
+                stages.append(PipelineStage('post', [detection_data_path], post_outputs, settings,
+                                            lambda: postprocessor.save_post_data(detection_data_path)))
+        else:
+            tracked_data_path = saver.get_tracked_data_path(detection_data_path)
+            if 'tracking' in self.steps:
+                stages.append(PipelineStage('tracking', [detection_data_path], [tracked_data_path],
+                                            postprocessor.get_tracking_settings(),
+                                            lambda: postprocessor.save_tracked_data(detection_data_path)))
+            if 'post' in self.steps:
+                stages.append(PipelineStage('post', [tracked_data_path], post_outputs,
+                                            postprocessor.get_post_settings(),
+                                            lambda: postprocessor.save_post_data(detection_data_path,
+                                                                                 tracked_data_path=tracked_data_path)))
+        if 'post_video' in self.steps and video_path is not None:
+            names = (post_data_path + '.csv').split(os.path.sep)
+            video_output_path = os.path.join(*(names[:-1] + ['post_video', names[-1].split('.')[0] + '.mp4']))
+            stages.append(PipelineStage('post_video', [video_path, post_data_path + '.csv'], [video_output_path],
+                                        postprocessor.get_render_settings(),
+                                        lambda: postprocessor.save_post_video(video_path, post_data_path + '.csv')))
+        return stages
+
+    def run_stage(self, stage):
+        manifest = stage.get_manifest()
+        reason = 'forced' if self.force else manifest.get_outdated_reason()
+        run_count, skip_count = self.stats.get(stage.name, (0, 0))
+        if reason is None:
+            logging.info('Up to date, skipping {}: {}'.format(stage.name, stage.output_paths[0]))
+            self.stats[stage.name] = (run_count, skip_count + 1)
+            return False
+        logging.info('Running {} ({}): {}'.format(stage.name, reason, stage.output_paths[0]))
+        for p in stage.output_paths:
+            if not os.path.exists(os.path.dirname(p) or '.'):
+                os.makedirs(os.path.dirname(p))
+        #a failed run must not leave an up to date manifest
+        manifest.remove()
+        with profiler.stage('pipeline.' + stage.name):
+            stage.run()
+        manifest.save()
+        self.stats[stage.name] = (run_count + 1, skip_count)
+        return True
+
+    def get_inputs(self, file_paths):
+        """videos and detection data without their video in file_paths"""
+        file_paths = [p for p in file_paths if not is_manifest_path(p)]
+        video_paths = [p for p in file_paths if p.split('.')[-1] in ['mp4', 'MP4']]
+        video_detection_paths = set(self.get_detection_data_path(p) for p in video_paths)
+        suffix = self.processor.detection_processor.saver.output_file_suffix
+        detection_data_paths = []
+        for p in file_paths:
+            stem, exten = os.path.splitext(p)
+            if exten in ['.csv', '.xlsx'] and stem.endswith(suffix) and stem not in video_detection_paths:
+                #csv and xlsx of the same data: the csv
+                if exten == '.csv' or stem + '.csv' not in file_paths:
+                    detection_data_paths.append(p)
+        return video_paths, detection_data_paths
+
+    def run(self, file_paths):
+        """runs the steps for videos and detection data in file_paths, returns nb of run stages"""
+        self.stats = OrderedDict()
+        video_paths, detection_data_paths = self.get_inputs(file_paths)
+        nb_runs = 0
+        for video_path in video_paths:
+            logging.info('Pipeline of: ' + video_path)
+            for stage in self.get_video_stages(video_path):
+                nb_runs += self.run_stage(stage)
+        for detection_data_path in detection_data_paths:
+            logging.info('Pipeline of: ' + detection_data_path)
+            for stage in self.get_data_stages(detection_data_path):
+                nb_runs += self.run_stage(stage)
+        logging.info('Pipeline stages (run, skipped): {}'.format(dict(self.stats)))
+        return nb_runs
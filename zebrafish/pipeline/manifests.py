@@ -0,0 +1,97 @@
+import numpy as np
+import logging
+import os
+import json
+import time
+
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+
+def get_manifest_path(output_path):
+    """manifest sidecar of an output file"""
+    return output_path + MANIFEST_SUFFIX
+
+def is_manifest_path(path):
+    return path.endswith(MANIFEST_SUFFIX)
+
+def get_file_fingerprint(path):
+    """size and modification time of a file (None if missing), files are not read"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def to_json_value(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Not json serializable: {}'.format(type(value)))
+
+def normalize_settings(settings):
+    """settings as loaded back from json (tuples are lists, numpy values are python values)"""
+    return json.loads(json.dumps(settings, sort_keys=True, default=to_json_value))
+
+
+class Manifest(object):
+    """
+    Record of a stage run: fingerprints of its input files, the settings it ran with and
+    fingerprints of the files it wrote. Saved as a json sidecar of the first output.
+    An output is up to date while inputs, settings and outputs match the record.
+    """
+    def __init__(self, stage, input_paths, settings, output_paths):
+        self.stage = stage
+        self.input_paths = list(input_paths)
+        self.settings = normalize_settings(settings)
+        self.output_paths = list(output_paths)
+
+    def get_path(self):
+        return get_manifest_path(self.output_paths[0])
+
+    def get_record(self):
+        return {'version': MANIFEST_VERSION,
+                'stage': self.stage,
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'inputs': dict((p, get_file_fingerprint(p)) for p in self.input_paths),
+                'settings': self.settings,
+                'outputs': dict((p, get_file_fingerprint(p)) for p in self.output_paths)}
+
+    def load_record(self):
+        try:
+            with open(self.get_path()) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def get_outdated_reason(self):
+        """why the outputs need to be computed again (None: up to date)"""
+        record = self.load_record()
+        if record is None:
+            return 'no manifest'
+        if record.get('version') != MANIFEST_VERSION or record.get('stage') != self.stage:
+            return 'manifest of another version or stage'
+        for p in self.output_paths:
+            fingerprint = get_file_fingerprint(p)
+            if fingerprint is None:
+                return 'missing output: ' + p
+            if record['outputs'].get(p) != fingerprint:
+                return 'output changed: ' + p
+        if sorted(record['inputs']) != sorted(self.input_paths):
+            return 'inputs changed'
+        for p in self.input_paths:
+            if record['inputs'][p] != get_file_fingerprint(p):
+                return 'input changed: ' + p
+        if record['settings'] != self.settings:
+            changed = sorted(k for k in set(record['settings']) | set(self.settings)
+                             if record['settings'].get(k) != self.settings.get(k))
+            return 'settings changed: {}'.format(changed)
+        return None
+
+    def save(self):
+        with open(self.get_path(), 'w') as f:
+            json.dump(self.get_record(), f, indent=2, sort_keys=True)
+
+    def remove(self):
+        if os.path.exists(self.get_path()):
+            os.remove(self.get_path())
@@ -1 +1,4 @@
-from zebrafish.post.post_processing_methods import DataConverter, PositionBounder
+from zebrafish.post.post_pipeline import PostStage, PostPipeline
+from zebrafish.post.post_processing_methods import DataConverter, PositionBounder, RegionLabeler
+from zebrafish.post.track_index import TrackIndex
+from zebrafish.post.summary_metrics import SummaryMetrics
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+class PostStage(ABC):
+    """
+    Post-processing stage (abstract: subclasses implement run_columns).
+    Declares the data columns it reads and writes, run_columns gets
+    {column name: array} (data columns and outputs of previous stages)
+    and returns {output column name: array}.
+    """
+    def get_input_columns(self):
+        return []
+
+    def get_output_columns(self):
+        return []
+
+    def get_settings(self):
+        """parameters that change the outputs"""
+        return {}
+
+    @abstractmethod
+    def run_columns(self, columns):
+        pass
+
+    def run(self, data):
+        """runs this stage alone on data"""
+        columns = get_column_arrays(data, self.get_input_columns())
+        for name, values in self.run_columns(columns).items():
+            data[name] = values
+        return data
+
+
+def get_column_arrays(data, names):
+    """contiguous arrays of the columns in data"""
+    return OrderedDict((name, np.ascontiguousarray(data[name].to_numpy()))
+                       for name in names if name in data.columns)
+
+
+class PostPipeline(object):
+    """
+    Runs selected stages in registration order in one pass over column arrays.
+    Input columns are read from data once, outputs of a stage are available to the
+    next stages, and every output is joined to data at the end.
+
+    export_columns: data columns kept in the output (None: every column),
+    stage outputs and required_columns are always kept.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.selected = OrderedDict()
+        self.export_columns = None
+        self.required_columns = ['frame_num', 'id']
+
+    def register(self, name, stage, selected=False):
+        self.stages[name] = stage
+        self.selected[name] = selected
+        return stage
+
+    def unregister(self, name):
+        del self.stages[name]
+        del self.selected[name]
+
+    def get_selected_stages(self):
+        return [(name, stage) for name, stage in self.stages.items() if self.selected[name]]
+
+    def get_settings(self):
+        """selected stages (in order) with their settings, and column selection"""
+        return {'stages': [[name, stage.get_settings()] for name, stage in self.get_selected_stages()],
+                'export_columns': self.export_columns,
+                'required_columns': self.required_columns}
+
+    def get_input_columns(self, stages):
+        """data columns read by stages (columns written by an earlier stage are not read from data)"""
+        input_columns = []
+        output_columns = set()
+        for name, stage in stages:
+            input_columns += [c for c in stage.get_input_columns()
+                              if c not in output_columns and c not in input_columns]
+            output_columns.update(stage.get_output_columns())
+        return input_columns
+
+    def run(self, data):
+        stages = self.get_selected_stages()
+        columns = get_column_arrays(data, self.get_input_columns(stages))
+        outputs = OrderedDict()
+        for name, stage in stages:
+            stage_outputs = stage.run_columns(columns)
+            columns.update(stage_outputs)
+            outputs.update(stage_outputs)
+        logging.info('Post stages run: {}'.format([name for name, stage in stages]))
+
+        #prune unused data columns, join outputs once
+        kept_columns = [c for c in data.columns if c not in outputs and
+                        (self.export_columns is None or c in self.export_columns or c in self.required_columns)]
+        if len(kept_columns) < len(data.columns) - len([c for c in data.columns if c in outputs]):
+            logging.info('Pruned columns: {}'.format([c for c in data.columns
+                                                      if c not in kept_columns and c not in outputs]))
+        if len(outputs) == 0:
+            return data[kept_columns]
+        return pd.concat([data[kept_columns], pd.DataFrame(outputs, index=data.index)], axis=1)
@@ -2,7 +2,9 @@ import numpy as np
 import cv2
 import logging
 
-class DataConverter(object):
+from zebrafish.post.post_pipeline import PostStage
+
+class DataConverter(PostStage):
 
     def __init__(self):
         self._available_converters = [
@@ -17,47 +19,174 @@ class DataConverter(object):
             'rel_angle_rad_to_sin_rel_angle':False,
             'rel_angle_rad_to_cos_rel_angle':False
         }
+        #(input columns, output columns) of converters
+        self._converter_columns = {
+            'pixel_diff_to_pixel_velocity': (['pos_diff_x', 'pos_diff_y', 'pos_dist', 'frame_diff'],
+                                             ['velocity_pixel_x', 'velocity_pixel_y', 'velocity_pixel']),
+            'pixel_to_cm': (['velocity_pixel'], ['velocity_cm']),
+            'rel_angle_rad_to_sin_rel_angle': (['rel_angle_rad'], ['sin_rel_angle']),
+            'rel_angle_rad_to_cos_rel_angle': (['rel_angle_rad'], ['cos_rel_angle'])
+        }
         self.fps = 30.0
         self.pixel_to_cm_ratio = 1.0
 
-    def run(self, data):
-        if self.selected['pixel_diff_to_pixel_velocity']:
+    def is_selected(self, converter):
+        #app settings select sin/cos converters with 'rel_angle_deg_to_*' keys
+        return self.selected.get(converter, False) or self.selected.get(converter.replace('_rad_', '_deg_'), False)
+
+    def get_selected_converters(self):
+        return [c for c in self._available_converters if self.is_selected(c)]
+
+    def get_settings(self):
+        settings = {'converters': self.get_selected_converters()}
+        if self.is_selected('pixel_diff_to_pixel_velocity'):
+            settings['fps'] = self.fps
+        if self.is_selected('pixel_to_cm'):
+            settings['pixel_to_cm_ratio'] = self.pixel_to_cm_ratio
+        return settings
+
+    def get_input_columns(self):
+        input_columns = []
+        output_columns = []
+        for c in self.get_selected_converters():
+            input_columns += [name for name in self._converter_columns[c][0]
+                              if name not in output_columns and name not in input_columns]
+            output_columns += self._converter_columns[c][1]
+        return input_columns
+
+    def get_output_columns(self):
+        return [name for c in self.get_selected_converters() for name in self._converter_columns[c][1]]
+
+    def run_columns(self, columns):
+        outputs = {}
+        if self.is_selected('pixel_diff_to_pixel_velocity'):
             logging.info('Converting pixel diff to pixel velocity, fps: ' + str(self.fps))
-            data['velocity_pixel_x'] = data['pos_diff_x'] * self.fps / data['frame_diff']
-            data['velocity_pixel_y'] = data['pos_diff_y'] * self.fps / data['frame_diff']
-            data['velocity_pixel'] = data['pos_dist'] * self.fps / data['frame_diff']
+            frame_diff = columns['frame_diff']
+            outputs['velocity_pixel_x'] = columns['pos_diff_x'] * self.fps / frame_diff
+            outputs['velocity_pixel_y'] = columns['pos_diff_y'] * self.fps / frame_diff
+            outputs['velocity_pixel'] = columns['pos_dist'] * self.fps / frame_diff
             logging.info('Converted pixel diff to pixel velocity')
-        if self.selected['pixel_to_cm']:
+        if self.is_selected('pixel_to_cm'):
             logging.info('Converting pixel to cm, pixel_to_cm_ratio: ' + str(self.pixel_to_cm_ratio))
-            try:
-                data['velocity_cm'] = data['velocity_pixel'] * self.pixel_to_cm_ratio
-                logging.info('Converted pixel_diff_to_pixel_velocity')
-            except:
-                logging.info('velocity_cm column does not exist. passing...')
-        if self.selected['rel_angle_rad_to_sin_rel_angle']:
+            velocity_pixel = outputs.get('velocity_pixel', columns.get('velocity_pixel'))
+            if velocity_pixel is None:
+                logging.info('velocity_pixel column does not exist. passing...')
+            else:
+                outputs['velocity_cm'] = velocity_pixel * self.pixel_to_cm_ratio
+                logging.info('Converted pixel_to_cm')
+        if self.is_selected('rel_angle_rad_to_sin_rel_angle'):
             logging.info('Converting rel_angle rad to sin rel_angle')
-            data['sin_rel_angle'] = np.sin(data['rel_angle_rad'])
-        if self.selected['rel_angle_deg_to_cos_rel_angle']:
+            outputs['sin_rel_angle'] = np.sin(columns['rel_angle_rad'])
+        if self.is_selected('rel_angle_rad_to_cos_rel_angle'):
             logging.info('Converting rel_angle rad to cos rel_angle')
-            data['cos_rel_angle'] = np.cos(data['rel_angle_rad'])
-        return data
+            outputs['cos_rel_angle'] = np.cos(columns['rel_angle_rad'])
+        return outputs
 
-class PositionBounder(object):
+class PositionBounder(PostStage):
     """
     Filters position by xy coordinate(pixel) bounds.
     """
     def __init__(self):
         self.bounds = []
 
-    def run(self, data):
+    def get_input_columns(self):
+        return ['pos_x_in_frame', 'pos_y_in_frame'] if len(self.bounds) > 0 else []
+
+    def get_output_columns(self):
+        return ['bound_{}-'.format(i) + str(self.bounds[i]) for i in range(len(self.bounds))]
+
+    def get_settings(self):
+        return {'bounds': np.asarray(self.bounds).tolist()}
+
+    def run_columns(self, columns):
+        outputs = {}
+        output_columns = self.get_output_columns()
         for i in range(len(self.bounds)):
             x_lower = self.bounds[i][0][0]
             x_upper = self.bounds[i][0][1]
             y_lower = self.bounds[i][1][0]
             y_upper = self.bounds[i][1][1]
-            x_idx_lower = data['pos_x_in_frame'] > x_lower
-            x_idx_upper = data['pos_x_in_frame'] < x_upper
-            y_idx_lower = data['pos_y_in_frame'] > y_lower
-            y_idx_upper = data['pos_y_in_frame'] < y_upper
-            data['bound_{}-'.format(i) + str(self.bounds[i])] = x_idx_lower & x_idx_upper & y_idx_lower & y_idx_upper
-        return data
+            x = columns['pos_x_in_frame']
+            y = columns['pos_y_in_frame']
+            outputs[output_columns[i]] = (x > x_lower) & (x < x_upper) & (y > y_lower) & (y < y_upper)
+        return outputs
+
+class RegionLabeler(PostStage):
+    """
+    Region membership by a label mask.
+    Regions are rectangles ([[x_lower, x_upper], [y_lower, y_upper]], same as PositionBounder bounds)
+    or polygons ([[x, y], ...]) in frame pixels. They are rasterized once into a label mask over
+    overall_crop, region_id of a row is the mask value at its position
+    (0: no region, a later region is drawn over earlier ones where they overlap).
+    """
+    def __init__(self):
+        self.overall_crop = np.array([[0,1290],[2120,3400]])
+        self.regions = []
+        self._mask = None
+        self._mask_key = None
+
+    def add_rectangle(self, x_bound, y_bound, name=None):
+        return self.add_region('rectangle', [list(x_bound), list(y_bound)], name)
+
+    def add_polygon(self, points, name=None):
+        return self.add_region('polygon', [list(p) for p in points], name)
+
+    def add_region(self, region_type, points, name=None):
+        region_id = len(self.regions) + 1
+        if name is None:
+            name = '{}_{}'.format(region_type, region_id)
+        self.regions.append({'name': name, 'type': region_type, 'points': points})
+        return region_id
+
+    def clear(self):
+        self.regions = []
+        self._mask = None
+
+    def get_region_names(self):
+        """region_id -> name"""
+        return dict((i + 1, r['name']) for i, r in enumerate(self.regions))
+
+    def get_mask(self):
+        crop = np.asarray(self.overall_crop)
+        mask_key = (tuple(crop.ravel().tolist()), str(self.regions))
+        if self._mask is not None and self._mask_key == mask_key:
+            return self._mask
+        mask = np.zeros((crop[1,0] - crop[0,0], crop[1,1] - crop[0,1]), dtype=np.uint16)
+        for i, region in enumerate(self.regions):
+            if region['type'] == 'rectangle':
+                x_bound, y_bound = region['points']
+                x_start = max(0, int(np.floor(x_bound[0])) - crop[0,1])
+                x_end = max(0, int(np.ceil(x_bound[1])) - crop[0,1])
+                y_start = max(0, int(np.floor(y_bound[0])) - crop[0,0])
+                y_end = max(0, int(np.ceil(y_bound[1])) - crop[0,0])
+                mask[y_start:y_end, x_start:x_end] = i + 1
+            elif region['type'] == 'polygon':
+                points = np.round(np.array(region['points'], dtype=np.float64) - crop[0, ::-1]).astype(np.int32)
+                cv2.fillPoly(mask, [points], i + 1)
+            else:
+                raise ValueError('Unknown region type: {}'.format(region['type']))
+        self._mask = mask
+        self._mask_key = mask_key
+        logging.info('Region mask built, nb regions: {}'.format(len(self.regions)))
+        return mask
+
+    def get_input_columns(self):
+        return ['pos_x_in_frame', 'pos_y_in_frame']
+
+    def get_output_columns(self):
+        return ['region_id']
+
+    def get_settings(self):
+        return {'overall_crop': np.asarray(self.overall_crop).tolist(),
+                'regions': self.regions}
+
+    def run_columns(self, columns):
+        mask = self.get_mask()
+        crop = np.asarray(self.overall_crop)
+        x = columns['pos_x_in_frame'] - crop[0,1]
+        y = columns['pos_y_in_frame'] - crop[0,0]
+        #rows outside the crop (or without position) are in no region
+        inside = (x >= 0) & (x < mask.shape[1]) & (y >= 0) & (y < mask.shape[0])
+        region_id = np.zeros(len(x), dtype=mask.dtype)
+        region_id[inside] = mask[y[inside].astype(np.int64), x[inside].astype(np.int64)]
+        return {'region_id': region_id}
@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import logging
+
+#values reduced with max / min, other values are summed
+_MAX_VALUES = ['max_speed', 'last_frame']
+_MIN_VALUES = ['first_frame']
+
+def reduce_by_keys(ids, time_bins, values, return_groups=False):
+    """
+    Segmented reductions of values (name -> array) per (id, time_bin).
+    Rows are sorted by (id, time_bin) once, every value is reduced with one reduceat.
+    return_groups: also returns the reduced row index of every input row.
+    """
+    order = np.lexsort((time_bins, ids))
+    sorted_ids = ids[order]
+    sorted_bins = time_bins[order]
+    if len(order) == 0:
+        starts = np.zeros(0, dtype=np.int64)
+    else:
+        key_changes = (sorted_ids[1:] != sorted_ids[:-1]) | (sorted_bins[1:] != sorted_bins[:-1])
+        starts = np.concatenate([[0], np.flatnonzero(key_changes) + 1]).astype(np.int64)
+    reduced = {'id': sorted_ids[starts], 'time_bin': sorted_bins[starts]}
+    for name, v in values.items():
+        v = v[order]
+        if len(starts) == 0:
+            reduced[name] = v[:0]
+        elif name in _MAX_VALUES:
+            reduced[name] = np.maximum.reduceat(v, starts, axis=0)
+        elif name in _MIN_VALUES:
+            reduced[name] = np.minimum.reduceat(v, starts, axis=0)
+        else:
+            reduced[name] = np.add.reduceat(v, starts, axis=0)
+    if return_groups:
+        groups = np.empty(len(order), dtype=np.int64)
+        groups[order] = np.repeat(np.arange(len(starts)), np.diff(np.concatenate([starts, [len(order)]])))
+        return reduced, groups
+    return reduced
+
+
+class SummaryMetrics(object):
+    """
+    Per-fish (id) and per time bin rheotaxis summary of post data.
+    Chunks are reduced to partial sums per (id, time_bin) and merged, so large
+    files can be summarized chunk by chunk (add_chunk, get_summary).
+
+    time_bin_s: time bin length in seconds (None: one bin per id).
+    oriented_angle_deg: rows with |rel_angle_deg| <= oriented_angle_deg are oriented against the flow.
+    speed_bin_edges: speed histogram bins for speed percentiles (speeds above the last edge are in the last bin).
+    """
+    def __init__(self):
+        self.fps = 30.0
+        self.time_bin_s = None
+        self.oriented_angle_deg = 45.0
+        self.speed_column = 'velocity_pixel'
+        self.speed_bin_edges = np.linspace(0, 1000, 201)
+        self.max_partials = 16
+        self.reset()
+
+    def reset(self):
+        self._partials = []
+
+    def get_settings(self):
+        return {'fps': self.fps,
+                'time_bin_s': self.time_bin_s,
+                'oriented_angle_deg': self.oriented_angle_deg,
+                'speed_column': self.speed_column,
+                'speed_bin_edges': np.asarray(self.speed_bin_edges).tolist()}
+
+    def get_column(self, data, name):
+        if name in data.columns:
+            return np.asarray(data[name], dtype=np.float64)
+        return np.full(len(data), np.nan)
+
+    def get_partial(self, data):
+        ids = self.get_column(data, 'id')
+        valid = ~np.isnan(ids)
+        ids = ids[valid]
+        frame_nums = self.get_column(data, 'frame_num')[valid]
+        if self.time_bin_s is None:
+            time_bins = np.zeros(len(ids), dtype=np.int64)
+        else:
+            time_bins = np.floor(frame_nums / (self.time_bin_s * self.fps)).astype(np.int64)
+
+        rel_angle_deg = self.get_column(data, 'rel_angle_deg')[valid]
+        if 'cos_rel_angle' in data.columns:
+            cos_rel_angle = self.get_column(data, 'cos_rel_angle')[valid]
+        else:
+            cos_rel_angle = np.cos(self.get_column(data, 'rel_angle_rad')[valid])
+        speed = self.get_column(data, self.speed_column)[valid]
+        pos_dist = self.get_column(data, 'pos_dist')[valid]
+
+        has_angle = ~np.isnan(rel_angle_deg)
+        has_cos = ~np.isnan(cos_rel_angle)
+        has_speed = ~np.isnan(speed)
+        speed_zero = np.where(has_speed, speed, 0.)
+
+        values = {
+            'nb_rows': np.ones(len(ids), dtype=np.int64),
+            'first_frame': frame_nums,
+            'last_frame': frame_nums,
+            'nb_angle': has_angle.astype(np.int64),
+            'nb_oriented': (has_angle & (np.abs(np.where(has_angle, rel_angle_deg, 180.)) <= self.oriented_angle_deg)).astype(np.int64),
+            'nb_cos': has_cos.astype(np.int64),
+            'sum_cos': np.where(has_cos, cos_rel_angle, 0.),
+            'nb_speed': has_speed.astype(np.int64),
+            'sum_speed': speed_zero,
+            'sum_speed_sq': speed_zero ** 2,
+            'max_speed': np.where(has_speed, speed, -np.inf),
+            'distance': np.where(np.isnan(pos_dist), 0., pos_dist)
+        }
+        reduced, groups = reduce_by_keys(ids, time_bins, values, return_groups=True)
+
+        #speed histograms per key: one bincount over (key, speed bin)
+        nb_bins = len(self.speed_bin_edges) - 1
+        nb_keys = len(reduced['id'])
+        speed_bins = np.clip(np.searchsorted(self.speed_bin_edges, speed[has_speed], side='right') - 1, 0, nb_bins - 1)
+        reduced['speed_hist'] = np.bincount(groups[has_speed] * nb_bins + speed_bins,
+                                            minlength=nb_keys * nb_bins).reshape(nb_keys, nb_bins)
+        return reduced
+
+    def merge_partials(self, partials):
+        values = dict((name, np.concatenate([p[name] for p in partials]))
+                      for name in partials[0] if name not in ['id', 'time_bin'])
+        return reduce_by_keys(np.concatenate([p['id'] for p in partials]),
+                              np.concatenate([p['time_bin'] for p in partials]), values)
+
+    def add_chunk(self, data):
+        self._partials.append(self.get_partial(data))
+        #partials of a chunk are small (one row per key), merge them to bound memory
+        if len(self._partials) > self.max_partials:
+            self._partials = [self.merge_partials(self._partials)]
+
+    def get_speed_percentile(self, speed_hist, q):
+        """speed percentile (q in [0, 1]) per row, linear within histogram bins"""
+        total = speed_hist.sum(axis=1)
+        cum_hist = np.cumsum(speed_hist, axis=1)
+        target = q * total
+        #first bin reaching the target count
+        bin_idx = np.clip(np.sum(cum_hist < target[:, None], axis=1), 0, speed_hist.shape[1] - 1)
+        rows = np.arange(len(total))
+        cum_before = cum_hist[rows, bin_idx] - speed_hist[rows, bin_idx]
+        in_bin = np.where(speed_hist[rows, bin_idx] > 0,
+                          (target - cum_before) / np.maximum(speed_hist[rows, bin_idx], 1), 0.)
+        percentile = self.speed_bin_edges[bin_idx] + in_bin * np.diff(self.speed_bin_edges)[bin_idx]
+        return np.where(total > 0, percentile, np.nan)
+
+    def get_summary(self):
+        """summary table, one row per (id, time_bin)"""
+        if len(self._partials) == 0:
+            return pd.DataFrame()
+        reduced = self.merge_partials(self._partials)
+        self._partials = [reduced]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed_mean = reduced['sum_speed'] / reduced['nb_speed']
+            speed_var = reduced['sum_speed_sq'] / reduced['nb_speed'] - speed_mean ** 2
+            summary = pd.DataFrame({
+                'id': reduced['id'],
+                'time_bin': reduced['time_bin'],
+                'start_s': reduced['time_bin'] * (self.time_bin_s or 0.),
+                'first_frame': reduced['first_frame'],
+                'last_frame': reduced['last_frame'],
+                'nb_frames': reduced['nb_rows'],
+                'oriented_ratio': reduced['nb_oriented'] / reduced['nb_angle'],
+                'oriented_time_s': reduced['nb_oriented'] / self.fps,
+                'mean_cos_rel_angle': reduced['sum_cos'] / reduced['nb_cos'],
+                'speed_mean': speed_mean,
+                'speed_std': np.sqrt(np.maximum(speed_var, 0.)),
+                'speed_max': np.where(reduced['nb_speed'] > 0, reduced['max_speed'], np.nan),
+                'speed_p50': self.get_speed_percentile(reduced['speed_hist'], 0.5),
+                'speed_p90': self.get_speed_percentile(reduced['speed_hist'], 0.9),
+                'distance_pixel': reduced['distance'],
+            })
+        logging.info('Summary: {} ids, {} rows'.format(len(np.unique(reduced['id'])), len(summary)))
+        return summary
+
+    def summarize(self, data):
+        self.reset()
+        self.add_chunk(data)
+        return self.get_summary()
+
+    def summarize_file(self, post_data_path, chunksize=1000000):
+        """summary of a post data csv, read in chunks of chunksize rows"""
+        self.reset()
+        for chunk in pd.read_csv(post_data_path, chunksize=chunksize):
+            self.add_chunk(chunk)
+        return self.get_summary()
@@ -0,0 +1,125 @@
+import numpy as np
+import logging
+
+class TrackIndex(object):
+    """
+    Per-id row offsets over post data.
+
+    Rows of post data are kept in frame order. `order` is a permutation of
+    those rows sorted by (id, frame_num), so the rows of one id are the
+    contiguous slice order[offsets[k]:offsets[k + 1]] and queries cost
+    O(result) instead of a full-table boolean filter.
+    """
+    def __init__(self):
+        self.data = None
+        self.ids = np.empty(0)
+        self.order = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.start_frames = np.empty(0)
+        self.end_frames = np.empty(0)
+        self.frame_nums = np.empty(0)
+        self.frame_order = None
+        self.sorted_frame_nums = np.empty(0)
+
+    def build(self, data):
+        frame_nums = np.asarray(data['frame_num'], dtype=np.float64)
+        ids = np.asarray(data['id'], dtype=np.float64)
+
+        #id sorted permutation (stable on frame_num), untracked rows (nan id) dropped
+        order = np.lexsort((frame_nums, ids))
+        order = order[~np.isnan(ids[order])]
+        sorted_ids = ids[order]
+
+        id_starts = np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1
+        offsets = np.concatenate([[0], id_starts, [len(order)]]).astype(np.int64)
+        if len(order) == 0:
+            offsets = np.zeros(1, dtype=np.int64)
+
+        self.ids = sorted_ids[offsets[:-1]]
+        self.order = order.astype(np.int64)
+        self.offsets = offsets
+        self.start_frames = frame_nums[self.order[offsets[:-1]]]
+        self.end_frames = frame_nums[self.order[offsets[1:] - 1]]
+        self.set_data(data)
+        logging.info('Track index built, nb ids: {}'.format(len(self.ids)))
+        return self
+
+    def set_data(self, data):
+        self.data = data
+        self.frame_nums = np.asarray(data['frame_num'], dtype=np.float64)
+        #post data is saved in frame order, keep a permutation only if it is not
+        if np.all(self.frame_nums[1:] >= self.frame_nums[:-1]):
+            self.frame_order = None
+            self.sorted_frame_nums = self.frame_nums
+        else:
+            self.frame_order = np.argsort(self.frame_nums, kind='mergesort')
+            self.sorted_frame_nums = self.frame_nums[self.frame_order]
+
+    def save(self, path):
+        np.savez(path,
+                 ids=self.ids,
+                 order=self.order,
+                 offsets=self.offsets,
+                 start_frames=self.start_frames,
+                 end_frames=self.end_frames)
+        logging.info('Track index saved at: ' + path)
+
+    def load(self, path, data=None):
+        with np.load(path) as index:
+            self.ids = index['ids']
+            self.order = index['order']
+            self.offsets = index['offsets']
+            self.start_frames = index['start_frames']
+            self.end_frames = index['end_frames']
+        if data is not None:
+            self.set_data(data)
+        return self
+
+    def _get_id_pos(self, track_id):
+        k = np.searchsorted(self.ids, track_id)
+        if k >= len(self.ids) or self.ids[k] != track_id:
+            raise KeyError('id not in track index: {}'.format(track_id))
+        return k
+
+    def get_rows(self, track_id):
+        """row positions of one id in frame order"""
+        k = self._get_id_pos(track_id)
+        return self.order[self.offsets[k]:self.offsets[k + 1]]
+
+    def get_id_rows(self, track_id, start_frame=None, end_frame=None):
+        """row positions of one id within frames [start_frame, end_frame)"""
+        rows = self.get_rows(track_id)
+        track_frames = self.frame_nums[rows]
+        lower = 0 if start_frame is None else np.searchsorted(track_frames, start_frame, side='left')
+        upper = len(rows) if end_frame is None else np.searchsorted(track_frames, end_frame, side='left')
+        return rows[lower:upper]
+
+    def get_window_rows(self, start_frame, end_frame):
+        """row positions of every detection within frames [start_frame, end_frame)"""
+        lower = np.searchsorted(self.sorted_frame_nums, start_frame, side='left')
+        upper = np.searchsorted(self.sorted_frame_nums, end_frame, side='left')
+        if self.frame_order is None:
+            return np.arange(lower, upper)
+        return self.frame_order[lower:upper]
+
+    def get_alive_ids(self, start_frame, end_frame):
+        """ids with at least one frame span overlapping [start_frame, end_frame)"""
+        alive = (self.start_frames < end_frame) & (self.end_frames >= start_frame)
+        return self.ids[alive]
+
+    def get_trajectory(self, track_id, columns=None):
+        return self._take(self.get_rows(track_id), columns)
+
+    def get_id_slice(self, track_id, start_frame=None, end_frame=None, columns=None):
+        return self._take(self.get_id_rows(track_id, start_frame, end_frame), columns)
+
+    def get_window(self, start_frame, end_frame, columns=None):
+        return self._take(self.get_window_rows(start_frame, end_frame), columns)
+
+    def _take(self, rows, columns=None):
+        if columns is None:
+            return self.data.iloc[rows]
+        return self.data.iloc[rows, self.data.columns.get_indexer(columns)]
+
+    def __len__(self):
+        return len(self.ids)
@@ -1,6 +1,9 @@
 import numpy as np
 import pandas as pd
 import logging
+import os
+
+from zebrafish.utils.profiler import profiler
 
 class DataSaver(object):
 
@@ -39,25 +42,36 @@ class DetectionDataSaver(DataSaver):
 
         self.data_names = self.base_data_names + self.input_data_names
         self.data_names_idx = dict((name, i) for i, name in enumerate(self.data_names))
+        #per frame flags saved as last columns, e.g. ['measured'] (motion gating)
+        self.flag_data_names = []
 
-    def add_data_by_frame(self, input_data, frame_num):
-        frame_num_array = np.zeros((input_data.shape[0], 1)) + frame_num
-        data = np.concatenate([frame_num_array, input_data], axis=-1)
-        self.data.append(data)
+    def add_data_by_frame(self, input_data, frame_num, flags=()):
+        with profiler.stage('saver.add_detection_data'):
+            frame_num_array = np.zeros((input_data.shape[0], 1)) + frame_num
+            flag_arrays = [np.zeros((input_data.shape[0], 1)) + flag for flag in flags]
+            data = np.concatenate([frame_num_array, input_data] + flag_arrays, axis=-1)
+            self.data.append(data)
 
     def save(self):
         #save data
-        data = np.concatenate(self.data, axis=0)
-        data = pd.DataFrame(data, columns=self.data_names)
-        #data.to_excel(self.excel_writer, 'data', index=False)
-        #self.excel_writer.save()
-        data.to_excel(self.output_file_path + '.xlsx', sheet_name='data', index=False)
-        data.to_csv(self.output_file_path + '.csv', index=False)
+        with profiler.stage('saver.save_detection_data'):
+            data = np.concatenate(self.data, axis=0)
+            data = pd.DataFrame(data, columns=self.data_names + self.flag_data_names)
+            #data.to_excel(self.excel_writer, 'data', index=False)
+            #self.excel_writer.save()
+            data.to_excel(self.output_file_path + '.xlsx', sheet_name='data', index=False)
+            data.to_csv(self.output_file_path + '.csv', index=False)
         logging.info('Detection data saved at: ' + self.output_file_path)
 
     def clear(self):
         self.data = []
 
+    def __getstate__(self):
+        #rows of the last detection run (saved by save()) are not sent to worker processes
+        state = self.__dict__.copy()
+        state['data'] = []
+        return state
+
     @property
     def video_path(self):
         return self._video_path
@@ -73,15 +87,52 @@ class PostprocessDataSaver(DataSaver):
     def __init__(self):
         super(PostprocessDataSaver, self).__init__()
         self.output_file_suffix = '_post'
+        self.track_index_suffix = '_track_index'
+        self.summary_suffix = '_summary'
+        #tracked data (before post methods) is cached in this folder next to the detection data
+        self.tracked_data_dir = 'tracked_data'
+        self.tracked_suffix = '_tracked'
         self._post_data_path = None
 
     def save(self, data):
         #data.to_excel(self.excel_writer, 'data', index=False)
         #self.excel_writer.save()
-        data.to_excel(self.output_file_path + '.xlsx', sheet_name='data', index=False)
-        data.to_csv(self.output_file_path + '.csv', index=False)
+        with profiler.stage('saver.save_post_data'):
+            data.to_excel(self.output_file_path + '.xlsx', sheet_name='data', index=False)
+            data.to_csv(self.output_file_path + '.csv', index=False)
         logging.info('Postprocessed data saved at: ' + self.output_file_path)
 
+    def save_chunk(self, data, is_first_chunk=False):
+        """appends rows to the csv output (xlsx is not written in chunks)"""
+        with profiler.stage('saver.save_post_data'):
+            data.to_csv(self.output_file_path + '.csv', mode='w' if is_first_chunk else 'a',
+                        header=is_first_chunk, index=False)
+
+    def get_output_file_path(self, post_data_path):
+        """output path (without extension) of post data of post_data_path"""
+        return post_data_path.split('.')[0] + self.output_file_suffix
+
+    def get_tracked_data_path(self, post_data_path=None):
+        """tracked data path of post_data_path (None: the current one)"""
+        data_dir, file_name = os.path.split(post_data_path or self._post_data_path)
+        return os.path.join(data_dir, self.tracked_data_dir, file_name.split('.')[0] + self.tracked_suffix + '.csv')
+
+    def save_tracked(self, data):
+        tracked_data_path = self.get_tracked_data_path()
+        if not os.path.exists(os.path.dirname(tracked_data_path)):
+            os.makedirs(os.path.dirname(tracked_data_path))
+        with profiler.stage('saver.save_tracked_data'):
+            data.to_csv(tracked_data_path, index=False)
+        logging.info('Tracked data saved at: ' + tracked_data_path)
+        return tracked_data_path
+
+    def save_track_index(self, track_index):
+        track_index.save(self.output_file_path + self.track_index_suffix + '.npz')
+
+    def save_summary(self, summary):
+        summary.to_csv(self.output_file_path + self.summary_suffix + '.csv', index=False)
+        logging.info('Summary saved at: ' + self.output_file_path + self.summary_suffix + '.csv')
+
     @property
     def post_data_path(self):
         return self._post_data_path
@@ -89,5 +140,5 @@ class PostprocessDataSaver(DataSaver):
     @post_data_path.setter
     def post_data_path(self, path):
         self._post_data_path = path
-        self.output_file_path = self._post_data_path.split('.')[0] + self.output_file_suffix
+        self.output_file_path = self.get_output_file_path(path)
         #self.excel_writer = pd.ExcelWriter(self.output_file_path + '.xlsx')
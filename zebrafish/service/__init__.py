@@ -0,0 +1 @@
+from zebrafish.service.watch_folder import WatchFolderService, process_video
@@ -0,0 +1,211 @@
+import logging
+import os
+import json
+import time
+import multiprocessing
+from glob import glob
+
+from zebrafish.pipeline import get_file_fingerprint
+from zebrafish.video import get_video_infos
+
+VIDEO_EXTENSIONS = ['mp4', 'MP4']
+
+def process_video(processor, video_path, steps):
+    """worker: incremental run of one video, outputs that are up to date are skipped"""
+    start = time.time()
+    nb_runs = processor.run_incremental([video_path], steps)
+    return {'nb_runs': nb_runs, 'elapsed_s': time.time() - start}
+
+
+class WatchFolderService(object):
+    """
+    Watches data_files_dir of processor and processes new or changed videos in a worker pool.
+
+    A video is queued once its size and mtime have not changed for stable_time_s and ffmpeg can
+    read its duration (recording finished). Queue state (queued, running, done, failed) is saved in
+    state_path after every change, videos running when the service stopped are queued again on start.
+    Failed videos are retried up to max_attempts times (until the file changes).
+    """
+    def __init__(self, processor, data_files_dir=None):
+        self.processor = processor
+        self.data_files_dir = data_files_dir or processor.data_files_dir
+        self.steps = ['detection', 'tracking', 'post']
+        self.nb_workers = 2
+        self.poll_interval_s = 5.0
+        self.stable_time_s = 30.0
+        self.max_attempts = 3
+        #metrics window (throughput of videos done within it)
+        self.metrics_window_s = 3600.0
+        self.state_path = os.path.join(self.data_files_dir, '.zebrafish_watch_state.json')
+        self.state = {'queue': [], 'running': {}, 'done': {}, 'failed': {}}
+        self._candidates = {} #path -> (fingerprint, stable since)
+        self._results = {} #path -> AsyncResult
+        self._pool = None
+        self._stopped = False
+        self._start_time = None
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as f:
+            state = json.load(f)
+        #interrupted runs are queued first
+        state['queue'] = [r for p, r in sorted(state['running'].items(), key=lambda x: x[1]['queued'])] + state['queue']
+        state['running'] = {}
+        self.state = state
+        logging.info('Watch state loaded, queued: {}, done: {}, failed: {}'.format(
+            len(state['queue']), len(state['done']), len(state['failed'])))
+
+    def save_state(self):
+        state = dict(self.state, metrics=self.get_metrics())
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def get_video_paths(self):
+        return sorted(p for p in glob(os.path.join(self.data_files_dir, '*.*'))
+                      if p.split('.')[-1] in VIDEO_EXTENSIONS)
+
+    def is_readable(self, video_path):
+        """duration of a finished recording, None while it cannot be read"""
+        try:
+            duration = get_video_infos(video_path)['duration']
+        except Exception:
+            return None
+        return duration if duration > 0 else None
+
+    def is_known(self, path, fingerprint):
+        if path in self.state['running'] or any(r['path'] == path for r in self.state['queue']):
+            return True
+        done = self.state['done'].get(path)
+        if done is not None and done['fingerprint'] == fingerprint:
+            return True
+        failed = self.state['failed'].get(path)
+        return failed is not None and failed['fingerprint'] == fingerprint and failed['attempts'] >= self.max_attempts
+
+    def scan(self):
+        """queues videos that are complete, returns nb of queued videos"""
+        now = time.time()
+        nb_queued = 0
+        video_paths = self.get_video_paths()
+        for path in video_paths:
+            fingerprint = get_file_fingerprint(path)
+            if fingerprint is None or self.is_known(path, fingerprint):
+                self._candidates.pop(path, None)
+                continue
+            candidate = self._candidates.get(path)
+            if candidate is None or candidate[0] != fingerprint:
+                #new or still being written
+                self._candidates[path] = (fingerprint, now)
+                continue
+            if now - candidate[1] < self.stable_time_s or fingerprint['size'] == 0:
+                continue
+            duration = self.is_readable(path)
+            if duration is None:
+                continue
+            del self._candidates[path]
+            failed = self.state['failed'].get(path)
+            attempts = failed['attempts'] if failed is not None and failed['fingerprint'] == fingerprint else 0
+            self.state['queue'].append({'path': path, 'fingerprint': fingerprint, 'duration_s': duration,
+                                        'queued': now, 'attempts': attempts})
+            nb_queued += 1
+            logging.info('Queued: {} ({:.1f} s video)'.format(path, duration))
+        #deleted files
+        for path in list(self._candidates):
+            if path not in video_paths:
+                del self._candidates[path]
+        return nb_queued
+
+    def dispatch(self):
+        nb_started = 0
+        while len(self.state['running']) < self.nb_workers and len(self.state['queue']) > 0:
+            record = self.state['queue'].pop(0)
+            record['started'] = time.time()
+            self.state['running'][record['path']] = record
+            self._results[record['path']] = self._pool.apply_async(process_video,
+                                                                   (self.processor, record['path'], self.steps))
+            nb_started += 1
+            logging.info('Started: ' + record['path'])
+        return nb_started
+
+    def collect(self):
+        nb_finished = 0
+        for path, result in list(self._results.items()):
+            if not result.ready():
+                continue
+            del self._results[path]
+            record = self.state['running'].pop(path)
+            record['finished'] = time.time()
+            try:
+                record.update(result.get())
+            except Exception as e:
+                record['attempts'] += 1
+                record['error'] = '{}: {}'.format(type(e).__name__, e)
+                self.state['failed'][path] = record
+                logging.info('Failed ({}/{}): {}, {}'.format(record['attempts'], self.max_attempts, path, record['error']))
+                if record['attempts'] < self.max_attempts:
+                    self.state['queue'].append(record)
+            else:
+                self.state['done'][path] = record
+                self.state['failed'].pop(path, None)
+                logging.info('Done: {} in {:.1f} s'.format(path, record['elapsed_s']))
+            nb_finished += 1
+        return nb_finished
+
+    def get_metrics(self):
+        """backlog and throughput of videos done within metrics_window_s"""
+        now = time.time()
+        uptime = now - self._start_time if self._start_time is not None else 0.
+        window = min(self.metrics_window_s, uptime) if uptime > 0 else self.metrics_window_s
+        recent = [r for r in self.state['done'].values() if r['finished'] >= now - window]
+        processed_video_s = sum(r['duration_s'] for r in recent)
+        return {'uptime_s': uptime,
+                'nb_waiting': len(self._candidates),
+                'nb_queued': len(self.state['queue']),
+                'nb_running': len(self.state['running']),
+                'nb_done': len(self.state['done']),
+                'nb_failed': len([r for r in self.state['failed'].values() if r['attempts'] >= self.max_attempts]),
+                'backlog_video_s': sum(r['duration_s'] for r in self.state['queue']) +
+                                   sum(r['duration_s'] for r in self.state['running'].values()),
+                'videos_per_hour': len(recent) * 3600. / window if window > 0 else 0.,
+                #> 1: video is processed faster than it is recorded
+                'realtime_factor': processed_video_s / window if window > 0 else 0.,
+                'mean_latency_s': sum(r['finished'] - r['queued'] for r in recent) / len(recent) if recent else None}
+
+    def start(self):
+        self.load_state()
+        self._start_time = time.time()
+        self._stopped = False
+        self._pool = multiprocessing.Pool(self.nb_workers)
+        logging.info('Watching {} with {} workers'.format(self.data_files_dir, self.nb_workers))
+
+    def poll(self):
+        """one scan, collect and dispatch, saves state if anything changed"""
+        changed = self.collect() + self.scan() + self.dispatch()
+        if changed > 0:
+            self.save_state()
+            logging.info('Watch metrics: {}'.format(self.get_metrics()))
+        return changed
+
+    def stop(self):
+        self._stopped = True
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self.save_state()
+
+    def run(self, max_polls=None):
+        """polls every poll_interval_s until stop() (or max_polls polls)"""
+        self.start()
+        nb_polls = 0
+        try:
+            while not self._stopped and (max_polls is None or nb_polls < max_polls):
+                self.poll()
+                nb_polls += 1
+                time.sleep(self.poll_interval_s)
+        finally:
+            self.close()
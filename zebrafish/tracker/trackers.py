@@ -1,10 +1,11 @@
 import numpy as np
 import logging
-from tqdm import tqdm
 import pandas as pd
 from scipy.spatial import distance_matrix
 from lapsolver import solve_dense
 
+from zebrafish.utils.progress import progress
+from zebrafish.utils.profiler import profiler
 from .mokt import MultiObjectKalmanTracker
 
 class Tracker(object):
@@ -44,6 +45,8 @@ class Tracker(object):
                 if data_id != curr_id:
                     found_after[i - 1] = False
                     curr_id = data_id
+            #last row of the last id
+            found_after[-1] = False
             data_sorted['found_after'] = found_after
 
         #is new id
@@ -90,15 +93,102 @@ class Tracker(object):
         data = data_sorted.sort_values(by=['frame_num', 'id'])
         return data
 
+    def get_chunk_track_data(self, data, last_rows=None, next_data=None):
+        """
+        get_track_data of tracked rows of a chunk (frame order), diffs continue across chunks.
+        last_rows: last row of ids in previous chunks, next_data: tracked rows after this chunk
+        (a row is found after if its id has a later row in data or next_data).
+        Returns data (frame_num, id order) and the last rows of ids in next_data.
+        Rows without id are a new id each, found_after is False for them.
+        """
+        carried_names = ['id', 'frame_num'] + self.position_names + self.angle_names
+        if last_rows is None:
+            last_rows = pd.DataFrame(columns=carried_names)
+        nb_carried = len(last_rows)
+        carried = pd.concat([last_rows[carried_names], data[carried_names]], ignore_index=True)
+
+        ids = np.asarray(carried['id'], dtype=np.float64)
+        frame_nums = np.asarray(carried['frame_num'], dtype=np.float64)
+        order = np.lexsort((frame_nums, ids))
+        sorted_ids = ids[order]
+
+        #is new id (nan != nan: rows without id are new ids)
+        is_new_id = np.ones(len(order), dtype=bool)
+        is_new_id[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        is_last = np.ones(len(order), dtype=bool)
+        is_last[:-1] = is_new_id[1:]
+
+        #frame, position, angle diff
+        tracked_frame = frame_nums[order]
+        frame_diff = np.full(len(order), np.nan)
+        frame_diff[1:] = tracked_frame[1:] - tracked_frame[:-1]
+        frame_diff[is_new_id] = np.nan
+
+        tracked_position = np.asarray(carried[self.position_names], dtype=np.float64)[order]
+        position_diff = np.full((len(order), 2), np.nan)
+        position_diff[1:] = tracked_position[1:] - tracked_position[:-1]
+        position_diff[is_new_id] = np.nan
+
+        angles = np.asarray(carried[self.angle_names[0]], dtype=np.float64)[order]
+        angle_diff = np.full(len(order), np.nan)
+        angle_diff[1:] = angles[1:] - angles[:-1]
+        angle_diff = np.where(angle_diff > 180.0, angle_diff - 360.0, angle_diff)
+        angle_diff = np.where(angle_diff < -180.0, angle_diff + 360.0, angle_diff)
+        angle_diff[is_new_id] = np.nan
+
+        #sorted rows of this chunk -> data rows
+        in_chunk = order >= nb_carried
+        data_rows = order[in_chunk] - nb_carried
+        data = data.reset_index(drop=True)
+        track_columns = {'is_new_id': is_new_id,
+                         'frame_diff': frame_diff,
+                         'pos_diff_x': position_diff[:, 0],
+                         'pos_diff_y': position_diff[:, 1],
+                         'pos_dist': np.linalg.norm(position_diff, axis=-1),
+                         'rel_angle_deg_diff': angle_diff}
+        if next_data is None:
+            next_ids = np.empty(0)
+        else:
+            next_ids = np.unique(np.asarray(next_data['id'], dtype=np.float64))
+        if not 'found_after' in data.columns:
+            track_columns['found_after'] = ~is_last | (is_last & np.isin(sorted_ids, next_ids))
+        for name in ['found_after', 'is_new_id', 'frame_diff', 'pos_diff_x', 'pos_diff_y', 'pos_dist', 'rel_angle_deg_diff']:
+            if name in track_columns:
+                values = np.empty(len(data), dtype=track_columns[name].dtype)
+                values[data_rows] = track_columns[name][in_chunk]
+                data[name] = values
+
+        #last rows of ids that continue in next_data
+        last_idx = order[is_last & np.isin(sorted_ids, next_ids)]
+        last_rows = carried.iloc[last_idx].reset_index(drop=True)
+
+        data = data.sort_values(by=['frame_num', 'id'])
+        return data, last_rows
+
     def initialize(self):
         pass
 
+    def get_settings(self):
+        """parameters that change tracking results"""
+        return {}
+
+    def get_nb_context_frames(self):
+        """number of frames (with detections) within which an id can be found again"""
+        return 0
+
     def get_id(self, data, start_frame_num, end_frame_num, frame_idx):
         pass
 
     def track(self, data, frame_cut=(0, None)):
         pass
 
+    def track_chunk(self, data, nb_tracked_frames=0):
+        """
+        Assigns ids to rows (frame order, index from 0) of a chunk, tracker state is kept between chunks.
+        The first nb_tracked_frames frames of data are tracked rows from the previous chunk.
+        """
+        pass
+
 class VicinityTracker(Tracker):
 
     def __init__(self,
@@ -114,22 +204,38 @@ class VicinityTracker(Tracker):
     def initialize(self):
         self.new_id = 0
 
-    def get_id(self, data, start_frame_num, end_frame_num, frame_idx):
-        #initialize columns
-        new_col = np.full_like(data['frame_num'], np.nan, dtype=np.float)
-        for name in self.new_col_names[:2]:
-            data[name] = new_col
-
-        #first frame
-        current_frame_idx = frame_idx[start_frame_num]
-        next_frame_idx = frame_idx[start_frame_num + 1]
-        first_frame_ids = np.arange(next_frame_idx)
-
-        self.new_id = first_frame_ids[-1] + 1
-        data.loc[current_frame_idx:next_frame_idx - 1, 'id'] = first_frame_ids
+    def get_settings(self):
+        return {'nb_frames_to_find': self.nb_frames_to_find,
+                'max_dist': self.max_dist,
+                'max_dist_inc_ratio': self.max_dist_inc_ratio}
+
+    def get_nb_context_frames(self):
+        return self.nb_frames_to_find
+
+    def get_id(self, data, start_frame_num, end_frame_num, frame_idx, nb_tracked_frames=0):
+        if nb_tracked_frames == 0:
+            #initialize columns
+            new_col = np.full_like(data['frame_num'], np.nan, dtype=np.float)
+            for name in self.new_col_names[:2]:
+                data[name] = new_col
+
+            #first frame
+            current_frame_idx = frame_idx[start_frame_num]
+            next_frame_idx = frame_idx[start_frame_num + 1]
+            first_frame_ids = np.arange(next_frame_idx)
+
+            self.new_id = first_frame_ids[-1] + 1
+            data.loc[current_frame_idx:next_frame_idx - 1, 'id'] = first_frame_ids
+            track_start_frame_num = start_frame_num + 1
+        else:
+            #frames before track_start_frame_num are tracked (previous chunk)
+            track_start_frame_num = start_frame_num + nb_tracked_frames
+            for name in self.new_col_names[:2]:
+                data.loc[frame_idx[track_start_frame_num]:, name] = np.nan
 
         #track
-        for current_frame in tqdm(range(start_frame_num + 1, end_frame_num)):
+        for current_frame in progress.iterate(range(track_start_frame_num, end_frame_num), 'tracking',
+                                              total=end_frame_num - track_start_frame_num):
             current_data_idx_start = frame_idx[current_frame]
             current_data_idx_end = frame_idx[current_frame + 1] - 1
             current_data = data.loc[current_data_idx_start:current_data_idx_end]
@@ -177,12 +283,19 @@ class VicinityTracker(Tracker):
 
         #track
         #id
-        data = self.get_id(data, start_frame_num, end_frame_num, frame_idx)
+        with profiler.stage('tracker.get_id'):
+            data = self.get_id(data, start_frame_num, end_frame_num, frame_idx)
 
         #data from tracking
-        data = self.get_track_data(data)
+        with profiler.stage('tracker.get_track_data'):
+            data = self.get_track_data(data)
         return data
 
+    def track_chunk(self, data, nb_tracked_frames=0):
+        frame_idx = self.get_frame_idx(data)
+        with profiler.stage('tracker.get_id'):
+            return self.get_id(data, 0, len(frame_idx) - 1, frame_idx, nb_tracked_frames)
+
 class KalmanTracker(Tracker):
 
     def __init__(self,
@@ -197,10 +310,20 @@ class KalmanTracker(Tracker):
     def initialize(self):
         self.mokt.initialize()
 
+    def get_settings(self):
+        return {'max_age': self.mokt.max_age,
+                'min_hits': self.mokt.min_hits,
+                'distance_threshold': self.mokt.distance_threshold}
+
+    def get_nb_context_frames(self):
+        #a track is removed after max_age frames without update
+        return self.mokt.max_age + 1
+
     def get_id(self, data, start_frame_num, end_frame_num, frame_idx):
         tracked_result_list = []
 
-        for current_frame in tqdm(range(start_frame_num, end_frame_num)):
+        for current_frame in progress.iterate(range(start_frame_num, end_frame_num), 'tracking',
+                                              total=end_frame_num - start_frame_num):
             current_data_idx_start = frame_idx[current_frame]
             current_data_idx_end = frame_idx[current_frame + 1] - 1
             current_data = data.loc[current_data_idx_start:current_data_idx_end]
@@ -228,8 +351,20 @@ class KalmanTracker(Tracker):
 
         #track
         #id
-        data = self.get_id(data, start_frame_num, end_frame_num, frame_idx)
+        with profiler.stage('tracker.get_id'):
+            data = self.get_id(data, start_frame_num, end_frame_num, frame_idx)
 
         #data from tracking
-        data = self.get_track_data(data)
+        with profiler.stage('tracker.get_track_data'):
+            data = self.get_track_data(data)
         return data
+
+    def track_chunk(self, data, nb_tracked_frames=0):
+        frame_idx = self.get_frame_idx(data)
+        nb_tracked_rows = frame_idx[nb_tracked_frames]
+        if nb_tracked_rows == len(data):
+            return data
+        new_data = data.iloc[nb_tracked_rows:].reset_index(drop=True)
+        with profiler.stage('tracker.get_id'):
+            new_data = self.get_id(new_data, 0, len(frame_idx) - 1 - nb_tracked_frames, self.get_frame_idx(new_data))
+        return pd.concat([data.iloc[:nb_tracked_rows], new_data], ignore_index=True, sort=False)
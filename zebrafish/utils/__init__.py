@@ -1 +1,5 @@
 from zebrafish.utils.utils import convert_angle
+from zebrafish.utils.label_atlas import LabelAtlas, get_nb_label_lines
+from zebrafish.utils.preview_images import PreviewImageEncoder
+from zebrafish.utils.profiler import Profiler, profiler
+from zebrafish.utils.progress import ProgressReporter, progress
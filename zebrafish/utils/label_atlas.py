@@ -0,0 +1,152 @@
+import numpy as np
+import cv2
+from collections import OrderedDict
+
+class LabelAtlas(object):
+    """
+    Overlay text compositor.
+
+    Every glyph is rasterized once with cv2.putText into a single-row atlas
+    (one slot per glyph, slot width = glyph advance). A label mask is the
+    gather of its glyph columns from the atlas, cached per label string, and
+    is blitted with one masked copy instead of rasterizing the string again.
+    """
+    def __init__(self,
+                 font_size=1.0,
+                 thickness=2,
+                 font=cv2.FONT_HERSHEY_SIMPLEX,
+                 characters='0123456789.,:- +?IDnanposvelcgidx',
+                 max_cached_labels=4096):
+        self.font_size = font_size
+        self.thickness = thickness
+        self.font = font
+        self.max_cached_labels = max_cached_labels
+        self.characters = ''
+        #character code -> glyph index
+        self.char_lut = np.full(256, -1, dtype=np.int64)
+        self.slot_starts = np.zeros(1, dtype=np.int64)
+        self.atlas = np.zeros((0, 0), dtype=np.uint8)
+        self.ascent = 0
+        self._label_masks = OrderedDict()
+        self._color_strips = {}
+        self.add_characters(characters)
+
+    def add_characters(self, characters):
+        new_characters = ''.join(sorted(set(c for c in characters if ord(c) < 256) - set(self.characters)))
+        if len(new_characters) == 0:
+            return
+        self.characters += new_characters
+        self.build()
+
+    def build(self):
+        size, baseline = cv2.getTextSize(self.characters, self.font, self.font_size, self.thickness)
+        self.ascent = size[1] + self.thickness
+        atlas_height = self.ascent + baseline + self.thickness
+
+        #advance of a glyph: width difference of doubled and single glyph
+        advances = [cv2.getTextSize(c * 2, self.font, self.font_size, self.thickness)[0][0] -
+                    cv2.getTextSize(c, self.font, self.font_size, self.thickness)[0][0]
+                    for c in self.characters]
+        slot_starts = np.concatenate([[0], np.cumsum(advances)]).astype(np.int64)
+
+        atlas = np.zeros((atlas_height, slot_starts[-1]), dtype=np.uint8)
+        for i, c in enumerate(self.characters):
+            glyph = np.zeros((atlas_height, advances[i] + 2 * self.thickness), dtype=np.uint8)
+            cv2.putText(glyph, c, (0, self.ascent), self.font, self.font_size, 255, self.thickness)
+            atlas[:, slot_starts[i]:slot_starts[i + 1]] = glyph[:, :advances[i]]
+
+        self.atlas = atlas
+        self.slot_starts = slot_starts
+        self.char_lut[:] = -1
+        for i, c in enumerate(self.characters):
+            self.char_lut[ord(c)] = i
+        self._label_masks.clear()
+        self._color_strips.clear()
+
+    def get_label_masks(self, texts):
+        """label masks of texts, uncached labels are composed with one atlas gather"""
+        masks = [self._label_masks.get(text) for text in texts]
+        new_texts = list(OrderedDict.fromkeys(text for text, mask in zip(texts, masks) if mask is None))
+        if len(new_texts) == 0:
+            return masks
+
+        chars = ''.join(new_texts)
+        codes = np.frombuffer(chars.encode('latin-1', 'replace'), dtype=np.uint8)
+        glyph_idxs = self.char_lut[codes]
+        if np.any(glyph_idxs < 0):
+            self.add_characters(chars)
+            glyph_idxs = self.char_lut[codes]
+
+        #atlas columns of every glyph of every new label
+        starts = self.slot_starts[glyph_idxs]
+        widths = self.slot_starts[glyph_idxs + 1] - starts
+        width_starts = np.cumsum(widths) - widths
+        columns = np.repeat(starts - width_starts, widths) + np.arange(widths.sum())
+        composed = self.atlas[:, columns]
+
+        #split composed masks by label
+        char_ends = np.cumsum([len(text) for text in new_texts])
+        label_ends = np.concatenate([width_starts, [widths.sum()]])[char_ends].tolist()
+        new_masks = {}
+        label_start = 0
+        for text, label_end in zip(new_texts, label_ends):
+            new_masks[text] = composed[:, label_start:label_end]
+            self._label_masks[text] = new_masks[text]
+            label_start = label_end
+        while len(self._label_masks) > self.max_cached_labels:
+            self._label_masks.popitem(last=False)
+        return [new_masks[text] if mask is None else mask for text, mask in zip(texts, masks)]
+
+    def get_color_strip(self, color, width):
+        strip = self._color_strips.get(color)
+        if strip is None or strip.shape[1] < width:
+            strip = np.empty((self.atlas.shape[0], max(width, 512), 3), dtype=np.uint8)
+            strip[:] = color
+            self._color_strips[color] = strip
+        return strip
+
+    def draw_texts(self, img, texts, orgs, color):
+        """same placement as cv2.putText: org is the bottom left of the text baseline"""
+        color = tuple(int(c) for c in color)
+        masks = self.get_label_masks(texts)
+        strip = self.get_color_strip(color, max([mask.shape[1] for mask in masks] + [1]))
+        img_height, img_width = img.shape[:2]
+        for mask, org in zip(masks, orgs):
+            x_start = int(org[0])
+            y_start = int(org[1]) - self.ascent
+
+            #clip label to the image
+            mask_x_start = max(0, -x_start)
+            mask_y_start = max(0, -y_start)
+            mask_x_end = min(mask.shape[1], img_width - x_start)
+            mask_y_end = min(mask.shape[0], img_height - y_start)
+            if mask_x_end <= mask_x_start or mask_y_end <= mask_y_start:
+                continue
+            #masked copy of the color strip into the label region
+            cv2.add(strip[mask_y_start:mask_y_end, mask_x_start:mask_x_end], (0, 0, 0, 0),
+                    dst=img[y_start + mask_y_start:y_start + mask_y_end,
+                            x_start + mask_x_start:x_start + mask_x_end],
+                    mask=mask[mask_y_start:mask_y_end, mask_x_start:mask_x_end])
+        return img
+
+    def draw_text(self, img, text, org, color):
+        return self.draw_texts(img, [text], [org], color)
+
+
+def get_nb_label_lines(nb_lines, label_density='full', frame_num=0, label_every_n_frames=1):
+    """
+    Number of label lines to draw for one object.
+      full: every line.
+      ids: first line only (ID in post video, position in detection video).
+      every_n: every line on every n-th frame, first line only in between.
+    """
+    if label_density == 'full':
+        return nb_lines
+    elif label_density == 'ids':
+        return min(1, nb_lines)
+    elif label_density == 'every_n':
+        if frame_num % max(1, int(label_every_n_frames)) == 0:
+            return nb_lines
+        return min(1, nb_lines)
+    else:
+        raise ValueError('Unknown label density: {}'.format(label_density))
@@ -0,0 +1,56 @@
+import numpy as np
+import cv2
+import base64
+import hashlib
+from collections import OrderedDict
+
+class PreviewImageEncoder(object):
+    """
+    Downsamples preview images to the display size and encodes them as data URIs.
+    Encoded images are cached (LRU) on the content of the downsampled image,
+    so showing the same preview again does not re-encode it.
+    image_format: 'auto' (png for single channel images, jpeg for color images), 'png' or 'jpeg'.
+    """
+    def __init__(self, image_format='auto', jpeg_quality=85, max_cached_images=64):
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.max_cached_images = max_cached_images
+        self._data_uris = OrderedDict()
+
+    def downsample(self, img, scale_factor=1.0):
+        height, width = img.shape[:2]
+        size = (max(1, int(round(width * scale_factor))), max(1, int(round(height * scale_factor))))
+        if size == (width, height):
+            return np.ascontiguousarray(img)
+        return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+    def get_image_format(self, img):
+        if self.image_format != 'auto':
+            return self.image_format
+        #single channel steps (gray, binary) compress well without loss
+        return 'png' if img.ndim == 2 else 'jpeg'
+
+    def encode(self, img, scale_factor=1.0):
+        """data URI of img downsampled by scale_factor (RGB or single channel uint8)"""
+        small_img = self.downsample(np.asarray(img, dtype=np.uint8), scale_factor)
+        image_format = self.get_image_format(small_img)
+        key = (hashlib.sha1(small_img.data).hexdigest(), small_img.shape, image_format)
+        data_uri = self._data_uris.get(key)
+        if data_uri is not None:
+            self._data_uris.move_to_end(key)
+            return data_uri
+
+        if small_img.ndim == 3:
+            small_img = cv2.cvtColor(small_img, cv2.COLOR_RGB2BGR)
+        if image_format == 'jpeg':
+            _, buf = cv2.imencode('.jpg', small_img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        elif image_format == 'png':
+            _, buf = cv2.imencode('.png', small_img)
+        else:
+            raise ValueError('Unknown image format: {}'.format(image_format))
+        data_uri = 'data:image/{};base64,'.format(image_format) + base64.b64encode(buf.tobytes()).decode('ascii')
+
+        self._data_uris[key] = data_uri
+        while len(self._data_uris) > self.max_cached_images:
+            self._data_uris.popitem(last=False)
+        return data_uri
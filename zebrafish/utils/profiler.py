@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import logging
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class Profiler(object):
+    """
+    Opt-in stage instrumentation: wall time, call count and peak memory of each stage.
+    Stages are timed with `with profiler.stage(name):`, which does nothing until start().
+    Peak memory (trace_memory) is the peak of traced allocations (python and numpy) above
+    the memory in use when the stage started, it slows down processing.
+    Stages run in worker processes (parallel rendering, preview sampling) are not recorded.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+        self.start_time = None
+        self.end_time = None
+        self._memory_stack = []
+
+    def start(self, trace_memory=False):
+        self.reset()
+        self.enabled = True
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.start_time = time.time()
+        logging.info('Profiling started, trace memory: {}'.format(trace_memory))
+
+    def stop(self):
+        self.enabled = False
+        self.end_time = time.time()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _update_memory_peaks(self):
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self._memory_stack:
+            frame['peak'] = max(frame['peak'], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return current
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        trace_memory = self.trace_memory and tracemalloc.is_tracing()
+        if trace_memory:
+            current = self._update_memory_peaks()
+            self._memory_stack.append({'start': current, 'peak': current})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak_memory = 0
+            if trace_memory:
+                self._update_memory_peaks()
+                frame = self._memory_stack.pop()
+                peak_memory = frame['peak'] - frame['start']
+            self.add(name, elapsed, peak_memory)
+
+    def add(self, name, elapsed, peak_memory=0):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = {'count': 0, 'total_s': 0., 'max_s': 0., 'peak_memory_bytes': 0}
+            self.stats[name] = stat
+        stat['count'] += 1
+        stat['total_s'] += elapsed
+        stat['max_s'] = max(stat['max_s'], elapsed)
+        stat['peak_memory_bytes'] = max(stat['peak_memory_bytes'], peak_memory)
+
+    def get_report(self):
+        end_time = time.time() if self.end_time is None else self.end_time
+        return {'start_time': self.start_time,
+                'wall_time_s': None if self.start_time is None else end_time - self.start_time,
+                'trace_memory': self.trace_memory,
+                'stages': self.stats}
+
+    def save_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.get_report(), f, indent=2)
+        logging.info('Profile report saved at: ' + path)
+
+    def get_summary(self):
+        """stats table sorted by total time, share: part of the run wall time (nested stages overlap)"""
+        report = self.get_report()
+        rows = []
+        for name, stat in self.stats.items():
+            rows.append({'stage': name,
+                         'count': stat['count'],
+                         'total_s': stat['total_s'],
+                         'mean_ms': 1000. * stat['total_s'] / stat['count'],
+                         'max_ms': 1000. * stat['max_s'],
+                         'share': stat['total_s'] / report['wall_time_s'] if report['wall_time_s'] else np.nan,
+                         'peak_memory_mb': stat['peak_memory_bytes'] / 2.**20})
+        columns = ['stage', 'count', 'total_s', 'mean_ms', 'max_ms', 'share', 'peak_memory_mb']
+        return pd.DataFrame(rows, columns=columns).sort_values(by='total_s', ascending=False).reset_index(drop=True)
+
+#shared profiler of the pipeline
+profiler = Profiler()
@@ -0,0 +1,92 @@
+import logging
+import time
+
+class ProgressTask(object):
+    """
+    Progress of one loop (stage). update() only counts frames and compares the time,
+    listeners get at most one event every reporter.min_interval_s.
+    """
+    def __init__(self, reporter, stage, total=None):
+        self.reporter = reporter
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.start_time = time.perf_counter()
+        self._next_emit_time = self.start_time + reporter.min_interval_s
+
+    def update(self, n=1):
+        self.done += n
+        if self.reporter.listeners:
+            now = time.perf_counter()
+            if now >= self._next_emit_time:
+                self._next_emit_time = now + self.reporter.min_interval_s
+                self.reporter.emit(self.get_event(now))
+
+    def get_event(self, now=None, finished=False):
+        now = now or time.perf_counter()
+        elapsed = now - self.start_time
+        fps = self.done / elapsed if elapsed > 0 else None
+        eta = None
+        if self.total is not None and fps:
+            eta = max(0., self.total - self.done) / fps
+        event = dict(self.reporter.context)
+        event.update({'type': 'progress',
+                      'stage': self.stage,
+                      'done': self.done,
+                      'total': self.total,
+                      'fps': fps,
+                      'elapsed_s': elapsed,
+                      'eta_s': 0. if finished else eta,
+                      'finished': finished})
+        return event
+
+    def close(self):
+        if self.reporter.listeners:
+            self.reporter.emit(self.get_event(finished=True))
+
+
+class ProgressReporter(object):
+    """
+    Throttled progress events of the detection, tracking and rendering loops:
+    stage, frames done, total, fps and ETA. Events are dicts sent to listeners
+    (functions, e.g. a queue of the notebook server job workers), context is added to every event.
+    show_bars: tqdm bars in the terminal / notebook (off for headless workers).
+    """
+    def __init__(self):
+        self.listeners = []
+        self.min_interval_s = 0.5
+        self.show_bars = True
+        self.context = {}
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def emit(self, event):
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                #progress must not stop processing
+                logging.warning('Progress listener failed: {}'.format(e))
+
+    def task(self, stage, total=None):
+        return ProgressTask(self, stage, total)
+
+    def iterate(self, iterable, stage, total=None, show_bar=True):
+        """yields items of iterable, counting each as one frame of stage"""
+        task = self.task(stage, total)
+        if show_bar and self.show_bars:
+            from tqdm import tqdm
+            iterable = tqdm(iterable, total=total, mininterval=self.min_interval_s)
+        try:
+            for item in iterable:
+                yield item
+                task.update()
+        finally:
+            task.close()
+
+progress = ProgressReporter()
@@ -0,0 +1,3 @@
+from zebrafish.video.video_writers import FFmpegVideoWriter, ENCODING_PRESETS, get_encoding_settings
+from zebrafish.video.video_readers import FFmpegVideoReader, get_video_infos, get_scaled_size
+from zebrafish.video.video_rendering import split_frame_range, render_video_segment, concat_videos
@@ -0,0 +1,108 @@
+import numpy as np
+import subprocess
+import tempfile
+
+from zebrafish.video.video_writers import get_ffmpeg_binary
+from zebrafish.utils.profiler import profiler
+
+def get_video_infos(video_path):
+    """size (width, height), fps, nb_frames (estimated from duration) and duration of a video"""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    infos = ffmpeg_parse_infos(video_path)
+    return {'size': tuple(infos['video_size']),
+            'fps': infos['video_fps'],
+            'nb_frames': infos['video_nframes'],
+            'duration': infos['duration']}
+
+def get_scaled_size(size, scale):
+    """(width, height) scaled and rounded to even sizes (h264 yuv420p), same size if scale is 1"""
+    if scale == 1:
+        return tuple(size)
+    return tuple(max(2, int(round(s * scale / 2.)) * 2) for s in size)
+
+
+class FFmpegVideoReader(object):
+    """
+    Decodes frames sequentially (no resampling) from an ffmpeg subprocess.
+    Frames are yielded with their integer frame index in the source video.
+
+    scale: frames are downscaled by the decoder (e.g. 0.5, 0.25), see get_scaled_size.
+    stride: only every stride-th frame (counted from start_frame) is decoded to output.
+    """
+    def __init__(self, video_path, start_frame=0, end_frame=None, scale=1.0, stride=1):
+        self.video_path = video_path
+        self.start_frame = start_frame
+        self.end_frame = end_frame #exclusive, None: until the end of the video
+        self.scale = scale
+        self.stride = max(1, int(stride))
+        infos = get_video_infos(video_path)
+        self.source_size = infos['size']
+        self.fps = infos['fps']
+        self.nb_frames = infos['nb_frames']
+        self.size = get_scaled_size(self.source_size, scale)
+        self.proc = None
+        self._log_file = None
+
+    def get_command(self):
+        cmd = [get_ffmpeg_binary(), '-loglevel', 'error']
+        if self.start_frame > 0:
+            #accurate seek: frames before (start_frame - 0.5) / fps are decoded and dropped
+            cmd += ['-ss', '{:.6f}'.format((self.start_frame - 0.5) / self.fps)]
+        cmd += ['-i', self.video_path, '-an', '-vsync', '0']
+        filters = []
+        if self.stride > 1:
+            filters.append('select=not(mod(n\\,{}))'.format(self.stride))
+        if self.size != self.source_size:
+            filters.append('scale={}:{}:flags=area'.format(self.size[0], self.size[1]))
+        if len(filters) > 0:
+            cmd += ['-vf', ','.join(filters)]
+        if self.end_frame is not None:
+            cmd += ['-frames:v', str(self.get_nb_output_frames())]
+        cmd += ['-f', 'image2pipe', '-pix_fmt', 'rgb24', '-vcodec', 'rawvideo', '-']
+        return cmd
+
+    def get_nb_output_frames(self):
+        end_frame = self.nb_frames if self.end_frame is None else self.end_frame
+        return max(0, -(-(end_frame - self.start_frame) // self.stride))
+
+    def open(self):
+        self._log_file = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(self.get_command(), stdout=subprocess.PIPE,
+                                     stderr=self._log_file, bufsize=10**8)
+        return self
+
+    def read_frame(self):
+        """next decoded frame, None at the end of the video"""
+        frame = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        with profiler.stage('video.decode'):
+            nb_bytes = self.proc.stdout.readinto(memoryview(frame).cast('B'))
+        if nb_bytes < frame.nbytes:
+            return None
+        return frame
+
+    def iter_frames(self):
+        if self.proc is None:
+            self.open()
+        frame_num = self.start_frame
+        try:
+            while self.end_frame is None or frame_num < self.end_frame:
+                frame = self.read_frame()
+                if frame is None:
+                    break
+                yield frame_num, frame
+                frame_num += self.stride
+        finally:
+            self.close()
+
+    def close(self):
+        if self.proc is None:
+            return
+        self.proc.stdout.close()
+        self.proc.terminate()
+        self.proc.wait()
+        self._log_file.close()
+        self.proc = None
+        self._log_file = None
+
+    def __iter__(self):
+        return self.iter_frames()
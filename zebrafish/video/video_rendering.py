@@ -0,0 +1,58 @@
+import numpy as np
+import os
+import logging
+import subprocess
+
+from zebrafish.video.video_writers import FFmpegVideoWriter, get_ffmpeg_binary, get_encoding_settings
+from zebrafish.video.video_readers import FFmpegVideoReader
+from zebrafish.utils.progress import progress
+
+def split_frame_range(nb_frames, nb_segments, stride=1):
+    """[start, end) frame ranges of (nearly) equal length, starts are multiples of stride"""
+    nb_segments = max(1, min(int(nb_segments), nb_frames))
+    bounds = np.linspace(0, nb_frames, nb_segments + 1)
+    bounds = (np.round(bounds / stride) * stride).astype(np.int64)
+    bounds[-1] = nb_frames
+    return [(bounds[i], bounds[i + 1]) for i in range(nb_segments) if bounds[i + 1] > bounds[i]]
+
+def render_video_segment(render_frame, video_path, segment_path, start_frame=0, end_frame=None,
+                         encoding_settings=None, show_progress=False, scale=1.0, stride=1):
+    """
+    Renders decoded frames [start_frame, end_frame) with its own reader and streams them to segment_path.
+    render_frame(frame, frame_num) gets the integer frame index of the source video.
+    With stride, output fps is the source fps / stride (same duration as the source).
+    Segments rendered with the same encoding settings can be concatenated without re-encoding.
+    """
+    if encoding_settings is None:
+        encoding_settings = get_encoding_settings()
+    reader = FFmpegVideoReader(video_path, start_frame, end_frame, scale=scale, stride=stride)
+    total = reader.get_nb_output_frames()
+    writer = None
+    try:
+        for frame_num, frame in progress.iterate(reader.iter_frames(), 'render', total=total, show_bar=show_progress):
+            out_frame = render_frame(frame, frame_num)
+            if writer is None:
+                writer = FFmpegVideoWriter(segment_path, (out_frame.shape[1], out_frame.shape[0]),
+                                           reader.fps / reader.stride, **encoding_settings)
+            writer.write_frame(out_frame)
+    finally:
+        if writer is not None:
+            writer.close()
+        reader.close()
+    return segment_path
+
+def concat_videos(segment_paths, output_path):
+    """joins segments with the ffmpeg concat demuxer (stream copy, no re-encoding)"""
+    list_path = output_path + '_segments.txt'
+    with open(list_path, 'w') as f:
+        for p in segment_paths:
+            f.write("file '{}'\n".format(os.path.abspath(p).replace("'", "'\\''")))
+    cmd = [get_ffmpeg_binary(), '-y', '-loglevel', 'error',
+           '-f', 'concat', '-safe', '0', '-i', list_path,
+           '-c', 'copy', output_path]
+    try:
+        subprocess.check_call(cmd)
+    finally:
+        os.remove(list_path)
+    logging.info('Concatenated {} segments at: {}'.format(len(segment_paths), output_path))
+    return output_path
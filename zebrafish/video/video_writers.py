@@ -0,0 +1,120 @@
+import numpy as np
+import logging
+import subprocess
+import tempfile
+
+from zebrafish.utils.profiler import profiler
+
+
+def get_ffmpeg_binary():
+    try:
+        from moviepy.config import get_setting
+        return get_setting('FFMPEG_BINARY')
+    except:
+        return 'ffmpeg'
+
+#named encoding presets (threads 0: ffmpeg picks the thread count)
+ENCODING_PRESETS = {
+    #same as moviepy's write_videofile defaults (x264 default crf)
+    'default': {'codec': 'libx264', 'preset': 'medium', 'crf': 23, 'pix_fmt': 'yuv420p', 'threads': None},
+    #quick look at tracking results, small encode time
+    'fast_qa': {'codec': 'libx264', 'preset': 'ultrafast', 'crf': 28, 'pix_fmt': 'yuv420p', 'threads': 0},
+    #visually lossless, slower encode and larger files
+    'archive': {'codec': 'libx264', 'preset': 'slow', 'crf': 17, 'pix_fmt': 'yuv420p', 'threads': 0},
+}
+
+def get_encoding_settings(preset_name='default', **overrides):
+    if preset_name not in ENCODING_PRESETS:
+        raise ValueError('Unknown encoding preset: {}, available: {}'.format(preset_name, list(ENCODING_PRESETS)))
+    settings = dict(ENCODING_PRESETS[preset_name])
+    settings.update(dict((k, v) for k, v in overrides.items() if v is not None))
+    return settings
+
+
+class FFmpegVideoWriter(object):
+    """
+    Streams uint8 RGB frames into an ffmpeg subprocess.
+    """
+    def __init__(self, output_path, size, fps,
+                 codec='libx264',
+                 preset='medium',
+                 crf=23,
+                 pix_fmt='yuv420p',
+                 threads=None):
+        self.output_path = output_path
+        self.size = size #(width, height)
+        self.fps = fps
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.pix_fmt = pix_fmt
+        self.threads = threads
+        self.nb_frames = 0
+        self.proc = None
+        self._log_file = None
+
+    def get_command(self):
+        cmd = [get_ffmpeg_binary(), '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-vcodec', 'rawvideo',
+               '-s', '{}x{}'.format(self.size[0], self.size[1]),
+               '-pix_fmt', 'rgb24',
+               '-r', '{}'.format(self.fps),
+               '-an', '-i', '-',
+               '-vcodec', self.codec]
+        if self.preset is not None:
+            cmd += ['-preset', self.preset]
+        if self.crf is not None:
+            cmd += ['-crf', str(self.crf)]
+        if self.threads is not None:
+            cmd += ['-threads', str(self.threads)]
+        if self.pix_fmt is not None:
+            cmd += ['-pix_fmt', self.pix_fmt]
+        cmd += [self.output_path]
+        return cmd
+
+    def open(self):
+        if self.pix_fmt == 'yuv420p' and (self.size[0] % 2 or self.size[1] % 2):
+            raise ValueError('yuv420p needs even frame sizes, got: {}x{}'.format(self.size[0], self.size[1]))
+        self._log_file = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(self.get_command(), stdin=subprocess.PIPE,
+                                     stdout=subprocess.DEVNULL, stderr=self._log_file)
+        return self
+
+    def write_frame(self, frame):
+        if self.proc is None:
+            self.open()
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.shape != (self.size[1], self.size[0], 3):
+            raise ValueError('Frame shape {} does not match writer size {}'.format(frame.shape, self.size))
+        try:
+            #blocks while ffmpeg encodes
+            with profiler.stage('video.encode'):
+                self.proc.stdin.write(frame.data)
+        except (IOError, OSError):
+            raise IOError('ffmpeg error while writing {}:\n{}'.format(self.output_path, self.get_log()))
+        self.nb_frames += 1
+
+    def get_log(self):
+        if self._log_file is None:
+            return ''
+        self._log_file.seek(0)
+        return self._log_file.read().decode(errors='replace')
+
+    def close(self):
+        if self.proc is None:
+            return
+        self.proc.stdin.close()
+        return_code = self.proc.wait()
+        log = self.get_log()
+        self._log_file.close()
+        self.proc = None
+        self._log_file = None
+        if return_code != 0:
+            raise IOError('ffmpeg exited with {} for {}:\n{}'.format(return_code, self.output_path, log))
+        logging.info('Wrote {} frames at: {}'.format(self.nb_frames, self.output_path))
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()